@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cleaning of bibitems: per-item and batched ``delatex`` against
+the pure-Python converter.
+
+Outputs of all the backends are compared on the corpus and the bibitems on
+which the pure-Python one differs from ``delatex`` are reported. ``delatex``
+runs are skipped if ``opendetex`` is not built. ``tests/test_bbl.py`` checks
+both backends against the hand-written expected outputs of the fixtures.
+
+Usage: ``python3 -m benchmarks.clean_bibitems [BBL_FILE] [REPEAT]``.
+"""
+import os
+import sys
+import time
+
+from reference_fetcher import bbl
+
+
+def load_bibitems(bbl_file, repeat):
+    """
+    Load the raw bibitems of a ``.bbl`` file, repeated ``repeat`` times.
+    """
+    return list(bbl.iter_bibitems(bbl_file)) * repeat
+
+
+def run(name, clean, bibitems):
+    """
+    Time a cleaning function over the list of bibitems and print a report.
+    """
+    start = time.perf_counter()
+    result = clean(bibitems)
+    elapsed = time.perf_counter() - start
+    print("%-10s %6d bibitems in %8.3fs: %10.1f bibitems/s" % (
+        name, len(bibitems), elapsed, len(bibitems) / elapsed))
+    return result
+
+
+if __name__ == "__main__":
+    bbl_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures", "sample.bbl")
+    repeat = 10
+    if len(sys.argv) > 1:
+        bbl_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        repeat = int(sys.argv[2])
+    bibitems = load_bibitems(bbl_file, repeat)
+
+    python = run("python", bbl.clean_bibitems_python, bibitems)
+    delatex_path = os.path.join(os.path.dirname(os.path.abspath(bbl.__file__)),
+                                "opendetex", "delatex")
+    if not os.path.isfile(delatex_path):
+        print("%s not found, skipping delatex backend." % (delatex_path,))
+        sys.exit()
+
+    per_item = run("per-item",
+                   lambda items: [bbl.clean_bibitem(i) for i in items],
+                   bibitems)
+    batched = run("batched", bbl.clean_bibitems, bibitems)
+    if per_item != batched:
+        sys.exit("Batched output differs from per-item output.")
+    mismatches = [(i, j) for i, j in zip(per_item, python) if i != j]
+    for expected, got in mismatches:
+        print("delatex: %s\npython:  %s\n" % (expected, got))
+    print("python agrees with delatex on %d/%d bibitems." % (
+        len(bibitems) - len(mismatches), len(bibitems)))
+    if mismatches:
+        sys.exit(1)
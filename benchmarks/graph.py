@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark the traversals of the in-memory relationships graph (``graph.py``)
+against the same breadth-first traversals issuing one indexed SQL query per
+paper.
+
+A file-backed SQLite database is filled with random ``cite`` edges, the
+graph is loaded from it, and k-hop neighbourhoods, shortest paths and
+incremental updates are timed.
+
+Usage: ``python3 -m benchmarks.graph --help``.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import database
+import graph
+
+
+def fill(engine, papers, edges):
+    """
+    Fill the database with papers and random ``cite`` edges.
+    """
+    database.Base.metadata.create_all(engine)
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO relationships (id, name) "
+                                "VALUES (1, 'cite')"))
+        connection.execute(
+            database.Paper.__table__.insert(),
+            [{"id": i, "doi": "10.5555/%d" % (i,)}
+             for i in range(1, papers + 1)])
+        connection.execute(
+            text("INSERT OR IGNORE INTO relationship_association "
+                 "(left_id, right_id, relationship_id) "
+                 "VALUES (:left_id, :right_id, 1)"),
+            [{"left_id": rng.randint(1, papers),
+              "right_id": rng.randint(1, papers)}
+             for _ in range(edges)])
+
+
+def sql_traverse(db, id, depth):
+    """
+    Breadth-first traversal with one SQL query per paper, as walking the
+    ``Paper.related_to`` collections would.
+    """
+    seen = set([id])
+    frontier = [id]
+    queries = 0
+    for distance in range(1, depth + 1):
+        next_frontier = []
+        for node in frontier:
+            queries += 1
+            for successor, in db.execute(
+                    text("SELECT right_id FROM relationship_association "
+                         "WHERE left_id = :id AND relationship_id = 1"),
+                    {"id": node}):
+                if successor not in seen:
+                    seen.add(successor)
+                    next_frontier.append(successor)
+        frontier = next_frontier
+    return len(seen) - 1, queries
+
+
+def timed(name, function, runs):
+    """
+    Time a function over some runs and print a report.
+    """
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = function()
+    elapsed = time.perf_counter() - start
+    print("%-28s %5d runs in %8.3fs: %10.3f ms/run (last: %s)" % (
+        name, runs, elapsed, 1000 * elapsed / runs, result))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the traversals of the relationships graph.")
+    parser.add_argument("--papers", type=int, default=100000,
+                        help="Number of papers.")
+    parser.add_argument("--edges", type=int, default=1000000,
+                        help="Number of cite edges.")
+    parser.add_argument("--runs", type=int, default=20,
+                        help="Number of runs of each traversal.")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = database.get_engine("sqlite:///%s" % (
+            os.path.join(tmp_dir, "benchmark.sqlite3"),))
+        start = time.perf_counter()
+        fill(engine, args.papers, args.edges)
+        print("Filled %d edges in %.1fs." % (args.edges,
+                                             time.perf_counter() - start))
+        db = sessionmaker(bind=engine)()
+        citation_graph = graph.CitationGraph()
+        start = time.perf_counter()
+        citation_graph.load("cite", engine)
+        print("Loaded the graph in %.1fs." % (time.perf_counter() - start,))
+
+        for depth in (1, 2, 3):
+            timed("sql %d-hop" % (depth,),
+                  lambda: sql_traverse(db, rng.randint(1, args.papers),
+                                       depth),
+                  max(1, args.runs // (5 ** (depth - 1))))
+            timed("graph %d-hop" % (depth,),
+                  lambda: len(list(citation_graph.traverse(
+                      "cite", rng.randint(1, args.papers), depth))),
+                  args.runs)
+        timed("graph reverse 3-hop",
+              lambda: len(list(citation_graph.traverse(
+                  "cite", rng.randint(1, args.papers), 3, reverse=True))),
+              args.runs)
+        timed("graph shortest path",
+              lambda: len(citation_graph.shortest_path(
+                  "cite", rng.randint(1, args.papers),
+                  rng.randint(1, args.papers), 10) or []),
+              args.runs)
+        edges = [(rng.randint(1, args.papers), rng.randint(1, args.papers))
+                 for _ in range(args.runs * 1000)]
+        timed("graph add and remove",
+              lambda: citation_graph.apply([
+                  ("added", "cite", edges), ("removed", "cite", edges)]),
+              1)
+        db.close()
+        engine.dispose()
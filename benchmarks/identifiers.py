@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark the extraction of identifiers (URLs, DOIs, arXiv ids) from cleaned
+plaintext citations, and check it gives the same results as the previous
+regex cascade on a regression corpus. The single pass scan of
+``doi.scan_doi_or_arxiv`` is also timed and checked against the cascade of
+``doi.match_doi_or_arxiv``.
+
+Usage: ``python3 -m benchmarks.identifiers [CITATIONS_FILE] [REPEAT]``, with
+one citation per line in ``CITATIONS_FILE``.
+"""
+import os
+import sys
+import time
+
+from reference_fetcher import doi
+from reference_fetcher import regex
+from reference_fetcher import tools
+
+
+def legacy_match_doi_or_arxiv(text, only=["DOI", "arXiv"]):
+    """
+    Regex cascade previously used by ``doi.match_doi_or_arxiv``, kept as the
+    reference implementation.
+    """
+    text = text.lower()
+    if "DOI" in only:
+        extractID = regex.doi.search(text.replace('&#338;', '-'))
+        if not extractID:
+            extractID = regex.doi_pnas.search(text.replace('pnas', '/pnas'))
+            if not extractID:
+                extractID = regex.doi_jsb.search(text)
+        if extractID:
+            cleanDOI = extractID.group(0).replace(':', '').replace(' ', '')
+            if regex.clean_doi.search(cleanDOI):
+                cleanDOI = cleanDOI[1:]
+            if regex.clean_doi_fabse.search(cleanDOI):
+                cleanDOI = cleanDOI[:20]
+            if regex.clean_doi_jcb.search(cleanDOI):
+                cleanDOI = cleanDOI[:21]
+            if len(cleanDOI) > 40:
+                cleanDOItemp = regex.clean_doi_len.sub('000', cleanDOI)
+                reps = {'.': 'A', '-': '0'}
+                cleanDOItemp = tools.replaceAll(cleanDOItemp[8:], reps)
+                digitStart = 0
+                for i in range(len(cleanDOItemp)):
+                    if cleanDOItemp[i].isdigit():
+                        digitStart = 1
+                        if cleanDOItemp[i].isalpha() and digitStart:
+                            break
+                cleanDOI = cleanDOI[0:(8+i)]
+            return ("DOI", cleanDOI)
+    if "arXiv" in only:
+        extractID = regex.arXiv.search(text)
+        if extractID:
+            return ("arXiv", extractID.group(1))
+    return None
+
+
+def legacy_extract_identifiers(citations):
+    """
+    Identifiers extraction as previously done in ``bbl.get_dois``.
+    """
+    results = []
+    for citation in citations:
+        raw_urls = regex.urls.findall(citation)
+        urls = [u.lower() for u in raw_urls]
+        for url in raw_urls:
+            citation = citation.replace(url, "")
+        citation = tools.clean_whitespaces(citation)
+        match = None
+        if (not doi.extract_arxiv_links(urls) and
+                not doi.extract_doi_links(urls)):
+            match = legacy_match_doi_or_arxiv(citation)
+        results.append((citation, urls, match))
+    return results
+
+
+def run(name, function, items):
+    """
+    Time a function over a list of items and print a report.
+    """
+    start = time.perf_counter()
+    result = function(items)
+    elapsed = time.perf_counter() - start
+    print("%-24s %7d citations in %7.3fs: %10.1f citations/s" % (
+        name, len(items), elapsed, len(items) / elapsed))
+    return result
+
+
+if __name__ == "__main__":
+    citations_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "fixtures", "citations.txt")
+    repeat = 1000
+    if len(sys.argv) > 1:
+        citations_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        repeat = int(sys.argv[2])
+    with open(citations_file, 'r') as fh:
+        corpus = [line.strip() for line in fh if line.strip()]
+    citations = corpus * repeat
+
+    # Microbenchmark of every pattern of regex.py
+    lowered = [citation.lower() for citation in citations]
+    for name in sorted(dir(regex)):
+        pattern = getattr(regex, name)
+        if isinstance(pattern, type(regex.urls)):
+            run("regex.%s" % (name,),
+                lambda items: [pattern.search(i) for i in items],
+                lowered)
+
+    cascade = run("match_doi_or_arxiv",
+                  lambda items: [doi.match_doi_or_arxiv(i) for i in items],
+                  lowered)
+    scan = run("scan_doi_or_arxiv",
+               lambda items: [doi.scan_doi_or_arxiv(i) for i in items],
+               lowered)
+    if cascade != scan:
+        sys.exit("Single pass scan differs from the regex cascade.")
+
+    legacy = run("legacy cascade", legacy_extract_identifiers, citations)
+    current = run("extract_identifiers", doi.extract_identifiers, citations)
+    mismatches = [(c, i, j) for c, i, j in zip(citations, legacy, current)
+                  if i != j]
+    for citation, expected, got in mismatches[:len(corpus)]:
+        print("%s\n  legacy:  %s\n  current: %s" % (citation, expected, got))
+    print("extract_identifiers matches the legacy cascade on %d/%d citations."
+          % (len(citations) - len(mismatches), len(citations)))
+    if mismatches:
+        sys.exit(1)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Benchmark the ingestion of the cited papers of a paper: the bulk
+``add_cited_urls`` against the previous one-citation-at-a-time path.
+
+Papers citing ``--references`` papers each are ingested in an in-memory
+SQLite database, a part of the cited papers being already known. Queries are
+counted, and both paths are checked to give the same papers, queue entries
+and relationships. arXiv API is replaced by a local stand-in, so that no
+network is involved.
+
+Usage: ``python3 -m benchmarks.ingestion --help``.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import database
+import tools
+from reference_fetcher import arxiv
+from routes import post
+
+
+def stand_in_eprints(dois):
+    """
+    Stand-in for ``arxiv.get_arxiv_eprint_from_doi_batch``: every other DOI
+    has an arXiv eprint.
+    """
+    return {doi: ("1501.%05d" % (int(doi.split("/")[1]),)
+                  if int(doi.split("/")[1]) % 2 else None)
+            for doi in dois}
+
+
+def stand_in_dois(eprints):
+    """
+    Stand-in for ``arxiv.get_doi_batch``, consistent with
+    ``stand_in_eprints``.
+    """
+    return {eprint: ("10.5555/%d" % (int(eprint.split(".")[1]),)
+                     if int(eprint.split(".")[1]) % 2 else None)
+            for eprint in eprints}
+
+
+def legacy_add_cited_urls(paper, cited_urls, db):
+    """
+    One-citation-at-a-time path previously used by ``add_cited_urls``, kept
+    as the reference implementation.
+    """
+    identifiers = [tools.get_identifier_from_url(url) for url in cited_urls]
+    identifiers = [(type, identifier)
+                   for type, identifier in identifiers
+                   if type is not None]
+    right_papers = {
+        (type, identifier): (
+            db.query(database.Paper)
+            .filter(getattr(database.Paper, type) == identifier)
+            .first())
+        for type, identifier in identifiers
+    }
+    missing = [key for key, right_paper in right_papers.items()
+               if right_paper is None]
+    known_arxiv_ids = arxiv.get_arxiv_eprint_from_doi_batch(
+        [identifier for type, identifier in missing if type == "doi"])
+    known_dois = arxiv.get_doi_batch(
+        [identifier for type, identifier in missing
+         if type == "arxiv_id"])
+    for type, identifier in identifiers:
+        right_paper = right_papers[(type, identifier)]
+        if right_paper is None or right_paper.imported:
+            if type == "doi":
+                right_paper = post.create_by_doi(
+                    identifier, db, known_arxiv_ids=known_arxiv_ids)
+            else:
+                right_paper = post.create_by_arxiv(
+                    identifier, db, known_dois=known_dois)
+            if right_paper is None:
+                continue
+            right_papers[(type, identifier)] = right_paper
+            queue = database.CitationProcessingQueue()
+            queue.paper = right_paper
+            db.add(queue)
+        post.update_relationship_backend(paper.id, right_paper.id, "cite", db)
+
+
+def dump(db):
+    """
+    Get the papers, queue entries and relationships of the database, by
+    identifiers.
+    """
+    papers = {paper.id: (paper.doi, paper.arxiv_id)
+              for paper in db.query(database.Paper)}
+    return (
+        sorted(papers.values(), key=repr),
+        sorted((papers[i.paper_id]
+                for i in db.query(database.CitationProcessingQueue)),
+               key=repr),
+        sorted(((papers[i.left_id], papers[i.right_id])
+                for i in db.query(database.RelationshipAssociation)),
+               key=repr)
+    )
+
+
+def run(name, add_cited_urls, args):
+    """
+    Ingest the papers with the given ``add_cited_urls`` and print a report.
+
+    :returns: The content of the database, see ``dump``.
+    """
+    engine = database.get_engine("sqlite://")
+    database.Base.metadata.create_all(engine)
+    queries = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(*args):
+        queries[0] += 1
+
+    db = sessionmaker(bind=engine)()
+    rng = random.Random(0)
+    # Already known papers, with both their identifiers as the previous path
+    # rolls back the whole transaction on a conflict
+    for i in range(0, args.cited, 3):
+        doi = "10.5555/%d" % (i,)
+        db.add(database.Paper(doi=doi,
+                              arxiv_id=stand_in_eprints([doi])[doi],
+                              imported=(i % 2 == 0)))
+    db.commit()
+    queries[0] = 0
+    start = time.perf_counter()
+    for i in range(args.papers):
+        paper = database.Paper(doi="10.1000/%d" % (i,))
+        db.add(paper)
+        db.flush()
+        cited = rng.sample(range(args.cited), args.references)
+        cited_urls = [
+            ("http://dx.doi.org/10.5555/%d" % (j,) if j % 4
+             else "http://arxiv.org/abs/1501.%05d" % (j,))
+            for j in cited
+        ]
+        add_cited_urls(paper, cited_urls, db)
+        db.commit()
+    elapsed = time.perf_counter() - start
+    print("%-6s %4d papers in %7.3fs: %7.1f queries/paper, %7.2f ms/paper" % (
+        name, args.papers, elapsed, queries[0] / args.papers,
+        1000 * elapsed / args.papers))
+    result = dump(db)
+    db.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingestion of cited papers.")
+    parser.add_argument("--papers", type=int, default=50,
+                        help="Number of citing papers.")
+    parser.add_argument("--references", type=int, default=150,
+                        help="Number of references of each paper.")
+    parser.add_argument("--cited", type=int, default=3000,
+                        help="Number of distinct cited papers.")
+    args = parser.parse_args()
+
+    arxiv.get_arxiv_eprint_from_doi_batch = stand_in_eprints
+    arxiv.get_doi_batch = stand_in_dois
+    legacy = run("legacy", legacy_add_cited_urls, args)
+    bulk = run("bulk", post.add_cited_urls, args)
+    print("Same papers, queue and relationships: %s." % (legacy == bulk,))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark the PageRank computation (``pagerank.pagerank``) on a random
+citation graph, from scratch and warm-started from the previous scores after
+some edges were added.
+
+The peak memory of the arrays allocated during the computation is reported
+along with the time and number of iterations.
+
+Usage: ``python3 -m benchmarks.pagerank --help``.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy
+
+import pagerank
+
+
+def run(name, exists, sources, targets, initial=None, chunk_size=None):
+    """
+    Time a PageRank computation and print a report.
+
+    :returns: The scores.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    scores, iterations, delta = pagerank.pagerank(
+        exists, sources, targets, initial=initial,
+        chunk_size=chunk_size or pagerank.CHUNK_SIZE)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("%-12s %3d iterations in %7.2fs (%6.3fs/iteration), delta %.1e, "
+          "peak memory %6.1f MiB" % (name, iterations, elapsed,
+                                      elapsed / iterations, delta,
+                                      peak / 1024 ** 2))
+    return scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the PageRank computation.")
+    parser.add_argument("--papers", type=int, default=1000000,
+                        help="Number of papers.")
+    parser.add_argument("--edges", type=int, default=10000000,
+                        help="Number of cite edges.")
+    parser.add_argument("--added", type=float, default=0.001,
+                        help="Fraction of edges added before the warm start.")
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(0)
+    exists = numpy.ones(args.papers + 1, dtype=bool)
+    exists[0] = False
+    # Citations of older papers (lower ids), with a preferential attachment
+    sources = rng.integers(2, args.papers + 1, args.edges, dtype=numpy.int32)
+    targets = (sources * rng.power(3, args.edges) ** 4).astype(numpy.int32)
+    targets = numpy.maximum(targets, 1)
+    print("%d papers, %d edges (%.1f MiB of edges)." % (
+        args.papers, args.edges,
+        (sources.nbytes + targets.nbytes) / 1024 ** 2))
+
+    scores = run("cold", exists, sources, targets)
+    added = int(args.edges * args.added)
+    sources = numpy.concatenate([sources, rng.integers(
+        2, args.papers + 1, added, dtype=numpy.int32)])
+    targets = numpy.concatenate([targets, rng.integers(
+        1, args.papers + 1, added, dtype=numpy.int32)])
+    print("Added %d edges." % (added,))
+    run("cold", exists, sources, targets)
+    run("warm", exists, sources, targets, initial=scores)
+    run("warm/chunks", exists, sources, targets, initial=scores,
+        chunk_size=pagerank.CHUNK_SIZE // 10)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the references pipeline, against local stand-in
+arXiv (e-print and API), Crossref ``/links`` and Dissemin servers.
+
+Every paper of the corpus is an e-print tarball built from the ``.bbl``
+files in ``fixtures/``, with some random filler (figures) around. Latency and
+errors can be injected in all the stand-in servers.
+
+The throughput and p50/p95/p99 latencies are reported for each stage:
+download, tar extraction, cleaning, identifiers extraction, Crossref
+resolution and OA lookup, as well as for the whole ``arxiv.get_cited_dois``.
+
+Usage: ``python3 -m benchmarks.pipeline --help``.
+"""
+import argparse
+import glob
+import hashlib
+import http.server
+import io
+import json
+import os
+import random
+import tarfile
+import threading
+import time
+import urllib.parse
+import xml.sax.saxutils
+
+from reference_fetcher import arxiv
+from reference_fetcher import bbl
+from reference_fetcher import client
+from reference_fetcher import doi
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+
+
+def build_corpus(papers, filler_size):
+    """
+    Build the e-print tarballs of the corpus.
+
+    :param papers: Number of papers in the corpus.
+    :param filler_size: Size (in bytes) of the random filler in each e-print.
+    :returns: A dict of eprint ids and their gzipped tarball.
+    """
+    bbl_files = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.bbl"))):
+        with open(path, 'rb') as fh:
+            bbl_files.append(fh.read())
+    rng = random.Random(0)
+    corpus = {}
+    for i in range(papers):
+        eprint = "1601.%05d" % (i,)
+        bbl_content = bbl_files[i % len(bbl_files)]
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tf:
+            members = [
+                ("main.tex", b"\\documentclass{article}\n"),
+                ("figure.eps", rng.getrandbits(8 * filler_size).to_bytes(
+                    filler_size, "little") if filler_size else b""),
+                ("main.bbl", bbl_content),
+            ]
+            for name, content in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tf.addfile(info, io.BytesIO(content))
+        corpus[eprint] = buffer.getvalue()
+    return corpus
+
+
+def resolved(text, ratio=0.8):
+    """
+    Whether the stand-in Crossref or Dissemin resolves a given text,
+    deterministically.
+    """
+    digest = hashlib.md5(text.encode("utf-8")).digest()
+    return digest[0] < 256 * ratio
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handler of the stand-in servers. ``service`` is one of ``arxiv``,
+    ``arxiv_api``, ``crossref`` or ``dissemin``.
+    """
+    service = None
+    corpus = {}
+    latency = 0
+    error_rate = 0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body=b"", content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def inject(self):
+        """
+        Inject latency and errors. Returns ``True`` if an error was sent.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.respond(503)
+            return True
+        return False
+
+    def do_GET(self):
+        if self.inject():
+            return
+        url = urllib.parse.urlparse(self.path)
+        if self.service == "arxiv":
+            eprint = url.path[len("/e-print/"):]
+            if eprint not in self.corpus:
+                return self.respond(404)
+            return self.respond(200, self.corpus[eprint],
+                                "application/x-eprint-tar")
+        elif self.service == "arxiv_api":
+            return self.respond(200, self.atom_feed(
+                urllib.parse.parse_qs(url.query)), "application/atom+xml")
+        elif self.service == "dissemin":
+            query = urllib.parse.unquote(url.path[len("/api/"):])
+            result = {"status": "ok", "paper": {}}
+            if resolved(query, 0.5):
+                result["paper"]["pdf_url"] = "http://oa.example.org/%s" % (
+                    query,)
+            return self.respond(200, json.dumps(result).encode("utf-8"))
+        return self.respond(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.inject():
+            return
+        if self.service != "crossref":
+            return self.respond(404)
+        results = []
+        for text in json.loads(body.decode("utf-8")):
+            result = {"text": text}
+            if resolved(text):
+                result["doi"] = "http://dx.doi.org/10.5555/%s" % (
+                    hashlib.md5(text.encode("utf-8")).hexdigest()[:8],)
+            results.append(result)
+        return self.respond(200, json.dumps({"results": results}).encode(
+            "utf-8"))
+
+    def atom_feed(self, params):
+        """
+        Build an arXiv API answer: every e-print has a DOI, and every DOI is
+        on arXiv.
+        """
+        entries = []
+        if "id_list" in params:
+            for eprint in params["id_list"][0].split(","):
+                entries.append((eprint + "v1", "10.5555/%s" % (eprint,)))
+        elif "search_query" in params:
+            for term in params["search_query"][0].split(" OR "):
+                value = term[len("doi:"):]
+                entries.append(("1602.%s" % (value[-5:],), value))
+        feed = ['<feed xmlns="http://www.w3.org/2005/Atom" '
+                'xmlns:arxiv="http://arxiv.org/schemas/atom">']
+        for id, doi_value in entries:
+            feed.append("<entry><id>http://arxiv.org/abs/%s</id>"
+                        "<arxiv:doi>%s</arxiv:doi></entry>" % (
+                            xml.sax.saxutils.escape(id),
+                            xml.sax.saxutils.escape(doi_value)))
+        feed.append("</feed>")
+        return "".join(feed).encode("utf-8")
+
+
+def start_stand_ins(corpus, latency, error_rate):
+    """
+    Start the stand-in servers, each in its own thread.
+
+    :returns: A tuple ``(servers, base_urls)``, ``base_urls`` being suitable \
+            for ``client.HTTPClient``.
+    """
+    hosts = {
+        "arxiv": "http://arxiv.org",
+        "arxiv_api": "http://export.arxiv.org",
+        "crossref": "http://search.crossref.org",
+        "dissemin": "http://beta.dissem.in",
+    }
+    servers = []
+    base_urls = {}
+    for service, host in hosts.items():
+        handler = type("%sHandler" % (service,), (StandInHandler,), {
+            "service": service,
+            "corpus": corpus,
+            "latency": latency,
+            "error_rate": error_rate,
+        })
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        base_urls[host] = "http://127.0.0.1:%d" % (server.server_port,)
+    return servers, base_urls
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+class Stages(object):
+    """
+    Timings of the stages of the pipeline.
+    """
+    def __init__(self):
+        self.durations = {}
+        self.items = {}
+
+    def time(self, stage, function, *args, items=1, **kwargs):
+        """
+        Run a function and record its duration under ``stage``.
+        """
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.durations.setdefault(stage, []).append(
+            time.perf_counter() - start)
+        self.items[stage] = self.items.get(stage, 0) + items
+        return result
+
+    def report(self):
+        print("%-12s %8s %12s %10s %10s %10s" % (
+            "stage", "items", "items/s", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+        for stage, durations in self.durations.items():
+            total = sum(durations)
+            print("%-12s %8d %12.1f %10.2f %10.2f %10.2f" % (
+                stage,
+                self.items[stage],
+                self.items[stage] / total if total else float("inf"),
+                1000 * percentile(durations, 50),
+                1000 * percentile(durations, 95),
+                1000 * percentile(durations, 99)))
+
+
+def download(eprint):
+    """
+    Download the raw e-print of a paper.
+    """
+    with arxiv.sources_from_arxiv(eprint) as fileobj:
+        return fileobj.read()
+
+
+def run_paper(eprint, stages, backend):
+    """
+    Run all the stages of the pipeline on a single paper.
+    """
+    raw = stages.time("download", download, eprint)
+    bbl_files = stages.time("extraction", arxiv.bbl_from_sources,
+                            io.BytesIO(raw))
+    for bbl_file in bbl_files:
+        citations = stages.time("cleaning", bbl.parse, bbl_file,
+                                backend=backend)
+        identifiers = stages.time("identifiers", doi.extract_identifiers,
+                                  citations, items=len(citations))
+        unresolved = [citation for citation, urls, match in identifiers
+                      if match is None and
+                      not doi.extract_doi_links(urls) and
+                      not doi.extract_arxiv_links(urls)]
+        dois = stages.time("crossref", bbl.crossref_links, unresolved,
+                           items=len(unresolved))
+        found = [url for url in dois.values() if url is not None]
+        stages.time("oa", doi.get_oa_versions, found, items=len(found))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the references pipeline end to end.")
+    parser.add_argument("--papers", type=int, default=50,
+                        help="Number of papers in the corpus.")
+    parser.add_argument("--filler-size", type=int, default=1024 ** 2,
+                        help="Size of the figures in each e-print (bytes).")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Latency of the stand-in servers (seconds).")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Ratio of requests answered with a 503.")
+    parser.add_argument("--backend", default="python",
+                        choices=["delatex", "python"],
+                        help="Cleaning backend.")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.papers, args.filler_size)
+    servers, base_urls = start_stand_ins(corpus, args.latency,
+                                         args.error_rate)
+    client.set_client(client.HTTPClient(base_urls=base_urls,
+                                        backoff_factor=0.01))
+
+    stages = Stages()
+    for eprint in sorted(corpus):
+        run_paper(eprint, stages, args.backend)
+    # Whole pipeline, as used by the API
+    bbl.CLEANING_BACKEND = args.backend
+    for eprint in sorted(corpus):
+        stages.time("end-to-end", arxiv.get_cited_dois, eprint)
+    stages.report()
+
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark the lookups of relationships on a large ``relationship_association``
+table, before and after ``migrate.upgrade`` (deduplication and composite
+indexes).
+
+A file-backed SQLite database is filled with random ``cite`` edges (with some
+duplicates) and the queries of ``fetch_relationship`` (forward and reverse),
+``delete_relationship`` and ``update_relationship_backend`` are timed.
+
+Usage: ``python3 -m benchmarks.relationships --help``.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import database
+import migrate
+
+
+def fill(engine, papers, edges, duplicates):
+    """
+    Fill the database with papers and random ``cite`` edges, without the
+    indexes of ``relationship_association``.
+    """
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index in database.RelationshipAssociation.__table__.indexes:
+            index.drop(connection)
+        connection.execute(text("INSERT INTO relationships (id, name) "
+                                "VALUES (1, 'cite')"))
+        connection.execute(
+            database.Paper.__table__.insert(),
+            [{"id": i, "doi": "10.5555/%d" % (i,)}
+             for i in range(1, papers + 1)])
+        rng = random.Random(0)
+        batch = []
+        for i in range(edges):
+            if i < duplicates and batch:
+                batch.append(dict(batch[-1]))
+            else:
+                batch.append({"left_id": rng.randint(1, papers),
+                              "right_id": rng.randint(1, papers),
+                              "relationship_id": 1})
+            if len(batch) >= 100000:
+                connection.execute(
+                    database.RelationshipAssociation.__table__.insert(),
+                    batch)
+                batch = []
+        if batch:
+            connection.execute(
+                database.RelationshipAssociation.__table__.insert(), batch)
+
+
+def run(name, db, papers, lookups):
+    """
+    Time the relationships lookups and print a report.
+    """
+    rng = random.Random(1)
+    ids = [(rng.randint(1, papers), rng.randint(1, papers))
+           for _ in range(lookups)]
+    RelationshipAssociation = database.RelationshipAssociation
+    queries = {
+        # fetch_relationship
+        "forward": lambda left, right: (
+            db.query(RelationshipAssociation.right_id)
+            .filter_by(left_id=left, relationship_id=1).all()),
+        # fetch_relationship with ?reverse=1
+        "reverse": lambda left, right: (
+            db.query(RelationshipAssociation.left_id)
+            .filter_by(right_id=right, relationship_id=1).all()),
+        # delete_relationship and update_relationship_backend
+        "edge": lambda left, right: (
+            db.query(RelationshipAssociation.id)
+            .filter_by(left_id=left, right_id=right, relationship_id=1)
+            .first()),
+    }
+    for query_name, query in queries.items():
+        start = time.perf_counter()
+        for left, right in ids:
+            query(left, right)
+        elapsed = time.perf_counter() - start
+        print("%-8s %-8s %6d lookups in %8.3fs: %10.3f ms/lookup" % (
+            name, query_name, lookups, elapsed, 1000 * elapsed / lookups))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the lookups of relationships.")
+    parser.add_argument("--papers", type=int, default=200000,
+                        help="Number of papers.")
+    parser.add_argument("--edges", type=int, default=2000000,
+                        help="Number of cite edges.")
+    parser.add_argument("--duplicates", type=int, default=10000,
+                        help="Number of duplicate edges.")
+    parser.add_argument("--lookups", type=int, default=50,
+                        help="Number of lookups of each kind.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine("sqlite:///%s" % (
+            os.path.join(tmp_dir, "benchmark.sqlite3"),))
+        start = time.perf_counter()
+        fill(engine, args.papers, args.edges, args.duplicates)
+        print("Filled %d edges in %.1fs." % (args.edges,
+                                             time.perf_counter() - start))
+        db = sessionmaker(bind=engine)()
+        run("before", db, args.papers, args.lookups)
+        db.close()
+
+        start = time.perf_counter()
+        _, removed = migrate.upgrade(engine)
+        print("Migrated in %.1fs, removed %d duplicate edges." % (
+            time.perf_counter() - start,
+            removed["relationship_association"]))
+        db = sessionmaker(bind=engine)()
+        run("after", db, args.papers, args.lookups)
+        db.close()
+        engine.dispose()
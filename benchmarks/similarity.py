@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark the computation of the similar papers (``similarity.py``): a full
+computation, then incremental refreshes after some citations were added.
+
+A file-backed SQLite database is filled with random ``cite`` edges, as in
+``benchmarks.graph``, and the similar papers of a sample of papers are
+checked against a direct computation from their citations.
+
+Usage: ``python3 -m benchmarks.similarity --help``.
+"""
+import argparse
+import collections
+import math
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import database
+import similarity
+from benchmarks.graph import fill
+from routes import post
+
+
+def reference(db, id, top_k):
+    """
+    Compute the similar papers of a paper directly from its citations.
+    """
+    cited = collections.defaultdict(set)
+    citing = collections.defaultdict(set)
+    for left_id, right_id in db.execute(text(
+            "SELECT left_id, right_id FROM relationship_association "
+            "WHERE relationship_id = 1")):
+        cited[left_id].add(right_id)
+        citing[right_id].add(left_id)
+    candidates = set()
+    for i in citing[id]:
+        candidates |= cited[i]
+    for i in cited[id]:
+        candidates |= citing[i]
+    candidates.discard(id)
+    scores = []
+    for i in candidates:
+        score = 0.0
+        cocitations = len(citing[id] & citing[i])
+        if cocitations:
+            score += similarity.COCITATION_WEIGHT * cocitations / math.sqrt(
+                len(citing[id]) * len(citing[i]))
+        couplings = len(cited[id] & cited[i])
+        if couplings:
+            score += similarity.COUPLING_WEIGHT * couplings / math.sqrt(
+                len(cited[id]) * len(cited[i]))
+        scores.append((-round(score, 9), i))
+    return [i for _, i in sorted(scores)[:top_k]]
+
+
+def timed(name, function):
+    """
+    Time a function and print a report.
+    """
+    start = time.perf_counter()
+    papers, similar, edges = function()
+    print("%-24s %8d papers, %9d similar papers in %8.3fs" % (
+        name, papers, similar, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the computation of the similar papers.")
+    parser.add_argument("--papers", type=int, default=100000,
+                        help="Number of papers.")
+    parser.add_argument("--edges", type=int, default=1000000,
+                        help="Number of cite edges.")
+    parser.add_argument("--changes", type=int, default=100,
+                        help="Number of cite edges added before a refresh.")
+    parser.add_argument("--checks", type=int, default=20,
+                        help="Number of papers checked.")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = database.get_engine("sqlite:///%s" % (
+            os.path.join(tmp_dir, "benchmark.sqlite3"),))
+        fill(engine, args.papers, args.edges)
+        timed("full", lambda: similarity.update_similar(engine))
+
+        db = sessionmaker(bind=engine)()
+        for _ in range(args.changes):
+            left_id = rng.randint(1, args.papers)
+            right_id = rng.randint(1, args.papers)
+            if db.execute(text(
+                    "SELECT 1 FROM relationship_association "
+                    "WHERE left_id = :left_id AND right_id = :right_id"),
+                    {"left_id": left_id, "right_id": right_id}).first():
+                continue
+            post.update_relationship_backend(left_id, right_id, "cite", db)
+        db.commit()
+        timed("incremental", lambda: similarity.update_similar(engine))
+        timed("incremental, no change",
+              lambda: similarity.update_similar(engine))
+        timed("full", lambda: similarity.update_similar(engine, full=True))
+
+        matching = 0
+        for _ in range(args.checks):
+            id = rng.randint(1, args.papers)
+            stored = [similar_id for similar_id, in db.execute(text(
+                "SELECT similar_id FROM similar_papers "
+                "WHERE paper_id = :id ORDER BY position"), {"id": id})]
+            matching += (stored == reference(db, id, similarity.TOP_K))
+        print("Same similar papers as the reference: %d/%d." % (
+            matching, args.checks))
+        db.close()
+        engine.dispose()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+# Local import
+import config
+from reference_fetcher import index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Build or update the local identifier index from "
+                     "metadata dumps."))
+    parser.add_argument("dumps", nargs="+",
+                        help=("arXiv OAI-PMH harvests (.xml), Crossref or "
+                              "arXiv JSON lines (.jsonl) or Crossref API "
+                              "pages (.json), possibly gzipped, or "
+                              "directories of them."))
+    parser.add_argument("--index", default=config.identifier_index,
+                        help="Path to the index (default: from config.py).")
+    parser.add_argument("--force", action="store_true",
+                        help="Index again the unchanged dump files.")
+    args = parser.parse_args()
+    if args.index is None:
+        parser.error("No index path given, and none in config.py.")
+
+    start = time.perf_counter()
+    identifier_index = index.IdentifierIndex(args.index)
+    count = identifier_index.update(args.dumps, force=args.force)
+    print("Indexed %d records in %.1fs, %d records in the index." % (
+        count, time.perf_counter() - start,
+        identifier_index.stats()["records"]))
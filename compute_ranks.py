@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import argparse
+import tempfile
+import time
+
+# Local import
+import config
+import database
+import pagerank
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Compute the PageRank of the papers in the graph of "
+                     "citations."))
+    parser.add_argument("--cold", action="store_true",
+                        help="Do not start from the previous scores.")
+    parser.add_argument("--damping", type=float, default=pagerank.DAMPING,
+                        help="Damping factor.")
+    parser.add_argument("--tolerance", type=float,
+                        default=pagerank.TOLERANCE,
+                        help=("Stop once the L1 norm of the change of the "
+                              "scores is under this tolerance."))
+    parser.add_argument("--max-iterations", type=int,
+                        default=pagerank.MAX_ITERATIONS,
+                        help="Maximum number of iterations.")
+    parser.add_argument("--memmap", action="store_true",
+                        help=("Keep the edges in memory-mapped temporary "
+                              "files, for graphs which do not fit in "
+                              "memory."))
+    args = parser.parse_args()
+
+    engine = database.get_engine(config.database_url,
+                                 echo=config.database_echo,
+                                 sqlite_pragmas=config.sqlite_pragmas,
+                                 pool=config.database_pool)
+    database.Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        papers, edges, iterations, delta = pagerank.update_ranks(
+            engine,
+            warm_start=(not args.cold),
+            directory=(tmp_dir if args.memmap else None),
+            damping=args.damping,
+            tolerance=args.tolerance,
+            max_iterations=args.max_iterations)
+    print("Ranked %d papers over %d citations in %d iterations (delta %g) "
+          "in %.1fs." % (papers, edges, iterations, delta,
+                         time.perf_counter() - start))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import argparse
+import tempfile
+import time
+
+# Local import
+import config
+import database
+import similarity
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Compute the most similar papers of the papers whose "
+                     "citations changed, by co-citation and bibliographic "
+                     "coupling."))
+    parser.add_argument("--full", action="store_true",
+                        help="Recompute the similar papers of all papers.")
+    parser.add_argument("--top", type=int, default=similarity.TOP_K,
+                        help="Number of similar papers kept for each paper.")
+    parser.add_argument("--memmap", action="store_true",
+                        help=("Keep the edges in memory-mapped temporary "
+                              "files, for graphs which do not fit in "
+                              "memory."))
+    args = parser.parse_args()
+
+    engine = database.get_engine(config.database_url,
+                                 echo=config.database_echo,
+                                 sqlite_pragmas=config.sqlite_pragmas,
+                                 pool=config.database_pool)
+    database.Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        papers, similar, edges = similarity.update_similar(
+            engine,
+            full=args.full,
+            top_k=args.top,
+            directory=(tmp_dir if args.memmap else None))
+    print("Stored %d similar papers of %d papers over %d citations "
+          "in %.1fs." % (similar, papers, edges,
+                         time.perf_counter() - start))
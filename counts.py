@@ -0,0 +1,117 @@
+"""
+This file contains the maintenance of the numbers of relationships of the
+papers (``RelationshipCount``), along with ``relationship_association``.
+"""
+import collections
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import database
+
+
+def _upsert(db, rows):
+    """
+    Add some deltas to the counts, creating the missing ones.
+
+    :param db: A database session.
+    :param rows: A list of dicts of ``paper_id``, ``relationship_id`` and \
+            the ``in_count`` and ``out_count`` deltas.
+    :returns: Nothing.
+    """
+    table = database.RelationshipCount.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ["sqlite", "postgresql"]:
+        if dialect == "sqlite":
+            statement = sqlite_insert(table)
+        else:
+            statement = postgresql_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.paper_id, table.c.relationship_id],
+            set_={
+                "in_count": table.c.in_count + statement.excluded.in_count,
+                "out_count": table.c.out_count + statement.excluded.out_count
+            })
+        db.execute(statement, rows)
+        return
+    # Other backends, update then insert the missing ones
+    statement = (
+        table.update()
+        .where(table.c.paper_id == bindparam("b_paper_id"))
+        .where(table.c.relationship_id == bindparam("b_relationship_id"))
+        .values(in_count=table.c.in_count + bindparam("b_in_count"),
+                out_count=table.c.out_count + bindparam("b_out_count")))
+    for row in rows:
+        updated = db.execute(
+            statement, {"b_%s" % (k,): v for k, v in row.items()}).rowcount
+        if updated == 0:
+            db.execute(table.insert(), row)
+
+
+def update(db, relationship_id, edges, delta):
+    """
+    Update the counts for some added or removed relationships.
+
+    :param db: A database session.
+    :param relationship_id: The id of the relationship.
+    :param edges: A list of tuples ``(left_id, right_id)`` of the added or \
+            removed relationships.
+    :param delta: ``1`` if they were added, ``-1`` if they were removed.
+    :returns: Nothing.
+    """
+    deltas = collections.OrderedDict()
+    for left_id, right_id in edges:
+        deltas.setdefault(left_id, [0, 0])[1] += delta
+        deltas.setdefault(right_id, [0, 0])[0] += delta
+    if not deltas:
+        return
+    _upsert(db, [{"paper_id": paper_id,
+                  "relationship_id": relationship_id,
+                  "in_count": in_count,
+                  "out_count": out_count}
+                 for paper_id, (in_count, out_count) in deltas.items()])
+
+
+def remove_paper(db, paper_id):
+    """
+    Update the counts of the papers related to a paper, before it is deleted
+    along with all its relationships.
+
+    :param db: A database session.
+    :param paper_id: The id of the paper.
+    :returns: Nothing.
+    """
+    RelationshipAssociation = database.RelationshipAssociation
+    edges = collections.defaultdict(list)
+    for left_id, right_id, relationship_id in (
+            db.query(RelationshipAssociation.left_id,
+                     RelationshipAssociation.right_id,
+                     RelationshipAssociation.relationship_id)
+            .filter((RelationshipAssociation.left_id == paper_id) |
+                    (RelationshipAssociation.right_id == paper_id))):
+        edges[relationship_id].append((left_id, right_id))
+    for relationship_id, relationship_edges in edges.items():
+        update(db, relationship_id, relationship_edges, -1)
+
+
+def recompute(connection):
+    """
+    Recompute all the counts from ``relationship_association``, in bulk.
+
+    :param connection: A ``SQLAlchemy`` connection, in a transaction.
+    :returns: The number of counts rows.
+    """
+    connection.execute(text("DELETE FROM relationship_counts"))
+    return connection.execute(text(
+        "INSERT INTO relationship_counts "
+        "(paper_id, relationship_id, in_count, out_count) "
+        "SELECT paper_id, relationship_id, SUM(in_count), SUM(out_count) "
+        "FROM ("
+        "SELECT right_id AS paper_id, relationship_id, "
+        "1 AS in_count, 0 AS out_count FROM relationship_association "
+        "UNION ALL "
+        "SELECT left_id AS paper_id, relationship_id, "
+        "0 AS in_count, 1 AS out_count FROM relationship_association"
+        ") AS edges "
+        "GROUP BY paper_id, relationship_id")).rowcount
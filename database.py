@@ -1,13 +1,19 @@
 """
 This file contains the database schema in SQLAlchemy format.
 """
+import collections
 import sqlite3
+import threading
 
-from sqlalchemy import event
-from sqlalchemy import Column, ForeignKey, Integer, String, Table
-from sqlalchemy.engine import Engine
+from sqlalchemy import create_engine, event
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Index, Integer
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import relationship as sqlalchemy_relationship
+from sqlalchemy.pool import StaticPool
 
 Base = declarative_base()
 
@@ -24,6 +30,50 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
         cursor.close()
 
 
+def get_engine(url, echo=False, sqlite_pragmas=None, pool=None):
+    """
+    Create the engine of the database.
+
+    SQLite databases get the given PRAGMAs on each new connection. An
+    in-memory SQLite database is a single connection, shared by all the
+    threads (the API and the queue worker). The other backends (e.g.
+    PostgreSQL) get a connection pool with the given options.
+
+    :param url: A ``SQLAlchemy`` database URL.
+    :param echo: Whether to log all the SQL statements.
+    :param sqlite_pragmas: A dict of PRAGMAs and their values, for SQLite.
+    :param pool: A dict of options of the connection pool (``pool_size``, \
+            ``max_overflow``, …), for the other backends.
+    :returns: A ``SQLAlchemy`` ``Engine``.
+    """
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, echo=echo, **(pool or {}))
+
+    sqlite_pragmas = dict(sqlite_pragmas or {})
+    if url.database in (None, "", ":memory:"):
+        # No WAL nor memory map for an in-memory database
+        sqlite_pragmas.pop("journal_mode", None)
+        sqlite_pragmas.pop("mmap_size", None)
+        engine = create_engine(url, echo=echo,
+                               poolclass=StaticPool,
+                               connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(url, echo=echo)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_tuning_pragmas(dbapi_connection, connection_record):
+        """
+        Apply the configured PRAGMAs to a new SQLite connection.
+        """
+        cursor = dbapi_connection.cursor()
+        for name, value in sqlite_pragmas.items():
+            cursor.execute("PRAGMA %s=%s" % (name, value))
+        cursor.close()
+
+    return engine
+
+
 class RelationshipAssociation(Base):
     # Relationships are to be read "left RELATION right"
     __tablename__ = "relationship_association"
@@ -42,10 +92,23 @@ class RelationshipAssociation(Base):
                                          foreign_keys=left_id,
                                          back_populates="related_to")
 
+    __table_args__ = (
+        # Relationships of a paper, and reverse relationships
+        Index("ix_relationship_association_left", left_id, relationship_id),
+        Index("ix_relationship_association_right", right_id, relationship_id),
+        # A relationship between two papers is stored only once
+        Index("uq_relationship_association_edge",
+              left_id, right_id, relationship_id, unique=True),
+    )
+
 tag_association_table = Table(
     'tag_association', Base.metadata,
     Column('paper_id', Integer, ForeignKey('papers.id', ondelete="CASCADE")),
-    Column('tag_id', Integer, ForeignKey('tags.id', ondelete="CASCADE"))
+    Column('tag_id', Integer, ForeignKey('tags.id', ondelete="CASCADE")),
+    # A paper is tagged only once with a tag
+    Index("uq_tag_association_paper_tag", "paper_id", "tag_id", unique=True),
+    # Papers of a tag
+    Index("ix_tag_association_tag", "tag_id", "paper_id")
 )
 
 
@@ -54,6 +117,14 @@ class Paper(Base):
     id = Column(Integer, primary_key=True)
     doi = Column(String(), nullable=True, unique=True)
     arxiv_id = Column(String(30), nullable=True, unique=True)
+    # URL of an open access version, if any
+    oa_url = Column(String(), nullable=True)
+    # arXiv version (e.g. 1401.2910v2) whose references were last extracted,
+    # or the unversioned id for the latest version at the first extraction
+    extracted_version = Column(String(30), nullable=True)
+    # Imported from a metadata dump (see import_papers.py), but not added
+    # through the API yet
+    imported = Column(Boolean, nullable=False, default=False)
     # related_to are papers related to this paper (this_paper R …)
     related_to = sqlalchemy_relationship("RelationshipAssociation",
                                          foreign_keys="RelationshipAssociation.left_id",
@@ -69,6 +140,13 @@ class Paper(Base):
                                    secondary=tag_association_table,
                                    backref="papers",
                                    passive_deletes=True)
+    # Number of relationships of this paper, see RelationshipCount
+    counts = sqlalchemy_relationship("RelationshipCount",
+                                     passive_deletes=True)
+    # PageRank of this paper, see PaperRank
+    rank = sqlalchemy_relationship("PaperRank",
+                                   uselist=False,
+                                   passive_deletes=True)
 
     def __repr__(self):
         return "<Paper(id='%d', doi='%s', arxiv_id='%s')>" % (
@@ -81,7 +159,9 @@ class Paper(Base):
         """
         Dict to dump for the JSON API.
         """
-        relationships = [i.name for i in db.query(Relationship).all()]
+        ids = relationship_registry.ids(db)
+        relationships = list(ids)
+        counts = {i.relationship_id: i for i in self.counts}
         relationships_dict = {
             k: {
                 "links": {
@@ -104,11 +184,24 @@ class Paper(Base):
             "attributes": {
                 "doi": self.doi,
                 "arxiv_id": self.arxiv_id,
+                "oa_url": self.oa_url,
             },
             "links": {
                 "self": "/papers/%d" % (self.id,)
             },
-            "relationships": relationships_dict
+            "relationships": relationships_dict,
+            "meta": {
+                "rank": self.rank.score if self.rank is not None else None,
+                "counts": {
+                    k: {
+                        "in": (counts[ids[k]].in_count
+                               if ids[k] in counts else 0),
+                        "out": (counts[ids[k]].out_count
+                                if ids[k] in counts else 0)
+                    }
+                    for k in relationships
+                }
+            }
         }
 
 
@@ -121,6 +214,100 @@ class Relationship(Base):
                                            passive_deletes=True)
 
 
+class RelationshipRegistry(object):
+    """
+    In-process registry of the names of the relationships, shared by all the
+    serializers of papers.
+
+    It is loaded from the database on first use. The sessions creating a
+    ``Relationship`` must call ``record_created``, so that it is invalidated
+    once they commit. Relationships created by other processes are found by
+    ``id``, which reloads the registry on a miss.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = None
+
+    def ids(self, db):
+        """
+        Get the ids of the relationships.
+
+        :param db: A database session, used if the registry is not loaded.
+        :returns: An ordered dict of the names of the relationships and \
+                their ids.
+        """
+        with self._lock:
+            if self._ids is None:
+                self._ids = collections.OrderedDict(
+                    db.query(Relationship.name, Relationship.id)
+                    .order_by(Relationship.id))
+            return self._ids
+
+    def id(self, name, db):
+        """
+        Get the id of a relationship, reloading the registry if it is not in
+        it (e.g. created by another process).
+
+        :param name: The name of the relationship.
+        :param db: A database session, used if the registry is not loaded.
+        :returns: The id of the relationship, or ``None`` if there is no such \
+                relationship.
+        """
+        id = self.ids(db).get(name)
+        if id is None:
+            self.invalidate()
+            id = self.ids(db).get(name)
+        return id
+
+    def names(self, db):
+        """
+        Get the names of the relationships.
+
+        :param db: A database session, used if the registry is not loaded.
+        :returns: A list of the names of the relationships.
+        """
+        return list(self.ids(db))
+
+    def invalidate(self):
+        """
+        Invalidate the registry, so that it is reloaded on next use.
+        """
+        with self._lock:
+            self._ids = None
+
+    def record_created(self, db):
+        """
+        Record a relationship created in a database session, to invalidate
+        the registry once committed.
+
+        :param db: A database session.
+        :returns: Nothing.
+        """
+        db.info["relationships_created"] = True
+
+
+# Shared registry of relationships names
+relationship_registry = RelationshipRegistry()
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_relationship_registry(session):
+    """
+    Invalidate the registry once the relationships created in a session are
+    committed.
+    """
+    if session.info.pop("relationships_created", False):
+        relationship_registry.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_created_relationships(session):
+    """
+    Discard the relationships created in a session, on rollback.
+    """
+    session.info.pop("relationships_created", None)
+
+
 class Tag(Base):
     __tablename__ = "tags"
     id = Column(Integer, primary_key=True)
@@ -142,6 +329,96 @@ class Tag(Base):
         }
 
 
+class RelationshipCount(Base):
+    """
+    Number of relationships of a paper, in both directions: ``in_count``
+    papers are related to it (e.g. cite it) and it is related to
+    ``out_count`` papers.
+
+    Maintained along with ``relationship_association``, see ``counts.py``.
+    """
+    __tablename__ = "relationship_counts"
+    paper_id = Column(Integer,
+                      ForeignKey("papers.id", ondelete="CASCADE"),
+                      primary_key=True)
+    relationship_id = Column(Integer,
+                             ForeignKey("relationships.id",
+                                        ondelete="CASCADE"),
+                             primary_key=True)
+    in_count = Column(Integer, nullable=False, default=0)
+    out_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Sort and filter the papers on their counts
+        Index("ix_relationship_counts_in", relationship_id, in_count),
+        Index("ix_relationship_counts_out", relationship_id, out_count),
+    )
+
+
+class PaperRank(Base):
+    """
+    PageRank of a paper in the graph of the "cite" relationships, computed
+    by compute_ranks.py.
+    """
+    __tablename__ = "paper_ranks"
+    paper_id = Column(Integer,
+                      ForeignKey("papers.id", ondelete="CASCADE"),
+                      primary_key=True)
+    score = Column(Float, nullable=False, index=True)
+
+
+class SimilarPaper(Base):
+    """
+    Most similar papers of a paper, by co-citation (both papers are cited by
+    the same papers) and bibliographic coupling (both papers cite the same
+    papers), computed by compute_similar.py.
+    """
+    __tablename__ = "similar_papers"
+    paper_id = Column(Integer,
+                      ForeignKey("papers.id", ondelete="CASCADE"),
+                      primary_key=True)
+    # Rank of the similar paper, from 0 for the most similar one
+    position = Column(Integer, primary_key=True, autoincrement=False)
+    similar_id = Column(Integer,
+                        ForeignKey("papers.id", ondelete="CASCADE"),
+                        index=True)
+    score = Column(Float, nullable=False)
+    # Number of papers citing both papers
+    cocitations = Column(Integer, nullable=False, default=0)
+    # Number of papers cited by both papers
+    couplings = Column(Integer, nullable=False, default=0)
+
+
+class SimilarityRefresh(Base):
+    """
+    Papers whose "cite" neighbourhood changed since their similar papers were
+    computed, see ``similarity.py``.
+    """
+    __tablename__ = "similarity_refresh"
+    id = Column(Integer, primary_key=True)
+    paper_id = Column(Integer,
+                      ForeignKey("papers.id", ondelete="CASCADE"),
+                      index=True)
+
+
+class ExtractedCitation(Base):
+    """
+    Citations extracted from the last processed version of a paper, with
+    their resolution, to only resolve the changed ones for a new version.
+    """
+    __tablename__ = "extracted_citations"
+    id = Column(Integer, primary_key=True)
+    paper_id = Column(Integer,
+                      ForeignKey('papers.id', ondelete="CASCADE"),
+                      index=True)
+    # Cleaned plaintext bibitem
+    raw_citation = Column(String())
+    # Citation with identifiers removed
+    citation = Column(String())
+    # DOI or arXiv URL, if resolved
+    url = Column(String(), nullable=True)
+
+
 class CitationProcessingQueue(Base):
     __tablename__ = "citationprocessingqueue"
     id = Column(Integer, primary_key=True)
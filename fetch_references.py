@@ -1,18 +1,194 @@
 #!/usr/bin/env python3
+import argparse
+import json
+import multiprocessing
 import os
 import sys
+import time
 
 # Local import
+import config
 from reference_fetcher import arxiv
 from reference_fetcher import bbl
+from reference_fetcher import cache
+from reference_fetcher import index
+
+
+# Caches of the current (worker) process
+resolution_cache = None
+sources_cache = None
+identifier_index = None
+
+
+def init_caches(offline=False):
+    """
+    Open the caches configured in ``config``, once per process.
+
+    :param offline: Force the offline mode of the sources store.
+    """
+    global resolution_cache, sources_cache, identifier_index
+    if config.resolution_cache is not None:
+        resolution_cache = cache.ResolutionCache(
+            config.resolution_cache,
+            max_entries=config.resolution_cache_max_entries)
+    if config.sources_cache is not None:
+        sources_cache = cache.SourcesCache(
+            config.sources_cache,
+            max_size=config.sources_cache_max_size,
+            offline=(offline or config.sources_cache_offline))
+    if (config.identifier_index is not None and
+            os.path.isfile(config.identifier_index)):
+        identifier_index = index.IdentifierIndex(config.identifier_index)
+
+
+def bulk_tasks(input):
+    """
+    List the papers to process in bulk mode.
+
+    :param input: Either a directory of ``.bbl`` files and e-print tarballs, \
+            or a file of arXiv eprint ids (one per line).
+    :returns: A generator of tuples ``(eprint, kind, path)``, where ``kind`` \
+            is ``bbl``, ``sources`` or ``arxiv``.
+    """
+    if os.path.isdir(input):
+        for name in sorted(os.listdir(input)):
+            path = os.path.join(input, name)
+            if not os.path.isfile(path):
+                continue
+            if name.endswith(".bbl"):
+                yield (name[:-len(".bbl")], "bbl", path)
+            else:
+                for extension in (".tar.gz", ".tgz", ".gz", ".tar"):
+                    if name.endswith(extension):
+                        name = name[:-len(extension)]
+                        break
+                yield (name, "sources", path)
+    else:
+        with open(input, 'r') as fh:
+            for line in fh:
+                eprint = line.strip()
+                if eprint and not eprint.startswith("#"):
+                    yield (eprint, "arxiv", None)
+
+
+def bulk_process(task):
+    """
+    Process a single paper in bulk mode. Runs in a worker process.
+
+    :param task: A tuple ``(eprint, kind, path)``, see ``bulk_tasks``.
+    :returns: A tuple ``(eprint, records)`` where ``records`` is a list of \
+            dicts to be dumped as JSON lines.
+    """
+    eprint, kind, path = task
+    timings = {}
+    try:
+        start = time.perf_counter()
+        if kind == "bbl":
+            bbl_files = [path]
+        elif kind == "sources":
+            with open(path, 'rb') as fh:
+                bbl_files = arxiv.bbl_from_sources(fh)
+        else:
+            bbl_files = arxiv.bbl_from_arxiv(eprint,
+                                             sources_cache=sources_cache)
+        timings["sources"] = time.perf_counter() - start
+        start = time.perf_counter()
+        resolutions = []
+        for bbl_file in bbl_files:
+            resolutions.extend(bbl.resolve_citations(
+                bbl_file, cache=resolution_cache, index=identifier_index))
+        timings["resolution"] = time.perf_counter() - start
+    except Exception as exc:
+        return (eprint, [{"eprint": eprint, "error": repr(exc)}])
+    return (eprint, [
+        {
+            "eprint": eprint,
+            "citation": citation,
+            "identifier": url,
+            "source": source,
+            "timings": timings
+        }
+        for _, citation, url, source in resolutions
+    ])
+
+
+def bulk(input, output, checkpoint=None, workers=None, offline=False):
+    """
+    Process many papers on a pool of processes, streaming the results as JSON
+    lines.
+
+    :param input: See ``bulk_tasks``.
+    :param output: A text file object to write the JSON lines to.
+    :param checkpoint: Optional path to a file listing the successfully \
+            processed papers. Papers listed in it are skipped, so that an \
+            interrupted run can be resumed and the failed papers retried.
+    :param workers: Number of worker processes, defaults to the number of \
+            CPUs.
+    :param offline: Force the offline mode of the sources store.
+    """
+    done = set()
+    if checkpoint is not None and os.path.isfile(checkpoint):
+        with open(checkpoint, 'r') as fh:
+            done = set(line.strip() for line in fh)
+    tasks = (task for task in bulk_tasks(input) if task[0] not in done)
+    checkpoint_fh = open(checkpoint, 'a') if checkpoint is not None else None
+    try:
+        with multiprocessing.Pool(workers or os.cpu_count(),
+                                  initializer=init_caches,
+                                  initargs=(offline,)) as pool:
+            for eprint, records in pool.imap_unordered(bulk_process, tasks):
+                for record in records:
+                    output.write(json.dumps(record) + "\n")
+                output.flush()
+                # Failed papers are retried when resuming
+                failed = any("error" in record for record in records)
+                if checkpoint_fh is not None and not failed:
+                    checkpoint_fh.write(eprint + "\n")
+                    checkpoint_fh.flush()
+    finally:
+        if checkpoint_fh is not None:
+            checkpoint_fh.close()
 
 
 if __name__ == "__main__":
     import pprint
-    if len(sys.argv) < 2:
-        sys.exit("Usage: " + sys.argv[0] + " BBL_FILE|ARXIV_EPRINT.")
+    parser = argparse.ArgumentParser(
+        description="Fetch the DOIs of the references of a paper.")
+    parser.add_argument("input",
+                        help=("BBL_FILE or ARXIV_EPRINT. In bulk mode, a "
+                              "directory of .bbl files and e-print tarballs, "
+                              "or a file of arXiv eprint ids."))
+    parser.add_argument("--bulk", action="store_true",
+                        help="Process many papers, output JSON lines.")
+    parser.add_argument("-o", "--output",
+                        help="Output file in bulk mode (default: stdout).")
+    parser.add_argument("--checkpoint",
+                        help="Checkpoint file to resume a bulk run.")
+    parser.add_argument("--workers", type=int,
+                        help="Number of worker processes in bulk mode.")
+    parser.add_argument("--offline", action="store_true",
+                        help="Never download e-prints.")
+    args = parser.parse_args()
+
+    if args.bulk:
+        if args.output is not None:
+            with open(args.output, 'a') as output:
+                bulk(args.input, output, args.checkpoint, args.workers,
+                     args.offline)
+        else:
+            bulk(args.input, sys.stdout, args.checkpoint, args.workers,
+                 args.offline)
+        sys.exit()
 
-    if os.path.isfile(sys.argv[1]):
-        pprint.pprint(bbl.get_dois(sys.argv[1]))
+    init_caches(args.offline)
+    if os.path.isfile(args.input):
+        pprint.pprint(bbl.get_dois(args.input, cache=resolution_cache,
+                                   index=identifier_index))
     else:
-        pprint.pprint(arxiv.get_cited_dois(sys.argv[1]))
+        try:
+            pprint.pprint(arxiv.get_cited_dois(args.input,
+                                               cache=resolution_cache,
+                                               sources_cache=sources_cache,
+                                               index=identifier_index))
+        except cache.OfflineMiss:
+            sys.exit("%s is not in the local sources store." % (args.input,))
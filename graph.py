@@ -0,0 +1,475 @@
+"""
+This file contains the in-memory graph of the relationships between papers,
+used for traversals (neighbourhoods, transitive closures, shortest paths).
+
+The graph of each relationship is loaded from ``relationship_association`` on
+first use (or at startup, see ``warm``), and kept up to date with the changes
+committed by the database sessions, see ``record_added``, ``record_removed``
+and ``record_deleted_papers``.
+"""
+import array
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import database
+
+
+# Number of edges added or removed since the CSR arrays of an adjacency were
+# built, after which they are rebuilt
+COMPACTION_THRESHOLD = 100000
+# Number of edges fetched at once when loading a relationship
+LOAD_BATCH_SIZE = 100000
+
+
+class Adjacency(object):
+    """
+    Adjacency of a directed graph of papers ids, in compressed sparse row
+    (CSR) format: the successors of the paper ``i`` are
+    ``targets[offsets[i]:offsets[i + 1]]``.
+
+    The edges added and removed afterwards are kept in a delta, which is
+    merged in the CSR arrays once it grows over ``COMPACTION_THRESHOLD``
+    edges.
+
+    :param sources: An ``array`` of the sources of the edges.
+    :param targets: An ``array`` of the targets of the edges, in the same \
+            order.
+    """
+    def __init__(self, sources, targets):
+        self._build(sources, targets)
+
+    def _build(self, sources, targets):
+        """
+        Build the CSR arrays, with a counting sort of the edges on their
+        sources, and reset the delta.
+        """
+        offsets = array.array("q", [0]) * ((max(sources) + 2) if sources
+                                          else 1)
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in range(1, len(offsets)):
+            offsets[i] += offsets[i - 1]
+        positions = array.array("q", offsets)
+        csr_targets = array.array("i", [0]) * len(targets)
+        for source, target in zip(sources, targets):
+            csr_targets[positions[source]] = target
+            positions[source] += 1
+        self._offsets = offsets
+        self._targets = csr_targets
+        # Delta: dict of sources and the set of their added targets, and set
+        # of the removed (source, target) edges
+        self._added = {}
+        self._removed = set()
+        self._delta = 0
+
+    def _base(self, source):
+        """
+        Get the targets of a source in the CSR arrays.
+        """
+        if source + 1 >= len(self._offsets):
+            return array.array("i")
+        return self._targets[self._offsets[source]:self._offsets[source + 1]]
+
+    def successors(self, source):
+        """
+        Get the successors of a paper.
+
+        :param source: The id of the paper.
+        :returns: A list of the ids of its successors.
+        """
+        targets = self._base(source)
+        if self._removed:
+            targets = [target for target in targets
+                       if (source, target) not in self._removed]
+        else:
+            targets = targets.tolist()
+        added = self._added.get(source)
+        if added:
+            targets.extend(added)
+        return targets
+
+    def add(self, source, target):
+        """
+        Add an edge, if not already there.
+        """
+        if (source, target) in self._removed:
+            self._removed.discard((source, target))
+            self._delta -= 1
+            return
+        if (target in self._added.get(source, ()) or
+                target in self._base(source)):
+            return
+        self._added.setdefault(source, set()).add(target)
+        self._delta += 1
+        self._compact()
+
+    def remove(self, source, target):
+        """
+        Remove an edge, if there.
+        """
+        added = self._added.get(source)
+        if added and target in added:
+            added.discard(target)
+            self._delta -= 1
+            return
+        if ((source, target) in self._removed or
+                target not in self._base(source)):
+            return
+        self._removed.add((source, target))
+        self._delta += 1
+        self._compact()
+
+    def edges(self):
+        """
+        Iterate over the edges.
+
+        :returns: A generator of tuples ``(source, target)``.
+        """
+        size = len(self._offsets) - 1
+        for source in range(size):
+            for target in self.successors(source):
+                yield (source, target)
+        for source in sorted(i for i in self._added if i >= size):
+            for target in self._added[source]:
+                yield (source, target)
+
+    def _compact(self):
+        """
+        Merge the delta in the CSR arrays, if it is too large.
+        """
+        if self._delta < COMPACTION_THRESHOLD:
+            return
+        sources = array.array("i")
+        targets = array.array("i")
+        for source, target in self.edges():
+            sources.append(source)
+            targets.append(target)
+        self._build(sources, targets)
+
+
+class CitationGraph(object):
+    """
+    In-process graph of the relationships between papers, with the forward
+    and reverse adjacencies of each relationship.
+
+    All the methods are thread safe. Traversals only hold the lock while
+    getting the successors of a paper, so that they can be streamed, and
+    relationships are loaded without holding it.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Serializes the loads of relationships
+        self._load_lock = threading.Lock()
+        # Dict of relationships names and their (forward, reverse)
+        # adjacencies
+        self._adjacencies = {}
+        # Dict of the relationships being loaded and the changes committed
+        # meanwhile, replayed once loaded
+        self._pending = {}
+
+    def load(self, name, bind):
+        """
+        Load a relationship from the database, if not already loaded.
+
+        The edges are read in a transaction of their own. The changes
+        committed from the start of this transaction until the relationship
+        is loaded are replayed on it.
+
+        :param name: The name of the relationship.
+        :param bind: An ``Engine`` or ``Connection`` of the database, e.g. \
+                ``db.get_bind()`` for a database session.
+        :returns: Whether the relationship exists.
+        """
+        with self._lock:
+            if name in self._adjacencies:
+                return True
+        with self._load_lock:
+            with self._lock:
+                if name in self._adjacencies:
+                    return True
+                self._pending[name] = []
+            adjacencies = None
+            try:
+                adjacencies = self._read(name, bind)
+            finally:
+                with self._lock:
+                    changes = self._pending.pop(name)
+                    if adjacencies is not None:
+                        self._adjacencies[name] = adjacencies
+                        self._apply(changes, only=name)
+            return adjacencies is not None
+
+    def _read(self, name, bind):
+        """
+        Read the edges of a relationship from the database, in a new session.
+
+        :returns: A tuple of its forward and reverse ``Adjacency``, or \
+                ``None`` if the relationship does not exist.
+        """
+        db = Session(bind=bind)
+        try:
+            relationship = (db.query(database.Relationship)
+                            .filter_by(name=name)
+                            .first())
+            if relationship is None:
+                return None
+            sources = array.array("i")
+            targets = array.array("i")
+            edges = (db.query(database.RelationshipAssociation.left_id,
+                              database.RelationshipAssociation.right_id)
+                     .filter_by(relationship_id=relationship.id)
+                     .yield_per(LOAD_BATCH_SIZE))
+            for left_id, right_id in edges:
+                sources.append(left_id)
+                targets.append(right_id)
+        finally:
+            db.close()
+        return (Adjacency(sources, targets), Adjacency(targets, sources))
+
+    def invalidate(self):
+        """
+        Drop all the loaded relationships, so that they are reloaded from the
+        database on next use.
+        """
+        with self._lock:
+            self._adjacencies = {}
+
+    def successors(self, name, id, reverse=False):
+        """
+        Get the successors of a paper.
+
+        :param name: The name of a loaded relationship.
+        :param id: The id of the paper.
+        :param reverse: Get the predecessors instead (e.g. the citing \
+                papers for ``cite``).
+        :returns: A list of papers ids.
+        """
+        with self._lock:
+            adjacencies = self._adjacencies.get(name)
+            if adjacencies is None:
+                return []
+            return adjacencies[1 if reverse else 0].successors(id)
+
+    def apply(self, changes):
+        """
+        Apply some changes to the loaded relationships.
+
+        :param changes: A list of changes, see ``record_added``.
+        :returns: Nothing.
+        """
+        with self._lock:
+            for name, pending in self._pending.items():
+                pending.extend(change for change in changes
+                               if change[1] in (None, name))
+            self._apply(changes)
+
+    def _apply(self, changes, only=None):
+        """
+        Apply some changes to the loaded relationships, see ``apply``. The
+        lock must be held.
+
+        :param only: Only apply them to this relationship, if not ``None``.
+        """
+        for kind, name, edges in changes:
+            if kind == "deleted_papers":
+                if only is not None:
+                    adjacencies = [self._adjacencies[only]]
+                else:
+                    adjacencies = self._adjacencies.values()
+                for forward, backward in adjacencies:
+                    for id in edges:
+                        for target in forward.successors(id):
+                            forward.remove(id, target)
+                            backward.remove(target, id)
+                        for source in backward.successors(id):
+                            backward.remove(id, source)
+                            forward.remove(source, id)
+                continue
+            adjacencies = self._adjacencies.get(name)
+            if adjacencies is None:
+                # Not loaded, will be up to date when loaded
+                continue
+            forward, backward = adjacencies
+            for source, target in edges:
+                if kind == "added":
+                    forward.add(source, target)
+                    backward.add(target, source)
+                else:
+                    forward.remove(source, target)
+                    backward.remove(target, source)
+
+    def traverse(self, name, id, depth, reverse=False):
+        """
+        Breadth-first traversal of a loaded relationship from a paper.
+
+        :param name: The name of the relationship.
+        :param id: The id of the starting paper.
+        :param depth: Maximum number of steps from the starting paper.
+        :param reverse: Follow the relationship backwards.
+        :returns: A generator of tuples ``(id, depth)`` of the papers \
+                reachable from the starting paper (excluded), by increasing \
+                depth.
+        """
+        seen = set([id])
+        frontier = [id]
+        for distance in range(1, depth + 1):
+            next_frontier = []
+            for node in frontier:
+                for successor in self.successors(name, node, reverse):
+                    if successor not in seen:
+                        seen.add(successor)
+                        next_frontier.append(successor)
+                        yield (successor, distance)
+            if not next_frontier:
+                return
+            frontier = next_frontier
+
+    def shortest_path(self, name, source, target, max_depth, reverse=False):
+        """
+        Find a shortest path between two papers in a loaded relationship, with
+        a bidirectional breadth-first search.
+
+        :param name: The name of the relationship.
+        :param source: The id of the paper to start from.
+        :param target: The id of the paper to reach.
+        :param max_depth: Maximum length of the path.
+        :param reverse: Follow the relationship backwards.
+        :returns: A list of the papers ids on the path, from ``source`` to \
+                ``target``, or ``None`` if there is no such path.
+        """
+        if source == target:
+            return [source]
+        # Dicts of the reached papers, and their parent and depth
+        forward = {source: (None, 0)}
+        backward = {target: (None, 0)}
+        forward_frontier = [source]
+        backward_frontier = [target]
+        depth = 0
+        while depth < max_depth and forward_frontier and backward_frontier:
+            # Expand the smaller side by a full layer
+            if len(forward_frontier) <= len(backward_frontier):
+                frontier, reached, other = forward_frontier, forward, backward
+                direction = reverse
+            else:
+                frontier, reached, other = (backward_frontier, backward,
+                                            forward)
+                direction = not reverse
+            next_frontier = []
+            meeting = None
+            for node in frontier:
+                node_depth = reached[node][1] + 1
+                for successor in self.successors(name, node, direction):
+                    if successor in reached:
+                        continue
+                    reached[successor] = (node, node_depth)
+                    next_frontier.append(successor)
+                    if successor in other:
+                        length = node_depth + other[successor][1]
+                        if meeting is None or length < meeting[1]:
+                            meeting = (successor, length)
+            if meeting is not None:
+                if meeting[1] > max_depth:
+                    return None
+                path = []
+                node = meeting[0]
+                while node is not None:
+                    path.append(node)
+                    node = forward[node][0]
+                path.reverse()
+                node = backward[meeting[0]][0]
+                while node is not None:
+                    path.append(node)
+                    node = backward[node][0]
+                return path
+            if frontier is forward_frontier:
+                forward_frontier = next_frontier
+            else:
+                backward_frontier = next_frontier
+            depth += 1
+        return None
+
+
+# Shared graph of the relationships between papers
+citation_graph = CitationGraph()
+
+
+def warm(bind, names=("cite",)):
+    """
+    Load some relationships in the shared graph in a background thread, e.g.
+    at startup, so that the first traversal does not wait for it.
+
+    :param bind: An ``Engine`` of the database.
+    :param names: The names of the relationships to load.
+    :returns: The started ``Thread``.
+    """
+    def load():
+        for name in names:
+            citation_graph.load(name, bind)
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
+
+
+def _record(db, change):
+    """
+    Record a change of the graph in a database session, to be applied on
+    commit.
+    """
+    db.info.setdefault("graph_changes", []).append(change)
+
+
+def record_added(db, name, edges):
+    """
+    Record relationships added in a database session.
+
+    :param db: A database session.
+    :param name: The name of the relationship.
+    :param edges: A list of tuples ``(left_id, right_id)``.
+    :returns: Nothing.
+    """
+    _record(db, ("added", name, list(edges)))
+
+
+def record_removed(db, name, edges):
+    """
+    Record relationships removed in a database session.
+
+    :param db: A database session.
+    :param name: The name of the relationship.
+    :param edges: A list of tuples ``(left_id, right_id)``.
+    :returns: Nothing.
+    """
+    _record(db, ("removed", name, list(edges)))
+
+
+def record_deleted_papers(db, ids):
+    """
+    Record papers deleted in a database session, along with all their
+    relationships.
+
+    :param db: A database session.
+    :param ids: A list of papers ids.
+    :returns: Nothing.
+    """
+    _record(db, ("deleted_papers", None, list(ids)))
+
+
+@event.listens_for(Session, "after_commit")
+def apply_graph_changes(session):
+    """
+    Apply the changes recorded in a session to the graph, once committed.
+    """
+    changes = session.info.pop("graph_changes", None)
+    if changes:
+        citation_graph.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_graph_changes(session):
+    """
+    Discard the changes recorded in a session, on rollback.
+    """
+    session.info.pop("graph_changes", None)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from sqlalchemy import bindparam
+from sqlalchemy.orm import sessionmaker
+
+# Local import
+import config
+import database
+from reference_fetcher import dumps
+from routes import post
+from reference_fetcher import regex
+
+
+# Number of papers upserted in a single transaction
+BATCH_SIZE = 10000
+
+
+def mappings(records):
+    """
+    Get the arXiv eprint id and DOI mappings from dump records.
+
+    :param records: An iterable of records, see ``reference_fetcher.dumps``.
+    :returns: A generator of ``(arxiv_id, doi)`` tuples, arXiv eprint ids \
+            being without version and DOIs lowercased, as the references \
+            pipeline gives them.
+    """
+    for record in records:
+        if record.get("arxiv_id") and record.get("doi"):
+            yield (regex.arxiv_version.sub("", record["arxiv_id"].strip()),
+                   record["doi"].strip().lower())
+
+
+def upsert_batch(batch, db):
+    """
+    Upsert a batch of arXiv eprint id and DOI mappings in the papers table.
+
+    New papers are inserted with ``imported`` set. Papers already known by
+    one of their identifiers get the other one if they do not have it yet.
+    Conflicting mappings are skipped.
+
+    :param batch: A list of ``(arxiv_id, doi)`` tuples.
+    :param db: A database session.
+    :returns: A tuple ``(inserted, updated)`` of the number of papers.
+    """
+    papers = database.Paper.__table__
+    # Keep a single mapping per identifier
+    by_arxiv_id = {}
+    by_doi = {}
+    for arxiv_id, doi in batch:
+        if arxiv_id not in by_arxiv_id and doi not in by_doi:
+            by_arxiv_id[arxiv_id] = doi
+            by_doi[doi] = arxiv_id
+    query = db.query(database.Paper.id,
+                     database.Paper.arxiv_id,
+                     database.Paper.doi)
+    existing = (
+        post._query_in(query, database.Paper.arxiv_id, list(by_arxiv_id)) +
+        post._query_in(query, database.Paper.doi, list(by_doi)))
+    known_arxiv_ids = {row.arxiv_id: row for row in existing
+                       if row.arxiv_id is not None}
+    known_dois = {row.doi: row for row in existing if row.doi is not None}
+    inserts = []
+    doi_updates = []
+    arxiv_id_updates = []
+    for arxiv_id, doi in by_arxiv_id.items():
+        paper_by_arxiv_id = known_arxiv_ids.get(arxiv_id)
+        paper_by_doi = known_dois.get(doi)
+        if paper_by_arxiv_id is None and paper_by_doi is None:
+            inserts.append({"arxiv_id": arxiv_id, "doi": doi,
+                            "imported": True})
+        elif paper_by_doi is None and paper_by_arxiv_id.doi is None:
+            doi_updates.append({"_id": paper_by_arxiv_id.id, "doi": doi})
+        elif paper_by_arxiv_id is None and paper_by_doi.arxiv_id is None:
+            arxiv_id_updates.append({"_id": paper_by_doi.id,
+                                     "arxiv_id": arxiv_id})
+    if inserts:
+        db.execute(papers.insert(), inserts)
+    if doi_updates:
+        db.execute(papers.update()
+                   .where(papers.c.id == bindparam("_id"))
+                   .values(doi=bindparam("doi")),
+                   doi_updates)
+    if arxiv_id_updates:
+        db.execute(papers.update()
+                   .where(papers.c.id == bindparam("_id"))
+                   .values(arxiv_id=bindparam("arxiv_id")),
+                   arxiv_id_updates)
+    return (len(inserts), len(doi_updates) + len(arxiv_id_updates))
+
+
+def import_papers(paths, create_session, batch_size=BATCH_SIZE):
+    """
+    Import the arXiv eprint id and DOI mappings of metadata dumps in the
+    papers table, streaming the dumps and committing every ``batch_size``
+    mappings.
+
+    :param paths: A list of paths to dump files or directories, see \
+            ``reference_fetcher.dumps.iter_records``.
+    :param create_session: A ``SQLAlchemy`` ``sessionmaker``.
+    :param batch_size: Number of mappings upserted in a single transaction.
+    :returns: A tuple ``(inserted, updated)`` of the number of papers.
+    """
+    inserted = updated = 0
+    db = create_session()
+    try:
+        batch = []
+        for mapping in mappings(dumps.iter_records(paths)):
+            batch.append(mapping)
+            if len(batch) >= batch_size:
+                counts = upsert_batch(batch, db)
+                db.commit()
+                inserted += counts[0]
+                updated += counts[1]
+                batch = []
+        if batch:
+            counts = upsert_batch(batch, db)
+            db.commit()
+            inserted += counts[0]
+            updated += counts[1]
+    finally:
+        db.close()
+    return (inserted, updated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Import the arXiv eprint id and DOI mappings of "
+                     "metadata dumps in the papers table."))
+    parser.add_argument("dumps", nargs="+",
+                        help=("arXiv OAI-PMH harvests (.xml) or arXiv JSON "
+                              "lines (.jsonl), possibly gzipped, or "
+                              "directories of them."))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Number of papers upserted per transaction.")
+    args = parser.parse_args()
+
+    engine = database.get_engine(config.database_url,
+                                 echo=config.database_echo,
+                                 sqlite_pragmas=config.sqlite_pragmas,
+                                 pool=config.database_pool)
+    database.Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    inserted, updated = import_papers(args.dumps, sessionmaker(bind=engine),
+                                      args.batch_size)
+    print("Imported %d new papers and updated %d papers in %.1fs." % (
+        inserted, updated, time.perf_counter() - start))
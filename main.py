@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
 import bottle
 from bottle.ext import sqlalchemy
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 import config
 import database
+import graph
 import routes
 import tools
 
 # Initialize db and include the SQLAlchemy plugin in bottle
-engine = create_engine('sqlite:///%s' % (config.database,), echo=True)
+engine = database.get_engine(config.database_url,
+                             echo=config.database_echo,
+                             sqlite_pragmas=config.sqlite_pragmas,
+                             pool=config.database_pool)
 create_session = sessionmaker(bind=engine)
 database.Base.metadata.create_all(engine)
 
@@ -49,6 +52,14 @@ app.get("/papers", callback=routes.get.fetch_papers)
 app.get("/papers/<id:int>", callback=routes.get.fetch_papers_by_id)
 app.get("/papers/<id:int>/relationships/<name>",
         callback=routes.get.fetch_relationship)
+app.get("/papers/<id:int>/graph", callback=routes.get.fetch_graph)
+app.get("/papers/<id:int>/graph/<name>",
+        callback=routes.get.fetch_graph_neighbours)
+app.get("/papers/<id:int>/graph/<name>/transitive",
+        callback=routes.get.fetch_graph_transitive)
+app.get("/papers/<id:int>/graph/<name>/path/<target:int>",
+        callback=routes.get.fetch_graph_path)
+app.get("/papers/<id:int>/similar", callback=routes.get.fetch_similar)
 app.get("/papers/<id:int>/<name>",
         callback=routes.get.fetch_relationship)
 app.route("/papers/<id:int>", method="DELETE",
@@ -73,5 +84,7 @@ app.route("/papers/<id:int>/relationships/<name>", method="PATCH",
 
 
 if __name__ == "__main__":
+    routes.post.init_caches()
+    graph.warm(engine)
     routes.post.fetch_citations_in_queue(create_session)
     app.run(host=config.host, port=config.port, debug=(not config.production))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from sqlalchemy import inspect, text
+
+# Local import
+import config
+import counts
+import database
+
+
+def deduplicate(connection):
+    """
+    Remove the duplicate relationships and tags of papers, which were allowed
+    before the unique indexes on ``relationship_association`` and
+    ``tag_association``.
+
+    :param connection: A ``SQLAlchemy`` connection, in a transaction.
+    :returns: A dict of the tables and their number of removed rows.
+    """
+    removed = {}
+    # Keep the first occurrence of each relationship
+    removed["relationship_association"] = connection.execute(text(
+        "DELETE FROM relationship_association WHERE id NOT IN ("
+        "SELECT MIN(id) FROM relationship_association "
+        "GROUP BY left_id, right_id, relationship_id)")).rowcount
+    # tag_association has no primary key, rebuild it from its distinct rows
+    count = connection.execute(text(
+        "SELECT COUNT(*) FROM tag_association")).scalar()
+    connection.execute(text(
+        "CREATE TEMPORARY TABLE tag_association_distinct AS "
+        "SELECT DISTINCT paper_id, tag_id FROM tag_association"))
+    distinct = connection.execute(text(
+        "SELECT COUNT(*) FROM tag_association_distinct")).scalar()
+    if distinct < count:
+        connection.execute(text("DELETE FROM tag_association"))
+        connection.execute(text(
+            "INSERT INTO tag_association (paper_id, tag_id) "
+            "SELECT paper_id, tag_id FROM tag_association_distinct"))
+    connection.execute(text("DROP TABLE tag_association_distinct"))
+    removed["tag_association"] = count - distinct
+    return removed
+
+
+# Columns added to the existing papers table, and their SQL definition
+PAPERS_COLUMNS = [
+    ("oa_url", "VARCHAR"),
+    ("extracted_version", "VARCHAR(30)"),
+    ("imported", "BOOLEAN NOT NULL DEFAULT FALSE"),
+]
+
+
+def add_columns(connection):
+    """
+    Add the missing columns to the ``papers`` table.
+
+    :param connection: A ``SQLAlchemy`` connection, in a transaction.
+    :returns: A list of the names of the added columns.
+    """
+    existing = set(column["name"]
+                   for column in inspect(connection).get_columns(
+                       database.Paper.__tablename__))
+    added = []
+    for name, definition in PAPERS_COLUMNS:
+        if name not in existing:
+            connection.execute(text("ALTER TABLE papers ADD COLUMN %s %s" % (
+                name, definition)))
+            added.append(name)
+    return added
+
+
+def upgrade(engine):
+    """
+    Upgrade an existing database: add the missing columns, deduplicate the
+    relationships and tags of papers, create the missing indexes and fill
+    the numbers of relationships of the papers.
+
+    :param engine: A ``SQLAlchemy`` engine.
+    :returns: A tuple ``(added, removed)`` of the list of the added columns \
+            of ``papers`` and the dict of the tables and their number of \
+            removed rows.
+    """
+    # Create the missing tables
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        added = add_columns(connection)
+        removed = deduplicate(connection)
+        # The counts table may have been created (empty) by the API before
+        # the upgrade, and the duplicates removed were counted
+        counts.recompute(connection)
+        for table in (database.RelationshipAssociation.__table__,
+                      database.tag_association_table):
+            existing = set(index["name"]
+                           for index in inspect(connection).get_indexes(
+                               table.name))
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(connection)
+    return (added, removed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upgrade the database to the current schema.")
+    parser.parse_args()
+
+    engine = database.get_engine(config.database_url,
+                                 echo=config.database_echo,
+                                 sqlite_pragmas=config.sqlite_pragmas,
+                                 pool=config.database_pool)
+    start = time.perf_counter()
+    added, removed = upgrade(engine)
+    print("Upgraded the database in %.1fs, added columns %s, removed %s." % (
+        time.perf_counter() - start,
+        ", ".join(added) or "none",
+        ", ".join("%d duplicate rows from %s" % (count, table)
+                  for table, count in sorted(removed.items()))))
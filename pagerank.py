@@ -0,0 +1,270 @@
+"""
+This file contains the batch computation of the PageRank of the papers in the
+graph of the "cite" relationships, stored in ``paper_ranks``.
+
+The edges are loaded in two arrays of papers ids (possibly memory-mapped
+files), and the power iteration is vectorized with NumPy, by chunks of edges
+so that the temporary arrays have a bounded size. The iteration starts from
+the previous scores, so that a recomputation after some edges were added
+converges in a few iterations.
+"""
+import itertools
+import os
+
+import numpy
+from sqlalchemy import bindparam, func, select
+
+import database
+
+
+# Damping factor, probability to follow a citation rather than to jump to a
+# random paper
+DAMPING = 0.85
+# Stop once the L1 norm of the change of the scores is under this tolerance
+TOLERANCE = 1e-6
+MAX_ITERATIONS = 100
+# Number of edges processed at once in an iteration
+CHUNK_SIZE = 1000000
+# Number of rows fetched or stored at once
+BATCH_SIZE = 100000
+
+
+def _load_ids(connection, statement, count, columns, directory=None):
+    """
+    Load integer columns of a query in arrays, by batches of
+    ``BATCH_SIZE`` rows.
+
+    :param connection: A ``SQLAlchemy`` connection.
+    :param statement: A ``SELECT`` statement.
+    :param count: The number of rows of the statement.
+    :param columns: The number of columns of the statement.
+    :param directory: If given, the arrays are memory-mapped files in this \
+            directory.
+    :returns: A list of ``numpy`` arrays, one for each column.
+    """
+    if directory is None:
+        arrays = [numpy.empty(count, dtype=numpy.int32)
+                  for _ in range(columns)]
+    else:
+        arrays = [numpy.memmap(os.path.join(directory, "%d.int32" % (i,)),
+                               dtype=numpy.int32, mode="w+",
+                               shape=(max(count, 1),))[:count]
+                  for i in range(columns)]
+    position = 0
+    result = connection.execution_options(
+        stream_results=True, yield_per=BATCH_SIZE).execute(statement)
+    for rows in result.partitions():
+        # Flatten the rows, numpy.array is slow on SQLAlchemy rows
+        rows = numpy.fromiter(itertools.chain.from_iterable(rows),
+                              dtype=numpy.int32,
+                              count=len(rows) * columns).reshape(-1, columns)
+        # Rows may have been added since the count
+        rows = rows[:count - position]
+        for i in range(columns):
+            arrays[i][position:position + len(rows)] = rows[:, i]
+        position += len(rows)
+    return [array[:position] for array in arrays]
+
+
+def load_graph(connection, directory=None):
+    """
+    Load the papers and the "cite" edges.
+
+    :param connection: A ``SQLAlchemy`` connection.
+    :param directory: If given, the edges are memory-mapped files in this \
+            directory, so that they do not have to fit in memory.
+    :returns: A tuple ``(exists, sources, targets)``, ``exists`` being a \
+            boolean array indexed by papers ids of the existing papers, \
+            and ``sources`` and ``targets`` the arrays of the ids of the \
+            citing and cited papers, both existing.
+    """
+    Paper = database.Paper
+    RelationshipAssociation = database.RelationshipAssociation
+    max_id = connection.execute(select(func.max(Paper.id))).scalar() or 0
+    count = connection.execute(select(func.count(Paper.id))).scalar()
+    ids, = _load_ids(connection, select(Paper.id), count, 1)
+    exists = numpy.zeros(max_id + 1, dtype=bool)
+    exists[ids] = True
+    del ids
+
+    relationship_id = connection.execute(
+        select(database.Relationship.id)
+        .where(database.Relationship.name == "cite")).scalar()
+    edges = (select(RelationshipAssociation.left_id,
+                    RelationshipAssociation.right_id)
+             .where(RelationshipAssociation.relationship_id ==
+                    relationship_id))
+    count = connection.execute(
+        select(func.count()).select_from(edges.subquery())).scalar()
+    sources, targets = _load_ids(connection, edges, count, 2, directory)
+    # Papers committed since the papers were loaded are ignored, even with a
+    # lower id than the loaded ones, so that no score leaks along edges to
+    # papers without any score
+    valid = ((sources <= max_id) & (targets <= max_id))
+    valid[valid] = (exists[sources[valid]] & exists[targets[valid]])
+    if not valid.all():
+        sources, targets = sources[valid], targets[valid]
+    return (exists, sources, targets)
+
+
+def load_scores(connection, size):
+    """
+    Load the previous scores.
+
+    :param connection: A ``SQLAlchemy`` connection.
+    :param size: Size of the array of scores, the maximum paper id + 1.
+    :returns: An array of the scores indexed by papers ids, 0 for the papers \
+            without a score.
+    """
+    scores = numpy.zeros(size)
+    result = connection.execution_options(
+        stream_results=True, yield_per=BATCH_SIZE).execute(
+            select(database.PaperRank.paper_id, database.PaperRank.score)
+            .where(database.PaperRank.paper_id < size))
+    for rows in result.partitions():
+        ids, values = zip(*rows)
+        scores[numpy.array(ids)] = values
+    return scores
+
+
+def pagerank(exists, sources, targets, initial=None, damping=DAMPING,
+             tolerance=TOLERANCE, max_iterations=MAX_ITERATIONS,
+             chunk_size=CHUNK_SIZE):
+    """
+    Compute the PageRank of the papers with a power iteration.
+
+    The scores of the papers without any citation (dangling papers) are
+    spread over all the papers, as the random jumps are.
+
+    :param exists: A boolean array indexed by papers ids of the existing \
+            papers.
+    :param sources: An array of the ids of the citing papers, existing ones \
+            only.
+    :param targets: An array of the ids of the cited papers, existing ones \
+            only.
+    :param initial: An optional array of scores to start from (e.g. the \
+            previous ones), indexed by papers ids.
+    :param damping: The damping factor.
+    :param tolerance: Stop once the L1 norm of the change of the scores is \
+            under this tolerance.
+    :param max_iterations: Maximum number of iterations.
+    :param chunk_size: Number of edges processed at once.
+    :returns: A tuple ``(scores, iterations, delta)`` of the array of the \
+            scores (summing to 1) indexed by papers ids, the number of \
+            iterations and the last change of the scores.
+    """
+    size = len(exists)
+    count = numpy.count_nonzero(exists)
+    if count == 0:
+        return (numpy.zeros(size), 0, 0.0)
+    teleport = exists / count
+    out_degree = numpy.zeros(size)
+    for i in range(0, len(sources), chunk_size):
+        out_degree += numpy.bincount(sources[i:i + chunk_size],
+                                     minlength=size)
+    dangling = exists & (out_degree == 0)
+    inverse_degree = numpy.divide(1.0, out_degree,
+                                  out=numpy.zeros(size),
+                                  where=(out_degree > 0))
+    del out_degree
+
+    scores = teleport
+    if initial is not None:
+        initial = numpy.where(exists, initial[:size], 0.0)
+        if initial.sum() > 0:
+            # New papers start from the average score
+            initial[exists & (initial == 0)] = initial.sum() / count
+            scores = initial / initial.sum()
+    delta = 0.0
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        weights = scores * inverse_degree
+        new_scores = numpy.zeros(size)
+        for i in range(0, len(sources), chunk_size):
+            new_scores += numpy.bincount(
+                targets[i:i + chunk_size],
+                weights=weights[sources[i:i + chunk_size]],
+                minlength=size)
+        new_scores *= damping
+        new_scores += (damping * scores[dangling].sum() +
+                       1 - damping) * teleport
+        delta = numpy.abs(new_scores - scores).sum()
+        scores = new_scores
+        if delta < tolerance:
+            break
+    return (scores, iteration, float(delta))
+
+
+def store_scores(engine, exists, scores):
+    """
+    Store the scores of the existing papers, by transactions of
+    ``BATCH_SIZE`` papers, so that the API is not locked out meanwhile.
+
+    :param engine: A ``SQLAlchemy`` engine.
+    :param exists: A boolean array indexed by papers ids of the existing \
+            papers.
+    :param scores: An array of the scores indexed by papers ids.
+    :returns: The number of stored scores, the papers deleted meanwhile \
+            not being stored.
+    """
+    table = database.PaperRank.__table__
+    update = (table.update()
+              .where(table.c.paper_id == bindparam("b_paper_id"))
+              .values(score=bindparam("b_score")))
+    ids = numpy.flatnonzero(exists)
+    stored = 0
+    for i in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[i:i + BATCH_SIZE]
+        with engine.begin() as connection:
+            existing = set(
+                paper_id for paper_id, in connection.execute(
+                    select(table.c.paper_id)
+                    .where(table.c.paper_id >= int(chunk[0]))
+                    .where(table.c.paper_id <= int(chunk[-1]))))
+            # Papers may have been deleted since they were loaded
+            papers = set(
+                paper_id for paper_id, in connection.execute(
+                    select(database.Paper.id)
+                    .where(database.Paper.id >= int(chunk[0]))
+                    .where(database.Paper.id <= int(chunk[-1]))))
+            updated = []
+            inserted = []
+            for paper_id, score in zip(chunk.tolist(),
+                                       scores[chunk].tolist()):
+                if paper_id not in papers:
+                    continue
+                if paper_id in existing:
+                    updated.append({"b_paper_id": paper_id,
+                                    "b_score": score})
+                else:
+                    inserted.append({"paper_id": paper_id, "score": score})
+            if updated:
+                result = connection.execute(update, updated)
+                stored += (result.rowcount
+                           if connection.dialect.supports_sane_multi_rowcount
+                           else len(updated))
+            if inserted:
+                connection.execute(table.insert(), inserted)
+                stored += len(inserted)
+    return stored
+
+
+def update_ranks(engine, warm_start=True, directory=None, **kwargs):
+    """
+    Compute the PageRank of the papers and store it.
+
+    :param engine: A ``SQLAlchemy`` engine.
+    :param warm_start: Start from the previous scores.
+    :param directory: If given, the edges are memory-mapped files in this \
+            directory.
+    :param kwargs: Other parameters of ``pagerank``.
+    :returns: A tuple ``(papers, edges, iterations, delta)``.
+    """
+    with engine.connect() as connection:
+        exists, sources, targets = load_graph(connection, directory)
+        initial = (load_scores(connection, len(exists)) if warm_start
+                   else None)
+    scores, iterations, delta = pagerank(exists, sources, targets,
+                                         initial=initial, **kwargs)
+    papers = store_scores(engine, exists, scores)
+    return (papers, len(sources), iterations, delta)
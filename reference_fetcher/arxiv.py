@@ -1,88 +1,438 @@
 """
 This file contains all the arXiv-specific functions.
 """
-import io
-import requests
+import codecs
+import contextlib
+import gzip
+import itertools
 import tarfile
 import xml.etree.ElementTree
 
 from . import bbl
+from . import client
+from . import coalesce
+from . import instrumentation
+from . import regex
 
 
+class PrefixedReader(object):
+    """
+    Read-only file-like object reading some already consumed bytes and then
+    the rest of a stream. Used to sniff the beginning of a stream which cannot
+    be rewound.
+
+    :param prefix: The bytes already read from the stream.
+    :param fileobj: The stream to continue reading from.
+    """
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.prefix + self.fileobj.read()
+            self.prefix = b""
+            return data
+        if len(self.prefix) >= size:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+            return data
+        data = self.prefix + self.fileobj.read(size - len(self.prefix))
+        self.prefix = b""
+        return data
+
+
+class CountingReader(object):
+    """
+    Read-only file-like object counting the bytes read from a stream.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.count += len(data)
+        return data
+
+
+def read_at_least(fileobj, size):
+    """
+    Read ``size`` bytes from a stream, less only if it ends before.
+    """
+    data = b""
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+BEGIN_THEBIBLIOGRAPHY = "\\begin{thebibliography}"
+END_THEBIBLIOGRAPHY = "\\end{thebibliography}"
+
+
+@contextlib.contextmanager
 def sources_from_arxiv(eprint):
     """
     Download sources on arXiv for a given preprint.
 
     :param eprint: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``).
-    :returns: A ``TarFile`` object of the sources of the arXiv preprint.
+    :returns: A context manager giving a binary file-like object streaming \
+            the raw e-print, without buffering it. The response is closed \
+            on exit, even if the e-print was not read entirely.
+    """
+    r = client.get_client().get("http://arxiv.org/e-print/%s" % (eprint,),
+                                stream=True)
+    try:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        yield r.raw
+    finally:
+        r.close()
+
+
+def bbl_from_sources(fileobj):
+    """
+    Get the .bbl files (if any) of an arXiv e-print, reading it as a stream.
+
+    Only the ``.bbl`` members of the e-print are kept in memory. An e-print
+    can be a (gzipped) tarball, a single gzipped ``.tex`` or ``.bbl`` file
+    (see ``bbl_from_single_file``), or a PDF, which has no ``.bbl`` file.
+
+    :param fileobj: A binary file-like object of the e-print.
+    :returns: A list of the ``.bbl`` files as text (if any).
+    """
+    head = read_at_least(fileobj, 2)
+    if head.startswith(b"%P"):
+        # PDF-only submission
+        return []
+    fileobj = PrefixedReader(head, fileobj)
+    if head == b"\x1f\x8b":
+        fileobj = gzip.GzipFile(fileobj=fileobj)
+    # Tarballs have the "ustar" magic in their first header block
+    head = read_at_least(fileobj, tarfile.BLOCKSIZE)
+    fileobj = PrefixedReader(head, fileobj)
+    if head[257:262] == b"ustar":
+        bbl_files = []
+        with tarfile.open(fileobj=fileobj, mode="r|") as tf:
+            for member in tf:
+                if member.isfile() and member.name.endswith(".bbl"):
+                    bbl_files.append(
+                        tf.extractfile(member).read().decode(tarfile.ENCODING))
+        return bbl_files
+    # Single file submission
+    return bbl_from_single_file(
+        codecs.getreader(tarfile.ENCODING)(fileobj, errors="replace"))
+
+
+def bbl_from_single_file(lines):
     """
-    r = requests.get("http://arxiv.org/e-print/%s" % (eprint,))
-    file_object = io.BytesIO(r.content)
-    return tarfile.open(fileobj=file_object)
+    Get the .bbl files (if any) of a single file e-print, reading it line by
+    line.
 
+    A ``.bbl`` file (``thebibliography`` or biblatex one) is returned as is.
+    Only the ``thebibliography`` environments of a ``.tex`` file are kept in
+    memory and returned.
 
-def bbl_from_arxiv(eprint):
+    :param lines: An iterable of the lines of the file, as text.
+    :returns: A list of the ``.bbl`` files as text (if any).
+    """
+    lines = iter(lines)
+    # Look at the first non blank line to guess the type of the file
+    head = []
+    for line in lines:
+        head.append(line)
+        if line.strip():
+            break
+    if head and head[0].startswith("%PDF"):
+        return []
+    if head and regex.bbl_head.match(head[-1]):
+        return ["".join(itertools.chain(head, lines))]
+    bbl_files = []
+    # Lines of the current thebibliography environment, if any
+    current = None
+    for line in itertools.chain(head, lines):
+        pos = 0
+        while True:
+            if current is None:
+                pos = line.find(BEGIN_THEBIBLIOGRAPHY, pos)
+                if pos < 0:
+                    break
+                current = []
+            end = line.find(END_THEBIBLIOGRAPHY, pos)
+            if end < 0:
+                current.append(line[pos:])
+                break
+            end += len(END_THEBIBLIOGRAPHY)
+            current.append(line[pos:end])
+            bbl_files.append("".join(current))
+            current = None
+            pos = end
+    return bbl_files
+
+
+def bbl_from_arxiv(eprint, sources_cache=None):
     """
     Get the .bbl files (if any) of a given preprint.
 
     :param eprint: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``).
-    :returns: A list of the ``.bbl`` files as text (if any) or ``None``.
+    :param sources_cache: An optional ``cache.SourcesCache`` to get the \
+            ``.bbl`` files from, instead of downloading them.
+    :returns: A list of the ``.bbl`` files as text (if any).
     """
-    tf = sources_from_arxiv(eprint)
-    bbl_files = [i for i in tf.getmembers() if i.name.endswith(".bbl")]
-    bbl_files = [tf.extractfile(member).read().decode(tarfile.ENCODING)
-                 for member in bbl_files]
+    with instrumentation.stage("sources") as timer:
+        def download(eprint):
+            with sources_from_arxiv(eprint) as fileobj:
+                if instrumentation.enabled():
+                    fileobj = CountingReader(fileobj)
+                bbl_files = bbl_from_sources(fileobj)
+            timer.add("downloads")
+            timer.add("bytes", getattr(fileobj, "count", 0))
+            return bbl_files
+
+        if sources_cache is not None:
+            bbl_files = sources_cache.fetch(eprint, download)
+        else:
+            bbl_files = download(eprint)
+        timer.add("bbl_files", len(bbl_files))
     return bbl_files
 
 
-def get_cited_dois(eprint):
+def get_cited_dois(eprint, cache=None, sources_cache=None, index=None):
     """
     Get the .bbl files (if any) of a given preprint.
 
     :param eprint: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``).
+    :param cache: An optional ``cache.ResolutionCache`` of citations \
+            resolutions, see ``bbl.get_dois``.
+    :param sources_cache: An optional ``cache.SourcesCache`` of e-prints \
+            ``.bbl`` files, see ``bbl_from_arxiv``.
+    :param index: An optional ``index.IdentifierIndex``, see \
+            ``bbl.get_dois``.
     :returns: A dict of cleaned plaintext citations and their associated doi.
     """
-    bbl_files = bbl_from_arxiv(eprint)
-    dois = {}
+    return {citation: url
+            for _, citation, url, _ in get_cited_resolutions(
+                eprint, cache=cache, sources_cache=sources_cache,
+                index=index)}
+
+
+def get_cited_resolutions(eprint, cache=None, sources_cache=None,
+                          known=None, index=None):
+    """
+    Resolve the citations of a given preprint, keeping track of how each one
+    was resolved.
+
+    :param eprint: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``).
+    :param cache: An optional ``cache.ResolutionCache`` of citations \
+            resolutions, see ``bbl.resolve_citations``.
+    :param sources_cache: An optional ``cache.SourcesCache`` of e-prints \
+            ``.bbl`` files, see ``bbl_from_arxiv``.
+    :param known: An optional dict of already known resolutions, e.g. from \
+            a previous version, see ``bbl.resolve_citations``.
+    :param index: An optional ``index.IdentifierIndex``, see \
+            ``bbl.resolve_citations``.
+    :returns: A list of tuples ``(raw_citation, citation, url, source)``, \
+            see ``bbl.resolve_citations``.
+    """
+    bbl_files = bbl_from_arxiv(eprint, sources_cache=sources_cache)
+    resolutions = []
     for bbl_file in bbl_files:
-        dois.update(bbl.get_dois(bbl_file))
+        resolutions.extend(bbl.resolve_citations(bbl_file, cache=cache,
+                                                 known=known, index=index))
+    return resolutions
+
+
+ARXIV_API_URL = "http://export.arxiv.org/api/query"
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+ARXIV_NS = "{http://arxiv.org/schemas/atom}"
+# Maximum number of identifiers in a single arXiv API query
+ARXIV_API_MAX_IDS = 100
+# Maximum number of DOIs OR-ed in a single arXiv API search query
+ARXIV_API_MAX_DOIS = 20
+
+
+def _query_arxiv_api(params):
+    """
+    Query arXiv API and get the returned entries.
+
+    :param params: The GET parameters of the query.
+    :returns: A list of ``(id, doi)`` tuples, where ``id`` is the full arXiv \
+            id (with version) and ``doi`` the associated DOI or ``None``. \
+            ``None`` is returned if the API returned an error.
+    """
+    r = client.get_client().get(ARXIV_API_URL, params=params, revalidate=True)
+    try:
+        e = xml.etree.ElementTree.fromstring(r.content)
+    except xml.etree.ElementTree.ParseError:
+        # Not an Atom feed, e.g. for a rejected query
+        return None
+    entries = []
+    for entry in e.iter(ATOM_NS + "entry"):
+        id = entry.find(ATOM_NS + "id").text
+        if not id.startswith("http://arxiv.org/abs/"):
+            # Error entry, e.g. for a malformed id
+            return None
+        doi = entry.find(ARXIV_NS + "doi")
+        entries.append((id.replace("http://arxiv.org/abs/", ""),
+                        doi.text if doi is not None else None))
+    return entries
+
+
+def _search_dois(dois):
+    """
+    Search arXiv API for the eprints of some DOIs, with a single OR-ed search
+    query of quoted DOIs.
+
+    If the API returns an error (e.g. for a malformed DOI), the DOIs are
+    split in two halves, searched separately, down to single DOIs.
+
+    :param dois: A list of DOIs to look for.
+    :returns: A dict of the found DOIs, lowercased, and their arXiv eprint id.
+    """
+    entries = _query_arxiv_api({
+        # Quoted not to be parsed as query syntax (e.g. parentheses)
+        "search_query": " OR ".join('doi:"%s"' % (doi.replace('"', " "),)
+                                    for doi in dois),
+        "max_results": 2 * len(dois)
+    })
+    if entries is None:
+        if len(dois) == 1:
+            return {}
+        half = len(dois) // 2
+        found = _search_dois(dois[:half])
+        for doi, id in _search_dois(dois[half:]).items():
+            found.setdefault(doi, id)
+        return found
+    found = {}
+    for id, doi in entries:
+        if doi is not None:
+            found.setdefault(doi.lower(), id)
+    return found
+
+
+def get_arxiv_eprint_from_doi_batch(dois):
+    """
+    Get the arXiv eprint ids for a list of DOIs, using OR-ed search queries.
+
+    :param dois: A list of DOIs to look for.
+    :returns: A dict of DOIs and their arXiv eprint id, or ``None`` if not \
+            found.
+    """
+    eprints = {}
+    for i in range(0, len(dois), ARXIV_API_MAX_DOIS):
+        chunk = dois[i:i + ARXIV_API_MAX_DOIS]
+        found = _search_dois(chunk)
+        for doi in chunk:
+            eprints[doi] = found.get(doi.lower())
+    return eprints
+
+
+def _query_id_list(eprints):
+    """
+    Query arXiv API for some eprints, with a single ``id_list`` query.
+
+    :param eprints: A list of at most ``ARXIV_API_MAX_IDS`` arXiv eprint ids.
+    :returns: A list of ``(id, doi)`` tuples, see ``_query_arxiv_api``.
+    """
+    entries = _query_arxiv_api({
+        "id_list": ",".join(eprints),
+        "max_results": len(eprints)
+    })
+    if entries is None:
+        # A malformed id makes the whole query fail, query one by one
+        entries = []
+        for eprint in eprints:
+            entries.extend(_query_arxiv_api({
+                "id_list": eprint,
+                "max_results": 1
+            }) or [])
+    return entries
+
+
+def get_doi_batch(eprints):
+    """
+    Get the associated DOIs for a list of arXiv eprints, using ``id_list``.
+
+    :param eprints: A list of arXiv eprint ids.
+    :returns: A dict of arXiv eprint ids and their DOI, or ``None``.
+    """
+    dois = {}
+    for i in range(0, len(eprints), ARXIV_API_MAX_IDS):
+        chunk = eprints[i:i + ARXIV_API_MAX_IDS]
+        entries = _query_id_list(chunk)
+        found = {}
+        for id, doi in entries:
+            found[id] = doi
+            found.setdefault(regex.arxiv_version.sub("", id), doi)
+        for eprint in chunk:
+            dois[eprint] = found.get(eprint)
     return dois
 
 
+def get_latest_version(eprint):
+    """
+    Get the latest version of a given arXiv eprint.
+
+    :param eprint: The arXiv eprint id, without version.
+    :returns: The arXiv eprint id with its latest version (e.g. \
+            ``1401.2910v2``), or ``None`` if not found.
+    """
+    for id, _ in _query_arxiv_api({"id_list": eprint,
+                                   "max_results": 1}) or []:
+        return id
+    return None
+
+
+def get_latest_versions(eprints):
+    """
+    Get the latest versions of a list of arXiv eprints, using ``id_list``.
+
+    :param eprints: A list of arXiv eprint ids, without version.
+    :returns: A dict of arXiv eprint ids and their latest version (e.g. \
+            ``1401.2910v2``), or ``None`` if not found.
+    """
+    versions = {}
+    for i in range(0, len(eprints), ARXIV_API_MAX_IDS):
+        chunk = eprints[i:i + ARXIV_API_MAX_IDS]
+        found = {regex.arxiv_version.sub("", id): id
+                 for id, _ in _query_id_list(chunk)}
+        for eprint in chunk:
+            versions[eprint] = found.get(eprint)
+    return versions
+
+
+# Concurrent single lookups are coalesced in batches
+arxiv_eprint_from_doi_lookups = coalesce.BatchCoalescer(
+    get_arxiv_eprint_from_doi_batch, max_batch=ARXIV_API_MAX_DOIS)
+doi_lookups = coalesce.BatchCoalescer(get_doi_batch,
+                                      max_batch=ARXIV_API_MAX_IDS)
+
+
 def get_arxiv_eprint_from_doi(doi):
     """
     Get the arXiv eprint id for a given DOI.
 
+    .. note::
+
+        Concurrent calls are served by a single batched query.
+
     :param doi: The DOI of the resource to look for.
     :returns: The arXiv eprint id, or ``None`` if not found.
     """
-    r = requests.get("http://export.arxiv.org/api/query",
-                     params={
-                         "search_query": "doi:%s" % (doi,),
-                         "max_results": 1
-                     })
-    e = xml.etree.ElementTree.fromstring(r.content)
-    for entry in e.iter("{http://www.w3.org/2005/Atom}entry"):
-        id = entry.find("{http://www.w3.org/2005/Atom}id").text
-        return id.replace("http://arxiv.org/abs/", "")
-    return None
+    return arxiv_eprint_from_doi_lookups.get(doi)
 
 
 def get_doi(eprint):
     """
     Get the associated DOI for a given arXiv eprint.
 
+    .. note::
+
+        Concurrent calls are served by a single batched query.
+
     :param eprint: The arXiv eprint id.
     :returns: The DOI if any, or ``None``.
     """
-    r = requests.get("http://export.arxiv.org/api/query",
-                     params={
-                         "id_list": eprint,
-                         "max_results": 1
-                     })
-    e = xml.etree.ElementTree.fromstring(r.content)
-    for entry in e.iter("{http://www.w3.org/2005/Atom}entry"):
-        doi = entry.find("{http://arxiv.org/schemas/atom}doi")
-        if doi is not None:
-            return doi.text
-    return None
+    return doi_lookups.get(eprint)
@@ -1,123 +1,696 @@
 """
 This files contains all the functions to deal with bbl files.
 """
-import math
+import collections
+import concurrent.futures
+import io
 import os
 import requests
 import subprocess
+import time
 
+from . import client
 from . import doi
+from . import instrumentation
+from . import latex
 from . import regex
 from . import tools
 
 
-def clean_bibitem(bibitem):
+CROSSREF_LINKS_URL = "http://search.crossref.org/links"
+# Maximum number of concurrent requests to Crossref
+CROSSREF_MAX_WORKERS = 4
+# Timeout (in seconds) of a single request to Crossref
+CROSSREF_TIMEOUT = 30
+# Batches answered slower than this (in seconds) are shrunk
+CROSSREF_TARGET_LATENCY = 10
+
+# Default backend to clean bibitems, see ``parse``
+CLEANING_BACKEND = "delatex"
+# Whether to rewrite accents, letters macros and groups glued to words with
+# ``latex.simplify`` before cleaning, see ``parse``. Off by default, as it
+# changes the cleaned citations, which are the keys of the resolution cache
+# and of the stored extracted citations.
+CLEANING_SIMPLIFY = False
+
+# Plain word put on its own paragraph between bibitems when cleaning them in a
+# single delatex run. It contains no TeX special chars, so delatex outputs it
+# untouched.
+DELATEX_SEPARATOR = "ZZBIBITEMSEPARATORZZ"
+
+# Number of bibitems cleaned at once while parsing a .bbl file
+CLEANING_CHUNK_SIZE = 50
+# Arguments of \bibitem and \entry longer than this are considered unbalanced
+BIBITEM_HEAD_MAX_LENGTH = 4096
+
+
+def delatex(text):
     """
-    Return a plaintext representation of the bibitem from the ``.bbl`` file.
+    Run ``opendetex/delatex -s`` on some text.
 
-    :param bibitem: The text content of the bibitem.
-    :returns: A cleaned plaintext citation from the bibitem.
+    :param text: The LaTeX text to convert.
+    :returns: The raw plaintext output of ``delatex``.
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     output = subprocess.check_output(["%s/opendetex/delatex" % (script_dir,),
                                       "-s"],
-                                     input=bibitem.encode("utf-8"))
-    output = output.decode("utf-8")
+                                     input=text.encode("utf-8"))
+    return output.decode("utf-8")
+
+
+def clean_bibitem(bibitem, simplify=False):
+    """
+    Return a plaintext representation of the bibitem from the ``.bbl`` file.
+
+    :param bibitem: The text content of the bibitem.
+    :param simplify: Whether to run ``latex.simplify`` on the bibitem first.
+    :returns: A cleaned plaintext citation from the bibitem.
+    """
+    if simplify:
+        bibitem = latex.simplify(bibitem)
+    output = delatex(bibitem)
     output = tools.clean_whitespaces(output)
     return output
 
 
-def parse(bbl):
+def clean_bibitems(bibitems, simplify=False):
+    """
+    Return plaintext representations of a list of bibitems, using a single
+    ``delatex`` process for all of them.
+
+    Bibitems are joined with ``DELATEX_SEPARATOR`` and the output is split back
+    on it. If the separator could not be found back exactly once between each
+    bibitem (e.g. a bibitem leaves a math environment open), this falls back
+    to cleaning each bibitem on its own.
+
+    :param bibitems: A list of text contents of bibitems.
+    :param simplify: Whether to run ``latex.simplify`` on the bibitems first.
+    :returns: A list of cleaned plaintext citations, in the same order.
+    """
+    if len(bibitems) == 0:
+        return []
+    if simplify:
+        bibitems = [latex.simplify(bibitem) for bibitem in bibitems]
+    if any(DELATEX_SEPARATOR in bibitem for bibitem in bibitems):
+        return [clean_bibitem(bibitem) for bibitem in bibitems]
+    output = delatex(("\n\n%s\n\n" % (DELATEX_SEPARATOR,)).join(bibitems))
+    output = output.split(DELATEX_SEPARATOR)
+    if len(output) != len(bibitems):
+        return [clean_bibitem(bibitem) for bibitem in bibitems]
+    return [tools.clean_whitespaces(i) for i in output]
+
+
+def clean_bibitems_python(bibitems, simplify=False):
+    """
+    Return plaintext representations of a list of bibitems, using the
+    pure-Python converter from ``latex.py`` instead of ``delatex``.
+
+    :param bibitems: A list of text contents of bibitems.
+    :param simplify: Whether to run ``latex.simplify`` on the bibitems first.
+    :returns: A list of cleaned plaintext citations, in the same order.
+    """
+    if simplify:
+        bibitems = [latex.simplify(bibitem) for bibitem in bibitems]
+    return [tools.clean_whitespaces(latex.to_plaintext(bibitem))
+            for bibitem in bibitems]
+
+
+def skip_group(text, pos, opening="{", closing="}"):
+    """
+    Skip a balanced LaTeX group (e.g. ``{key}`` or ``[label]``) and the
+    whitespaces and comments before it.
+
+    :param text: The LaTeX text.
+    :param pos: The position to start from.
+    :param opening: The opening delimiter of the group.
+    :param closing: The closing delimiter of the group.
+    :returns: The position after the group, ``pos`` if there is no such \
+            group at ``pos``, or ``None`` if the text ends before the end of \
+            the group.
+    """
+    start = pos
+    pos = regex.latex_blank.match(text, pos).end()
+    if pos >= len(text):
+        return None
+    if text[pos] != opening:
+        return start
+    pos += 1
+    depth = 0
+    while pos < len(text):
+        char = text[pos]
+        if char == "\\":
+            pos += 2
+            continue
+        if char == closing and depth == 0:
+            return pos + 1
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        pos += 1
+    return None
+
+
+def read_group(text, pos):
+    """
+    Read the content of a balanced ``{…}`` LaTeX group.
+
+    :param text: The LaTeX text.
+    :param pos: The position to start from.
+    :returns: A tuple ``(content, end)``, or ``None`` if there is no \
+            complete group at ``pos``.
+    """
+    end = skip_group(text, pos)
+    if end is None or end == pos:
+        return None
+    return (text[text.index("{", pos) + 1:end - 1], end)
+
+
+def iter_groups(text):
+    """
+    Iterate over the contents of consecutive ``{…}`` LaTeX groups.
+    """
+    pos = 0
+    while True:
+        group = read_group(text, pos)
+        if group is None:
+            return
+        content, pos = group
+        yield content
+
+
+def skip_bibitem_head(text, pos):
+    """
+    Skip the ``[label]{key}`` arguments of a ``\\bibitem``.
+
+    :returns: The position after the arguments, or ``None`` if the text ends \
+            before them.
+    """
+    pos = skip_group(text, pos, "[", "]")
+    if pos is None:
+        return None
+    return skip_group(text, pos)
+
+
+def skip_entry_head(text, pos):
+    """
+    Skip the ``{key}{type}{options}`` arguments of a biblatex ``\\entry``.
+
+    :returns: The position after the arguments, or ``None`` if the text ends \
+            before them.
+    """
+    for _ in range(3):
+        pos = skip_group(text, pos)
+        if pos is None:
+            return None
+    return pos
+
+
+def biblatex_name(name):
+    """
+    Format a name of a biblatex ``\\name`` list.
+
+    :param name: The content of the name group, either with named parts \
+            (``{hash=…}{family={…},given={…}}``, biblatex ≥ 3.3) or with \
+            positional ones (``{hash}{family}{f.}{given}{g.}…``).
+    :returns: The full name, as LaTeX text.
+    """
+    parts = {}
+    for match in regex.biblatex_name_parts.finditer(name):
+        group = read_group(name, match.end())
+        if group is not None:
+            parts[match.group(1)] = group[0]
+    if not parts:
+        groups = list(iter_groups(name))
+        for key, index in (("family", 1), ("given", 3),
+                           ("prefix", 5), ("suffix", 7)):
+            if index < len(groups):
+                parts[key] = groups[index]
+    return " ".join(parts[key] for key in ("given", "prefix", "family",
+                                           "suffix")
+                    if parts.get(key))
+
+
+def biblatex_entry_to_bibitem(entry):
+    """
+    Convert the body of a biblatex ``\\entry`` to a citation similar to a
+    ``thebibliography`` bibitem.
+
+    :param entry: The body of the entry, between its arguments and \
+            ``\\endentry``.
+    :returns: A LaTeX citation, with the authors, title, journal, volume, \
+            pages, year and identifiers (DOI, arXiv id, URL) of the entry.
+    """
+    fields = {}
+    names = {}
+    for match in regex.biblatex_fields.finditer(entry):
+        kind, key = match.groups()
+        pos = match.end()
+        if kind == "name":
+            # Skip the number of names and the options
+            for _ in range(2):
+                pos = skip_group(entry, pos)
+        elif kind == "list":
+            # Skip the number of items
+            pos = skip_group(entry, pos)
+        group = read_group(entry, pos) if pos is not None else None
+        if group is None:
+            continue
+        if kind == "name":
+            names[key] = [biblatex_name(i) for i in iter_groups(group[0])]
+        elif kind == "list":
+            fields[key] = ", ".join(iter_groups(group[0]))
+        else:
+            fields[key] = group[0]
+    for key, value in regex.biblatex_verbs.findall(entry):
+        # Long values are split on several \verb lines
+        fields[key] = "".join(i.strip() for i in value.split("\\verb "))
+    parts = [", ".join(names.get("author") or names.get("editor") or [])]
+    for key in ("title", "journaltitle", "booktitle", "publisher", "volume",
+                "pages"):
+        parts.append(fields.get(key))
+    parts.append(fields.get("year") or fields.get("date", "")[:4])
+    if "doi" in fields:
+        parts.append("doi:\\doi{%s}" % (fields["doi"],))
+    if "eprint" in fields and fields.get("eprinttype", "").lower() == "arxiv":
+        parts.append("arXiv:%s" % (fields["eprint"],))
+    if "url" in fields:
+        parts.append("\\url{%s}" % (fields["url"],))
+    return ", ".join(part for part in parts if part)
+
+
+def tokenize_bibitems(lines):
+    """
+    Split the lines of a ``.bbl`` file in bibitems, in a single pass.
+
+    Both ``thebibliography`` items (``\\bibitem{key}`` and
+    ``\\bibitem[label]{key}``) and biblatex entries (``\\entry{key}{type}{}`` …
+    ``\\endentry``, converted with ``biblatex_entry_to_bibitem``) are
+    supported. Only the current bibitem is kept in memory.
+
+    :param lines: An iterable of the lines of the ``.bbl`` file.
+    :returns: A generator of the LaTeX contents of the bibitems.
+    """
+    # One of None (outside of any item), "bibitem", "entry", or their "_head"
+    # while their arguments are not fully read
+    state = None
+    item = []
+    pending = ""
+    for line in lines:
+        pending += line
+        pos = 0
+        while True:
+            if state in ("bibitem_head", "entry_head"):
+                if state == "bibitem_head":
+                    end = skip_bibitem_head(pending, pos)
+                else:
+                    end = skip_entry_head(pending, pos)
+                if end is None:
+                    if len(pending) - pos < BIBITEM_HEAD_MAX_LENGTH:
+                        # Wait for the next lines
+                        break
+                    # Unbalanced arguments, keep them in the content
+                    end = pos
+                state = state[:-len("_head")]
+                pos = end
+            match = regex.bbl_markers.search(pending, pos)
+            if match is None:
+                if state is not None:
+                    item.append(pending[pos:])
+                pos = len(pending)
+                break
+            if state is not None:
+                item.append(pending[pos:match.start()])
+            marker = match.group(0)
+            if state == "bibitem":
+                yield "".join(item).strip()
+            elif state == "entry" and marker != "\\bibitem":
+                yield biblatex_entry_to_bibitem("".join(item))
+            item = []
+            if marker == "\\bibitem":
+                state = "bibitem_head"
+            elif marker == "\\entry":
+                state = "entry_head"
+            else:
+                state = None
+            pos = match.end()
+        pending = pending[pos:]
+    if state is not None and state.endswith("_head"):
+        item.append(pending)
+        state = state[:-len("_head")]
+    if state == "bibitem":
+        yield "".join(item).strip()
+    elif state == "entry":
+        yield biblatex_entry_to_bibitem("".join(item))
+
+
+def iter_bibitems(bbl):
+    """
+    Lazily iterate over the bibitems of a ``.bbl`` file, see
+    ``tokenize_bibitems``.
+
+    :param bbl: Either the path to the .bbl file, the content of a ``.bbl`` \
+            file or a text file-like object.
+    :returns: A generator of the LaTeX contents of the bibitems.
+    """
+    if hasattr(bbl, "read"):
+        yield from tokenize_bibitems(bbl)
+    elif os.path.isfile(bbl):
+        with open(bbl, 'r') as fh:
+            yield from tokenize_bibitems(fh)
+    else:
+        yield from tokenize_bibitems(io.StringIO(bbl))
+
+
+def parse_chunks(bbl, batch=True, backend=None, chunk_size=None,
+                 simplify=None):
+    """
+    Lazily parse a ``*.bbl`` file, cleaning its bibitems by chunks as soon as
+    they are read, so that the citations can be processed before the whole
+    file is parsed.
+
+    :param bbl: See ``iter_bibitems``.
+    :param batch: See ``parse``.
+    :param backend: See ``parse``.
+    :param chunk_size: Number of bibitems cleaned at once, defaults to \
+            ``CLEANING_CHUNK_SIZE``.
+    :param simplify: See ``parse``.
+    :returns: A generator of lists of cleaned plaintext citations.
+    """
+    if backend is None:
+        backend = CLEANING_BACKEND
+    if simplify is None:
+        simplify = CLEANING_SIMPLIFY
+    if backend not in ("delatex", "python"):
+        raise ValueError("Unknown cleaning backend %s." % (backend,))
+    if chunk_size is None:
+        chunk_size = CLEANING_CHUNK_SIZE
+    chunk = []
+    for bibitem in iter_bibitems(bbl):
+        chunk.append(bibitem)
+        if len(chunk) >= chunk_size:
+            yield _clean_chunk(chunk, batch, backend, simplify)
+            chunk = []
+    if chunk:
+        yield _clean_chunk(chunk, batch, backend, simplify)
+
+
+def _clean_chunk(bibitems, batch, backend, simplify):
+    """
+    Clean a chunk of bibitems, see ``parse``.
+    """
+    with instrumentation.stage("cleaning", bibitems=len(bibitems)):
+        if backend == "python":
+            return clean_bibitems_python(bibitems, simplify=simplify)
+        if batch:
+            return clean_bibitems(bibitems, simplify=simplify)
+        return [clean_bibitem(bibitem, simplify=simplify)
+                for bibitem in bibitems]
+
+
+def parse(bbl, batch=True, backend=None, simplify=None):
     """
     Parse a ``*.bbl`` file to get a clean list of plaintext citations.
 
     :param bbl: Either the path to the .bbl file or the content of a ``.bbl`` \
             file.
+    :param batch: Whether to clean all the bibitems in a single ``delatex`` \
+            process (default) or to spawn one process per bibitem. Only \
+            used by the ``delatex`` backend.
+    :param backend: Either ``delatex`` to clean bibitems with \
+            ``opendetex/delatex`` or ``python`` to use the pure-Python \
+            converter, which does not need the compiled ``opendetex``. \
+            Defaults to ``CLEANING_BACKEND``.
+    :param simplify: Whether to rewrite accents, letters macros and groups \
+            glued to words with ``latex.simplify`` before cleaning, so that \
+            they do not split words apart (both backends split them \
+            otherwise, e.g. ``Marto\\v{n}\\'{a}k`` is ``Marto n a k``). \
+            Defaults to ``CLEANING_SIMPLIFY``.
     :returns:  A list of cleaned plaintext citations.
     """
-    # Handle path or content
-    if os.path.isfile(bbl):
-        with open(bbl, 'r') as fh:
-            bbl_content = fh.read()
-    else:
-        bbl_content = bbl
-    # Get a list of bibitems
-    bibitems = regex.bibitems.split(bbl_content)[1:]
-    bibitems = [regex.endthebibliography.sub("",
-                                             i).strip() for i in bibitems]
-    cleaned_bbl = []
-    # Clean every bibitem
-    for bibitem in bibitems:
-        cleaned_bbl.append(clean_bibitem(bibitem))
-    return cleaned_bbl
+    return [citation
+            for chunk in parse_chunks(bbl, batch=batch, backend=backend,
+                                      simplify=simplify)
+            for citation in chunk]
 
 
-def get_dois(bbl_input):
+class AdaptiveBatchSize(object):
     """
-    Get the papers cited by the paper identified by the given DOI.
+    Size of the batches of citations sent to Crossref, adapted to the observed
+    response times: it grows by one after each fast enough answer and is
+    halved after each slow answer, timeout or error.
+    """
+    def __init__(self, size=10, minimum=1, maximum=50,
+                 target_latency=CROSSREF_TARGET_LATENCY):
+        self.size = size
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+
+    def success(self, elapsed):
+        """
+        Update the batch size after a batch answered in ``elapsed`` seconds.
+        """
+        if elapsed > self.target_latency:
+            self.failure()
+        else:
+            self.size = min(self.maximum, self.size + 1)
+
+    def failure(self):
+        """
+        Update the batch size after a failed batch.
+        """
+        self.size = max(self.minimum, self.size // 2)
+
+
+def crossref_batch(citations):
+    """
+    Send a single batch of plaintext citations to Crossref ``/links`` API.
+
+    :param citations: A list of plaintext citations.
+    :returns: A tuple ``(elapsed time, list of Crossref results)``.
+    """
+    start = time.perf_counter()
+    r = client.get_client().post(CROSSREF_LINKS_URL,
+                                 json=citations,
+                                 timeout=CROSSREF_TIMEOUT)
+    r.raise_for_status()
+    results = r.json()["results"]
+    return (time.perf_counter() - start, results)
+
+
+def crossref_links(citations, max_workers=CROSSREF_MAX_WORKERS):
+    """
+    Resolve plaintext citations to DOIs using Crossref ``/links`` API.
+
+    Batches are sent concurrently, with at most ``max_workers`` requests in
+    flight, and their size follows ``AdaptiveBatchSize``. A failed batch is
+    split in two and sent again, until it is a single citation. Results are
+    merged in the order of the citations, whatever the order of the answers.
+
+    :param citations: A list of plaintext citations.
+    :param max_workers: Maximum number of concurrent requests.
+    :returns: A dict of citations and their associated DOI, or ``None`` if \
+            Crossref did not find any. Citations that could not be sent \
+            successfully are not in it.
+    """
+    batch_size = AdaptiveBatchSize()
+    retries = collections.deque()
+    position = 0
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        running = {}
+        while position < len(citations) or retries or running:
+            # Fill in the pool of in-flight requests
+            while (len(running) < max_workers and
+                   (retries or position < len(citations))):
+                if retries:
+                    start, batch = retries.popleft()
+                else:
+                    start = position
+                    batch = citations[start:start + batch_size.size]
+                    position += len(batch)
+                running[executor.submit(crossref_batch, batch)] = (start,
+                                                                   batch)
+            done, _ = concurrent.futures.wait(
+                running,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                start, batch = running.pop(future)
+                try:
+                    elapsed, batch_results = future.result()
+                except (requests.exceptions.RequestException,
+                        ValueError, KeyError):
+                    batch_size.failure()
+                    if len(batch) > 1:
+                        half = len(batch) // 2
+                        retries.append((start, batch[:half]))
+                        retries.append((start + half, batch[half:]))
+                    continue
+                batch_size.success(elapsed)
+                results[start] = batch_results
+    dois = {}
+    for start in sorted(results):
+        for result in results[start]:
+            dois[result["text"]] = result.get("doi")
+    return dois
+
+
+def resolve_citations(bbl_input, cache=None, known=None, index=None):
+    """
+    Resolve the citations of a ``.bbl`` file to DOIs or arXiv links, keeping
+    track of how each one was resolved.
 
     :param bbl_input: Either the path to the .bbl file or the content of a \
             bbl file.
+    :param cache: An optional ``cache.ResolutionCache`` consulted before \
+            extracting identifiers and querying Crossref, and updated with \
+            their results.
+    :param known: An optional dict of raw citations and their already known \
+            ``(citation, url)`` resolution, e.g. from a previous version of \
+            the paper. Only the other citations, and the known ones without \
+            any ``url`` (which may come from a failed Crossref query), are \
+            resolved.
+    :param index: An optional ``index.IdentifierIndex`` to match the \
+            citations without any identifier against, before querying \
+            Crossref. Only low-confidence matches are sent to Crossref.
 
-    :returns: A dict of cleaned plaintext citations and their associated doi.
+    :returns: A list of tuples ``(raw_citation, citation, url, source)``, \
+            where ``raw_citation`` is the cleaned plaintext bibitem, \
+            ``citation`` the cleaned plaintext citation with identifiers \
+            removed, ``url`` the DOI or arXiv link (or ``None``) and \
+            ``source`` one of ``known``, ``cache``, ``url``, ``regex``, \
+            ``index``, ``crossref`` or ``None`` if the Crossref query \
+            failed.
     """
-    cleaned_citations_with_URLs = parse(bbl_input)
     dois = {}
+    resolutions = []
     cleaned_citations = []
-    # Try to get the DOI directly from the citation
-    for citation in cleaned_citations_with_URLs[:]:
-        # Get all the urls in the citation
-        raw_urls = regex.urls.findall(citation)
-        urls = [u.lower() for u in raw_urls]
-        # Remove URLs in citation
-        for url in raw_urls:
-            citation = citation.replace(url, "")
-        citation = tools.clean_whitespaces(citation)
-        # Try to find an arXiv link
-        arxiv_url = doi.extract_arxiv_links(urls)
-        if arxiv_url:
-            dois[citation] = arxiv_url
-        # Try to find a DOI link
-        doi_url = doi.extract_doi_links(urls)
-        if doi_url:
-            dois[citation] = doi_url
-        # Try to find a direct match using a regex if links search failed
-        if not doi_url and not arxiv_url:
-            regex.match = doi.match_doi_or_arxiv(citation)
-            if regex.match:
-                print(regex.match)
-                citation = citation.replace(regex.match[1], "")
-                if regex.match[0] == "DOI":
-                    dois[citation] = "http://dx.doi.org/%s" % (regex.match[1],)
+    # Raw citations (as keyed in the cache) of the cleaned citations
+    raw_citations = {}
+    # Resolutions to store in the cache, see ``cache.set_many``
+    to_cache = []
+    # Resolve the citations by chunks, as soon as they are parsed
+    for cleaned_citations_with_URLs in parse_chunks(bbl_input):
+        # Look for the citations in the cache first
+        uncached_citations = []
+        with instrumentation.stage("resolution_cache") as timer:
+            cached_citations = {}
+            if cache is not None:
+                cached_citations = cache.get_many([
+                    citation for citation in cleaned_citations_with_URLs
+                    if (known is None or citation not in known or
+                        known[citation][1] is None)])
+            for citation in cleaned_citations_with_URLs:
+                if (known is not None and citation in known and
+                        known[citation][1] is not None):
+                    timer.add("known")
+                    cached = known[citation]
+                    dois[cached[0]] = cached[1]
+                    resolutions.append((citation, cached[0], cached[1],
+                                        "known"))
+                    continue
+                if cache is not None:
+                    cached = cached_citations.get(citation)
+                    if cached is not None:
+                        timer.add("hits")
+                        dois[cached[0]] = cached[1]
+                        resolutions.append((citation, cached[0], cached[1],
+                                            "cache"))
+                        continue
+                    timer.add("misses")
+                uncached_citations.append(citation)
+        # Try to get the DOI directly from the citation
+        with instrumentation.stage("identifiers",
+                                   citations=len(uncached_citations)):
+            identifiers = doi.extract_identifiers(uncached_citations)
+        for raw_citation, (citation, urls, match) in zip(
+                uncached_citations, identifiers):
+            source = "url"
+            # Try to find an arXiv link
+            arxiv_url = doi.extract_arxiv_links(urls)
+            if arxiv_url:
+                dois[citation] = arxiv_url
+            # Try to find a DOI link
+            doi_url = doi.extract_doi_links(urls)
+            if doi_url:
+                dois[citation] = doi_url
+            # Use the direct match using a regex if links search failed
+            if match:
+                source = "regex"
+                citation = citation.replace(match[1], "")
+                if match[0] == "DOI":
+                    dois[citation] = "http://dx.doi.org/%s" % (match[1],)
                 else:
                     dois[citation] = (
                         "http://arxiv.org/abs/%s" %
-                        (regex.match[1].replace("arxiv:", ""),)
+                        (match[1].replace("arxiv:", ""),)
                     )
-        # If no match found, stack it for next step
-        if citation not in dois:
-            cleaned_citations.append(citation)
-    # Do batch of 10 papers, to prevent from the timeout of crossref
-    for i in range(math.ceil(len(cleaned_citations) / 10)):
-        lower_bound = 10 * i
-        upper_bound = min(10 * (i + 1), len(cleaned_citations))
-        r = requests.post("http://search.crossref.org/links",
-                          json=cleaned_citations[lower_bound:upper_bound])
-        for result in r.json()["results"]:
-            if "doi" not in result:
-                # If DOI is not found, try a direct query to get a DOI
-                # r = requests.get("http://search.crossref.org/dois",
-                #                  params={
-                #                      'q': result["text"],
-                #                      "sort": "score",
-                #                      "rows": 1
-                #                  })
-                # doi_result = r.json()
-                # if len(doi_result) > 0:
-                #     dois[result["text"]] = doi_result[0]["doi"]
-                # else:
-                #     dois[result["text"]] = None
-                dois[result["text"]] = None
+            # If no match found, stack it for next step
+            if citation not in dois:
+                cleaned_citations.append(citation)
+                raw_citations[citation] = raw_citation
             else:
-                dois[result["text"]] = result["doi"]
-    return dois
+                resolutions.append((raw_citation, citation, dois[citation],
+                                    source))
+                to_cache.append((raw_citation, citation, dois[citation]))
+        if cache is not None:
+            cache.set_many(to_cache)
+            to_cache = []
+    # Match the remaining citations against the local index
+    if index is not None:
+        with instrumentation.stage("index",
+                                   citations=len(cleaned_citations)) as timer:
+            unmatched_citations = []
+            for citation in cleaned_citations:
+                url = index.lookup(citation)
+                if url is None:
+                    unmatched_citations.append(citation)
+                    continue
+                timer.add("matched")
+                dois[citation] = url
+                raw_citation = raw_citations[citation]
+                resolutions.append((raw_citation, citation, url, "index"))
+                to_cache.append((raw_citation, citation, url))
+            cleaned_citations = unmatched_citations
+    # Resolve the remaining citations through Crossref
+    with instrumentation.stage("crossref",
+                               citations=len(cleaned_citations)) as timer:
+        crossref_dois = crossref_links(cleaned_citations)
+        timer.add("failed", len(cleaned_citations) - len(crossref_dois))
+        timer.add("resolved", len([i for i in crossref_dois.values()
+                                   if i is not None]))
+    for citation, doi_url in crossref_dois.items():
+        dois[citation] = doi_url
+        raw_citation = raw_citations.get(citation, citation)
+        resolutions.append((raw_citation, citation, doi_url, "crossref"))
+        if citation in raw_citations:
+            to_cache.append((raw_citation, citation, doi_url))
+    if cache is not None:
+        cache.set_many(to_cache)
+    # Citations whose batch failed are kept, without any DOI
+    for citation in cleaned_citations:
+        if citation not in dois:
+            dois[citation] = None
+            resolutions.append((raw_citations[citation], citation, None,
+                                None))
+    return resolutions
+
+
+def get_dois(bbl_input, cache=None, index=None):
+    """
+    Get the papers cited by the paper identified by the given DOI.
+
+    :param bbl_input: Either the path to the .bbl file or the content of a \
+            bbl file.
+    :param cache: An optional ``cache.ResolutionCache``, see \
+            ``resolve_citations``.
+    :param index: An optional ``index.IdentifierIndex``, see \
+            ``resolve_citations``.
+
+    :returns: A dict of cleaned plaintext citations and their associated doi.
+    """
+    return {citation: url
+            for _, citation, url, _ in resolve_citations(bbl_input,
+                                                         cache=cache,
+                                                         index=index)}
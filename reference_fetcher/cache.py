@@ -0,0 +1,477 @@
+"""
+This file contains the persistent caches: citation resolutions, e-prints
+sources and open access versions.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Maximum number of values in an IN clause, below the limit of SQLite
+SQLITE_CHUNK_SIZE = 500
+
+
+def connect(path):
+    """
+    Open a SQLite database shared by threads and processes.
+
+    :param path: Path to the SQLite file, or ``:memory:``.
+    :returns: A ``sqlite3.Connection``.
+    """
+    db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    if path != ":memory:":
+        # Readers do not block writers, for concurrent workers
+        db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+def normalize_citation(citation):
+    """
+    Normalize a cleaned plaintext citation to be used as a cache key.
+
+    :param citation: A cleaned plaintext citation.
+    :returns: The lowercased citation, with whitespaces collapsed.
+    """
+    return ' '.join(citation.lower().split())
+
+
+class ResolutionCache(object):
+    """
+    On-disk (SQLite) cache of the resolution of cleaned plaintext citations.
+
+    Both positive (a DOI or arXiv URL was found) and negative (nothing was
+    found) resolutions are stored, with their own TTL, and the expired ones
+    are purged every ``purge_interval`` seconds. The cache is bounded to
+    ``max_entries``, least recently used entries being evicted first.
+    ``get_many`` and ``set_many`` look up and store the resolutions of the
+    citations of a paper in a single transaction each.
+
+    :param path: Path to the SQLite file, ``:memory:`` for a cache in memory.
+    :param max_entries: Maximum number of stored resolutions.
+    :param ttl: Time to live (in seconds) of positive resolutions.
+    :param negative_ttl: Time to live (in seconds) of negative resolutions.
+    :param purge_interval: Minimum time (in seconds) between two purges of \
+            the expired resolutions.
+    """
+    def __init__(self, path, max_entries=1000000,
+                 ttl=180 * 24 * 3600, negative_ttl=7 * 24 * 3600,
+                 purge_interval=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.purge_interval = purge_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        # Serialize the creation with the other processes
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.execute("CREATE TABLE IF NOT EXISTS resolutions ("
+                         "key TEXT PRIMARY KEY, "
+                         "citation TEXT NOT NULL, "
+                         "url TEXT, "
+                         "expires REAL NOT NULL, "
+                         "last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS resolutions_last_used "
+                         "ON resolutions (last_used)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS resolutions_expires "
+                         "ON resolutions (expires)")
+        # Number of stored resolutions, maintained by triggers so that it is
+        # shared by all the processes using the cache
+        self._db.execute("CREATE TABLE IF NOT EXISTS resolutions_size ("
+                         "id INTEGER PRIMARY KEY CHECK (id = 0), "
+                         "entries INTEGER NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO resolutions_size "
+                         "SELECT 0, COUNT(*) FROM resolutions")
+        self._db.execute("CREATE TRIGGER IF NOT EXISTS resolutions_insert "
+                         "AFTER INSERT ON resolutions BEGIN "
+                         "UPDATE resolutions_size SET entries = entries + 1; "
+                         "END")
+        self._db.execute("CREATE TRIGGER IF NOT EXISTS resolutions_delete "
+                         "AFTER DELETE ON resolutions BEGIN "
+                         "UPDATE resolutions_size SET entries = entries - 1; "
+                         "END")
+        self._db.commit()
+        # Expired resolutions are purged on the first write
+        self._last_purge = 0
+
+    def _size(self):
+        """
+        Get the number of stored resolutions. Must be called with the lock
+        held.
+        """
+        return self._db.execute(
+            "SELECT entries FROM resolutions_size").fetchone()[0]
+
+    def get(self, citation):
+        """
+        Get the cached resolution of a citation.
+
+        :param citation: A cleaned plaintext citation, as found in the bbl.
+        :returns: ``None`` on a miss, a tuple ``(citation, url)`` otherwise, \
+                where ``citation`` is the citation with the identifiers \
+                removed and ``url`` is ``None`` for a negative resolution.
+        """
+        return self.get_many([citation]).get(citation)
+
+    def get_many(self, citations):
+        """
+        Get the cached resolutions of a list of citations, in a single
+        transaction.
+
+        :param citations: A list of cleaned plaintext citations, as found in \
+                the bbl.
+        :returns: A dict of the cached citations and their resolution, see \
+                ``get``.
+        """
+        keys = {}
+        for citation in citations:
+            keys.setdefault(normalize_citation(citation), []).append(citation)
+        key_list = list(keys)
+        now = time.time()
+        resolutions = {}
+        hit_keys = []
+        with self._lock:
+            for start in range(0, len(key_list), SQLITE_CHUNK_SIZE):
+                chunk = key_list[start:start + SQLITE_CHUNK_SIZE]
+                for key, cleaned_citation, url, expires in self._db.execute(
+                        "SELECT key, citation, url, expires FROM resolutions "
+                        "WHERE key IN (%s)" % (", ".join("?" * len(chunk)),),
+                        chunk):
+                    if expires < now:
+                        continue
+                    hit_keys.append((now, key))
+                    for citation in keys[key]:
+                        resolutions[citation] = (cleaned_citation, url)
+            if hit_keys:
+                self._db.executemany(
+                    "UPDATE resolutions SET last_used = ? WHERE key = ?",
+                    hit_keys)
+                self._db.commit()
+            hits = len([citation for citation in citations
+                        if citation in resolutions])
+            self.hits += hits
+            self.misses += len(citations) - hits
+        return resolutions
+
+    def set(self, citation, cleaned_citation, url):
+        """
+        Store the resolution of a citation.
+
+        :param citation: A cleaned plaintext citation, as found in the bbl.
+        :param cleaned_citation: The citation with the identifiers removed, \
+                as returned by ``bbl.get_dois``.
+        :param url: The DOI or arXiv URL, ``None`` for a negative resolution.
+        """
+        self.set_many([(citation, cleaned_citation, url)])
+
+    def set_many(self, resolutions):
+        """
+        Store the resolutions of a list of citations, in a single
+        transaction.
+
+        :param resolutions: A list of tuples ``(citation, cleaned_citation, \
+                url)``, see ``set``.
+        """
+        if not resolutions:
+            return
+        now = time.time()
+        rows = [
+            (normalize_citation(citation), cleaned_citation, url,
+             now + (self.ttl if url is not None else self.negative_ttl), now)
+            for citation, cleaned_citation, url in resolutions]
+        with self._lock:
+            # Other processes may set the same citations meanwhile
+            self._db.executemany(
+                "INSERT INTO resolutions VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET citation = excluded.citation, "
+                "url = excluded.url, expires = excluded.expires, "
+                "last_used = excluded.last_used",
+                rows)
+            if now - self._last_purge > self.purge_interval:
+                self._purge(now)
+            # Read in the write transaction, so that the processes do not
+            # evict the same entries
+            size = self._size()
+            if size > self.max_entries:
+                # Evict least recently used entries
+                self._db.execute(
+                    "DELETE FROM resolutions WHERE key IN ("
+                    "SELECT key FROM resolutions "
+                    "ORDER BY last_used LIMIT ?)",
+                    (size - self.max_entries,))
+            self._db.commit()
+
+    def _purge(self, now):
+        """
+        Delete the expired resolutions. Must be called with the lock held.
+        """
+        self._db.execute("DELETE FROM resolutions WHERE expires < ?", (now,))
+        self._last_purge = now
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+
+        :returns: A dict with the number of ``hits``, ``misses`` and stored \
+                ``entries``.
+        """
+        with self._lock:
+            entries = self._size()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries
+        }
+
+
+class OfflineMiss(LookupError):
+    """
+    Raised by ``SourcesCache`` in offline mode when an e-print is not stored.
+    """
+    pass
+
+
+class SourcesCache(object):
+    """
+    Local, content-addressed store of the ``.bbl`` files of arXiv e-prints.
+
+    ``.bbl`` files are stored once under the SHA-256 of their content, and an
+    index (SQLite) maps every e-print id (including its version, if given)
+    to its ``.bbl`` files. The store is bounded to ``max_size`` bytes, least
+    recently used e-prints being evicted first.
+
+    .. note::
+
+        An e-print id without version refers to the latest version at the time
+        it was first fetched. Use versioned ids for stable results.
+
+    :param path: Directory of the store, created if it does not exist.
+    :param max_size: Maximum total size (in bytes) of the stored files.
+    :param offline: If ``True``, never download anything and raise \
+            ``OfflineMiss`` for e-prints which are not stored.
+    """
+    def __init__(self, path, max_size=1024 ** 3, offline=False):
+        self.path = path
+        self.max_size = max_size
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._db = connect(os.path.join(path, "index.sqlite3"))
+        self._db.execute("CREATE TABLE IF NOT EXISTS eprints ("
+                         "eprint TEXT PRIMARY KEY, "
+                         "hashes TEXT NOT NULL, "
+                         "last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS eprints_last_used "
+                         "ON eprints (last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files ("
+                         "hash TEXT PRIMARY KEY, "
+                         "size INTEGER NOT NULL, "
+                         "refs INTEGER NOT NULL)")
+        self._db.commit()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    def _file_path(self, hash):
+        return os.path.join(self.path, hash[:2], hash + ".bbl")
+
+    def get(self, eprint):
+        """
+        Get the stored ``.bbl`` files of an e-print.
+
+        :param eprint: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``).
+        :returns: A list of the ``.bbl`` files as text, or ``None`` if the \
+                e-print is not stored.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT hashes FROM eprints WHERE eprint = ?",
+                (eprint,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            # Read the files with the lock held, so that they are not evicted
+            # meanwhile by this process
+            bbl_files = []
+            try:
+                for hash in json.loads(row[0]):
+                    with open(self._file_path(hash), "rb") as fh:
+                        bbl_files.append(fh.read().decode("utf-8"))
+            except FileNotFoundError:
+                # Evicted by another process
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE eprints SET last_used = ? WHERE eprint = ?",
+                (time.time(), eprint))
+            self._db.commit()
+            self.hits += 1
+        return bbl_files
+
+    def set(self, eprint, bbl_files):
+        """
+        Store the ``.bbl`` files of an e-print.
+
+        :param eprint: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``).
+        :param bbl_files: A list of the ``.bbl`` files as text.
+        """
+        contents = [bbl_file.encode("utf-8") for bbl_file in bbl_files]
+        hashes = [hashlib.sha256(content).hexdigest() for content in contents]
+        with self._lock:
+            self._remove(eprint)
+            for hash, content in zip(hashes, contents):
+                updated = self._db.execute(
+                    "UPDATE files SET refs = refs + 1 WHERE hash = ?",
+                    (hash,)).rowcount
+                if updated:
+                    continue
+                file_path = self._file_path(hash)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, "wb") as fh:
+                    fh.write(content)
+                self._db.execute("INSERT INTO files VALUES (?, ?, 1)",
+                                 (hash, len(content)))
+                self._size += len(content)
+            self._db.execute("INSERT INTO eprints VALUES (?, ?, ?)",
+                             (eprint, json.dumps(hashes), time.time()))
+            # Other processes may share the store
+            self._size = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+            # Evict least recently used e-prints
+            while self._size > self.max_size:
+                row = self._db.execute(
+                    "SELECT eprint FROM eprints WHERE eprint != ? "
+                    "ORDER BY last_used LIMIT 1", (eprint,)).fetchone()
+                if row is None:
+                    break
+                self._remove(row[0])
+            self._db.commit()
+
+    def _remove(self, eprint):
+        """
+        Remove an e-print from the store, and its files if they are not used
+        anymore. Must be called with the lock held.
+        """
+        row = self._db.execute("SELECT hashes FROM eprints WHERE eprint = ?",
+                               (eprint,)).fetchone()
+        if row is None:
+            return
+        self._db.execute("DELETE FROM eprints WHERE eprint = ?", (eprint,))
+        for hash in json.loads(row[0]):
+            self._db.execute(
+                "UPDATE files SET refs = refs - 1 WHERE hash = ?", (hash,))
+            size = self._db.execute(
+                "SELECT size FROM files WHERE hash = ? AND refs <= 0",
+                (hash,)).fetchone()
+            if size is not None:
+                self._db.execute("DELETE FROM files WHERE hash = ?", (hash,))
+                try:
+                    os.remove(self._file_path(hash))
+                except FileNotFoundError:
+                    # Already removed by another process
+                    pass
+                self._size -= size[0]
+
+    def fetch(self, eprint, download):
+        """
+        Get the ``.bbl`` files of an e-print, from the store if possible.
+
+        :param eprint: The arXiv id (e.g. ``1401.2910`` or ``1401.2910v1``).
+        :param download: A function taking the e-print id and returning the \
+                list of its ``.bbl`` files, called on a miss.
+        :returns: A list of the ``.bbl`` files as text.
+        """
+        bbl_files = self.get(eprint)
+        if bbl_files is not None:
+            return bbl_files
+        if self.offline:
+            raise OfflineMiss(eprint)
+        bbl_files = download(eprint)
+        self.set(eprint, bbl_files)
+        return bbl_files
+
+    def stats(self):
+        """
+        Get the counters of the store.
+
+        :returns: A dict with the number of ``hits``, ``misses`` and the \
+                ``size`` of the stored files.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": self._size
+        }
+
+
+class OAVersionCache(object):
+    """
+    On-disk (SQLite) cache of the open access versions of DOIs.
+
+    DOIs without any open access version are stored too, with their own TTL.
+
+    :param path: Path to the SQLite file, ``:memory:`` for a cache in memory.
+    :param ttl: Time to live (in seconds) of found open access versions.
+    :param negative_ttl: Time to live (in seconds) of DOIs without open \
+            access version.
+    """
+    def __init__(self, path, ttl=90 * 24 * 3600, negative_ttl=14 * 24 * 3600):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS oa_versions ("
+                         "doi TEXT PRIMARY KEY, "
+                         "url TEXT, "
+                         "expires REAL NOT NULL)")
+        self._db.commit()
+
+    def get(self, doi):
+        """
+        Get the cached open access version of a DOI.
+
+        :param doi: A DOI.
+        :returns: ``None`` on a miss, a tuple ``(url, )`` otherwise, where \
+                ``url`` is ``None`` if there is no open access version.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, expires FROM oa_versions WHERE doi = ?",
+                (doi.lower(),)).fetchone()
+            if row is None or row[1] < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return (row[0],)
+
+    def set(self, doi, url):
+        """
+        Store the open access version of a DOI.
+
+        :param doi: A DOI.
+        :param url: The URL of the open access version, or ``None``.
+        """
+        ttl = self.ttl if url is not None else self.negative_ttl
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO oa_versions VALUES (?, ?, ?)",
+                (doi.lower(), url, time.time() + ttl))
+            self._db.commit()
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+
+        :returns: A dict with the number of ``hits`` and ``misses``.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,140 @@
+"""
+This file contains the HTTP client shared by all the ``reference_fetcher``
+functions.
+"""
+import collections
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HTTPClient(object):
+    """
+    HTTP client with keep-alive connection pools per host, default timeouts,
+    retries with exponential backoff on 429 and 5xx errors and conditional
+    (``ETag`` / ``Last-Modified``) revalidation of GET requests.
+
+    :param timeout: Default timeout (in seconds), either a number or a \
+            ``(connect, read)`` tuple.
+    :param retries: Number of retries on connection errors, 429 and 5xx.
+    :param backoff_factor: Backoff factor between retries, see ``urllib3``.
+    :param pool_maxsize: Maximum number of kept-alive connections per host.
+    :param base_urls: Optional dict to rewrite URLs prefixes, e.g. \
+            ``{"http://export.arxiv.org": "http://localhost:8001"}`` to point \
+            at a local stand-in server.
+    :param max_revalidation_entries: Maximum number of responses kept for \
+            conditional revalidation.
+    """
+    def __init__(self, timeout=(10, 60), retries=3, backoff_factor=0.5,
+                 pool_maxsize=10, base_urls=None,
+                 max_revalidation_entries=1024):
+        self.timeout = timeout
+        self.base_urls = base_urls or {}
+        self.max_revalidation_entries = max_revalidation_entries
+        self._revalidation = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=None,
+                      raise_on_status=False,
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=10,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _url(self, url):
+        """
+        Rewrite an URL according to ``base_urls``.
+        """
+        for prefix, base_url in self.base_urls.items():
+            if url.startswith(prefix):
+                return base_url + url[len(prefix):]
+        return url
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request, see ``requests.Session.request``.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, self._url(url), **kwargs)
+
+    def get(self, url, params=None, revalidate=False, **kwargs):
+        """
+        Send a GET request.
+
+        :param url: The URL to query.
+        :param params: Optional GET parameters.
+        :param revalidate: If ``True``, the response is kept and the next \
+                identical request is sent with ``If-None-Match`` / \
+                ``If-Modified-Since`` headers. The kept response is returned \
+                on a ``304 Not Modified``.
+        :returns: A ``requests.Response``.
+        """
+        if not revalidate:
+            return self.request("GET", url, params=params, **kwargs)
+        key = requests.Request("GET", self._url(url),
+                               params=params).prepare().url
+        with self._lock:
+            cached = self._revalidation.get(key)
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached is not None:
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+        r = self.request("GET", url, params=params, headers=headers, **kwargs)
+        if r.status_code == 304 and cached is not None:
+            with self._lock:
+                # May have been evicted by another thread meanwhile
+                cached = self._revalidation.get(key)
+                if cached is not None:
+                    self._revalidation.move_to_end(key)
+            if cached is not None:
+                return cached
+            # Nothing to return on the 304, fetched again as a miss
+            headers.pop("If-None-Match", None)
+            headers.pop("If-Modified-Since", None)
+            r = self.request("GET", url, params=params, headers=headers,
+                             **kwargs)
+        if (r.status_code == requests.codes.ok and
+                ("ETag" in r.headers or "Last-Modified" in r.headers)):
+            with self._lock:
+                self._revalidation[key] = r
+                self._revalidation.move_to_end(key)
+                while (len(self._revalidation) >
+                       self.max_revalidation_entries):
+                    self._revalidation.popitem(last=False)
+        return r
+
+    def post(self, url, **kwargs):
+        """
+        Send a POST request, see ``requests.Session.post``.
+        """
+        return self.request("POST", url, **kwargs)
+
+
+_client = HTTPClient()
+
+
+def get_client():
+    """
+    Get the HTTP client used by ``reference_fetcher``.
+    """
+    return _client
+
+
+def set_client(client):
+    """
+    Replace the HTTP client used by ``reference_fetcher``, e.g. to point it
+    at local stand-in servers in tests and benchmarks.
+
+    :param client: An ``HTTPClient``.
+    """
+    global _client
+    _client = client
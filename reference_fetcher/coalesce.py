@@ -0,0 +1,97 @@
+"""
+This file contains a request-coalescing layer, to serve concurrent lookups
+with a single batched upstream query.
+"""
+import concurrent.futures
+import threading
+
+
+class BatchCoalescer(object):
+    """
+    Group lookups made by concurrent callers into batches.
+
+    Keys requested within ``delay`` seconds of each other (or until
+    ``max_batch`` keys are pending) are looked up with a single call to
+    ``batch_function``. Callers asking for a key already pending share the
+    same result.
+
+    :param batch_function: A function taking a list of keys and returning a \
+            dict of keys and their values. Keys missing in the dict get \
+            ``None``.
+    :param max_batch: Maximum number of keys in a batch.
+    :param delay: Time (in seconds) to wait for other keys before sending a \
+            batch.
+    """
+    def __init__(self, batch_function, max_batch=100, delay=0.02):
+        self.batch_function = batch_function
+        self.max_batch = max_batch
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def submit(self, key):
+        """
+        Request the value of a key.
+
+        :param key: The key to look up.
+        :returns: A ``concurrent.futures.Future`` of the value.
+        """
+        batch = None
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = concurrent.futures.Future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                batch = self._take_batch()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch is not None:
+            self._run(batch)
+        return future
+
+    def get(self, key):
+        """
+        Get the value of a key, waiting for its batch to be looked up.
+
+        :param key: The key to look up.
+        :returns: The value associated to the key.
+        """
+        return self.submit(key).result()
+
+    def flush(self):
+        """
+        Look up the pending keys right now.
+        """
+        with self._lock:
+            batch = self._take_batch()
+        self._run(batch)
+
+    def _take_batch(self):
+        """
+        Take all the pending keys. Must be called with the lock held.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        return batch
+
+    def _run(self, batch):
+        """
+        Look up a batch of keys and resolve their futures.
+        """
+        if not batch:
+            return
+        try:
+            values = self.batch_function(list(batch))
+        except Exception as exc:
+            for future in batch.values():
+                future.set_exception(exc)
+            return
+        for key, future in batch.items():
+            future.set_result(values.get(key))
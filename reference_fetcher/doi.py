@@ -1,12 +1,18 @@
 """
 This file contains all the DOI-related functions.
 """
+import concurrent.futures
 import requests
 
+from . import client
 from . import regex
 from . import tools
 
 
+# Maximum number of concurrent requests to Dissemin
+OA_MAX_WORKERS = 8
+
+
 def extract_doi_links(urls):
     """
     Try to find a DOI from a given list of URLs.
@@ -36,6 +42,30 @@ def extract_arxiv_links(urls):
         return None
 
 
+def clean_doi(doi):
+    """
+    Clean a DOI matched in a text by ``match_doi_or_arxiv``.
+
+    :param doi: The matched DOI, lowercased.
+    :returns: The cleaned DOI.
+    """
+    cleanDOI = doi.replace(':', '').replace(' ', '')
+    if regex.clean_doi.search(cleanDOI):
+        cleanDOI = cleanDOI[1:]
+    # FABSE J fix
+    if regex.clean_doi_fabse.search(cleanDOI):
+        cleanDOI = cleanDOI[:20]
+    # Second JCB fix
+    if regex.clean_doi_jcb.search(cleanDOI):
+        cleanDOI = cleanDOI[:21]
+    if len(cleanDOI) > 40:
+        # Long DOIs used to be trimmed by a digit-scanning loop whose
+        # break was unreachable, so that it always dropped the last
+        # char only.
+        cleanDOI = cleanDOI[:-1]
+    return cleanDOI
+
+
 def match_doi_or_arxiv(text, only=["DOI", "arXiv"]):
     """
     Search for a valid article ID (DOI or ArXiv) in the given text
@@ -63,28 +93,7 @@ def match_doi_or_arxiv(text, only=["DOI", "arXiv"]):
                 extractID = regex.doi_jsb.search(text)
         if extractID:
             # If DOI extracted, clean it and return it
-            cleanDOI = False
-            cleanDOI = extractID.group(0).replace(':', '').replace(' ', '')
-            if regex.clean_doi.search(cleanDOI):
-                cleanDOI = cleanDOI[1:]
-            # FABSE J fix
-            if regex.clean_doi_fabse.search(cleanDOI):
-                cleanDOI = cleanDOI[:20]
-            # Second JCB fix
-            if regex.clean_doi_jcb.search(cleanDOI):
-                cleanDOI = cleanDOI[:21]
-            if len(cleanDOI) > 40:
-                cleanDOItemp = regex.clean_doi_len.sub('000', cleanDOI)
-                reps = {'.': 'A', '-': '0'}
-                cleanDOItemp = tools.replaceAll(cleanDOItemp[8:], reps)
-                digitStart = 0
-                for i in range(len(cleanDOItemp)):
-                    if cleanDOItemp[i].isdigit():
-                        digitStart = 1
-                        if cleanDOItemp[i].isalpha() and digitStart:
-                            break
-                cleanDOI = cleanDOI[0:(8+i)]
-            return ("DOI", cleanDOI)
+            return ("DOI", clean_doi(extractID.group(0)))
     # Else, try to extract arXiv
     if "arXiv" in only:
         extractID = regex.arXiv.search(text)
@@ -93,6 +102,80 @@ def match_doi_or_arxiv(text, only=["DOI", "arXiv"]):
     return None
 
 
+def scan_doi_or_arxiv(text):
+    """
+    Search for a valid article ID (DOI or ArXiv) in the given text, in a
+    single pass of ``regex.identifiers`` over it.
+
+    Same as ``match_doi_or_arxiv(text)``, without its copies of the text and
+    its successive searches.
+
+    :param text: Input text on which matching is to be done.
+    :returns: a tuple ``(type, first matching ID)`` or ``None`` if not found.
+    """
+    text = text.lower()
+    # Rare texts matched differently without the rewriting of "&#338;", or
+    # without the case-insensitive patterns, for which "ı" is "i" and "ſ" is
+    # "s", even once lowercased
+    if "&#338;" in text or "ı" in text or "ſ" in text:
+        return match_doi_or_arxiv(text)
+    found = {}
+    for match in regex.identifiers.finditer(text):
+        kind = match.lastgroup
+        if kind == "doi":
+            # First match of the first pattern, nothing to look for further
+            return ("DOI", clean_doi(match.group(kind)))
+        found.setdefault(kind, match.group(kind))
+    if "doi_pnas" in found:
+        return ("DOI", clean_doi(found["doi_pnas"].replace("pnas", "/pnas")))
+    if "doi_jsb" in found:
+        return ("DOI", clean_doi("10" + found["doi_jsb"]))
+    if "arXiv" in found:
+        return ("arXiv", found["arXiv"])
+    return None
+
+
+def extract_identifiers(citations):
+    """
+    Find the URLs, DOIs and arXiv ids of a list of cleaned plaintext
+    citations.
+
+    The DOI or arXiv id in the text is only looked for when no DOI or arXiv
+    link was found in the URLs, see ``scan_doi_or_arxiv``.
+
+    :param citations: A list of cleaned plaintext citations.
+    :returns: A list of tuples ``(citation, urls, match)``, where \
+            ``citation`` is the citation with URLs removed, ``urls`` the \
+            lowercased URLs found in it and ``match`` the result of \
+            ``scan_doi_or_arxiv`` (or ``None``).
+    """
+    results = []
+    for citation in citations:
+        raw_urls = regex.urls.findall(citation)
+        # Remove URLs in citation
+        for url in raw_urls:
+            citation = citation.replace(url, "")
+        citation = tools.clean_whitespaces(citation)
+        urls = [u.lower() for u in raw_urls]
+        match = None
+        if not extract_arxiv_links(urls) and not extract_doi_links(urls):
+            match = scan_doi_or_arxiv(citation)
+        results.append((citation, urls, match))
+    return results
+
+
+def strip_doi_link(doi):
+    """
+    Get the DOI out of a dx.doi.org link.
+
+    :param doi: A DOI or a dx.doi.org link.
+    :returns: The DOI.
+    """
+    if "dx.doi.org" in doi:
+        doi = doi[doi.find("dx.doi.org") + 11:]
+    return doi
+
+
 def get_oa_version(doi):
     """
     Get an OA version for a given DOI.
@@ -101,9 +184,9 @@ def get_oa_version(doi):
     :returns: The URL of the OA version of the given DOI, or ``None``.
     """
     # If DOI is a link, truncate it
-    if "dx.doi.org" in doi:
-        doi = doi[doi.find("dx.doi.org") + 11:]
-    r = requests.get("http://beta.dissem.in/api/%s" % (doi,))
+    doi = strip_doi_link(doi)
+    r = client.get_client().get("http://beta.dissem.in/api/%s" % (doi,),
+                                revalidate=True)
     oa_url = None
     if r.status_code == requests.codes.ok:
         result = r.json()
@@ -113,3 +196,42 @@ def get_oa_version(doi):
            "pdf_url" in result["paper"]):
             oa_url = result["paper"]["pdf_url"]
     return oa_url
+
+
+def get_oa_versions(dois, cache=None, max_workers=OA_MAX_WORKERS):
+    """
+    Get the OA versions of a list of DOIs, concurrently.
+
+    :param dois: A list of DOIs or dx.doi.org links.
+    :param cache: An optional ``cache.OAVersionCache``, consulted first and \
+            updated with the results.
+    :param max_workers: Maximum number of concurrent requests.
+    :returns: A dict of the given DOIs and the URL of their OA version, or \
+            ``None``.
+    """
+    oa_urls = {}
+    to_fetch = []
+    for doi in set(dois):
+        cached = None
+        if cache is not None:
+            cached = cache.get(strip_doi_link(doi))
+        if cached is not None:
+            oa_urls[doi] = cached[0]
+        else:
+            to_fetch.append(doi)
+    if len(to_fetch) == 0:
+        return oa_urls
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(get_oa_version, doi): doi
+                   for doi in to_fetch}
+        for future in concurrent.futures.as_completed(futures):
+            doi = futures[future]
+            try:
+                oa_urls[doi] = future.result()
+            except (requests.exceptions.RequestException, ValueError):
+                # Failed lookups are not cached
+                oa_urls[doi] = None
+                continue
+            if cache is not None:
+                cache.set(strip_doi_link(doi), oa_urls[doi])
+    return oa_urls
@@ -0,0 +1,215 @@
+"""
+This file contains the readers of local metadata dumps: arXiv OAI-PMH XML
+harvests and Crossref or arXiv JSON lines.
+
+All the readers stream their input and yield records as dicts with the
+following keys (any of them may be ``None``): ``doi``, ``arxiv_id``,
+``title``, ``authors`` (a list of family names), ``year`` and ``journal``.
+"""
+import gzip
+import json
+import os
+import xml.etree.ElementTree
+
+from . import regex
+
+
+OAI_NS = "{http://www.openarchives.org/OAI/2.0/}"
+ARXIV_OAI_NS = "{http://arxiv.org/OAI/arXiv/}"
+
+
+def open_dump(path):
+    """
+    Open a dump file, transparently decompressing ``.gz`` files.
+
+    :param path: Path to the dump file.
+    :returns: A binary file object.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def dump_format(path):
+    """
+    Guess the format of a dump file from its extension.
+
+    :param path: Path to the dump file.
+    :returns: One of ``xml``, ``jsonl`` or ``json``, or ``None``.
+    """
+    if path.endswith(".gz"):
+        path = path[:-len(".gz")]
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".xml":
+        return "xml"
+    elif extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    elif extension == ".json":
+        return "json"
+    return None
+
+
+def dump_files(paths):
+    """
+    List the dump files, walking directories (e.g. the pages of an OAI-PMH
+    harvest).
+
+    :param paths: A list of paths to dump files or directories.
+    :returns: A sorted list of paths to dump files of a known format.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names
+                             if dump_format(name) is not None)
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def _year(*texts):
+    """
+    Get the first year found in some texts.
+    """
+    for text in texts:
+        if text:
+            match = regex.year.search(text)
+            if match:
+                return match.group(0)
+    return None
+
+
+def iter_arxiv_oai(fileobj):
+    """
+    Stream the records of an arXiv OAI-PMH harvest, in the ``arXiv``
+    metadata format.
+
+    Records are dropped from the tree as soon as they are read, so that memory
+    stays constant whatever the size of the harvest.
+
+    :param fileobj: A binary file object of the XML document.
+    :returns: A generator of records.
+    """
+    stack = []
+    for event, element in xml.etree.ElementTree.iterparse(
+            fileobj, events=("start", "end")):
+        if event == "start":
+            stack.append(element)
+            continue
+        stack.pop()
+        if element.tag == ARXIV_OAI_NS + "arXiv":
+            authors = []
+            for author in element.iter(ARXIV_OAI_NS + "author"):
+                keyname = author.findtext(ARXIV_OAI_NS + "keyname")
+                if keyname:
+                    authors.append(keyname)
+            journal = element.findtext(ARXIV_OAI_NS + "journal-ref")
+            yield {
+                "doi": element.findtext(ARXIV_OAI_NS + "doi"),
+                "arxiv_id": element.findtext(ARXIV_OAI_NS + "id"),
+                "title": element.findtext(ARXIV_OAI_NS + "title"),
+                "authors": authors,
+                "year": _year(journal,
+                              element.findtext(ARXIV_OAI_NS + "created")),
+                "journal": journal,
+            }
+        elif element.tag != OAI_NS + "record":
+            continue
+        if stack:
+            stack[-1].remove(element)
+
+
+def _crossref_record(item):
+    """
+    Convert a Crossref work to a record.
+    """
+    year = None
+    for key in ("issued", "published-print", "published-online", "created"):
+        date_parts = (item.get(key) or {}).get("date-parts") or [[None]]
+        if date_parts[0] and date_parts[0][0] is not None:
+            year = str(date_parts[0][0])
+            break
+    return {
+        "doi": item.get("DOI"),
+        "arxiv_id": None,
+        "title": " ".join(item.get("title") or []) or None,
+        "authors": [author["family"] for author in item.get("author") or []
+                    if author.get("family")],
+        "year": year,
+        "journal": " ".join(item.get("container-title") or []) or None,
+    }
+
+
+def _arxiv_json_record(item):
+    """
+    Convert an arXiv JSON metadata record (as in the arXiv metadata snapshot)
+    to a record.
+    """
+    authors = [author[0] for author in item.get("authors_parsed") or []
+               if author and author[0]]
+    versions = item.get("versions") or [{}]
+    return {
+        "doi": item.get("doi"),
+        "arxiv_id": item.get("id"),
+        "title": item.get("title"),
+        "authors": authors,
+        "year": _year(item.get("journal-ref"), versions[0].get("created"),
+                      item.get("update_date")),
+        "journal": item.get("journal-ref"),
+    }
+
+
+def _json_records(item):
+    """
+    Convert a JSON document (Crossref work, Crossref API page with
+    ``items``, or arXiv metadata record) to records.
+    """
+    if "message" in item:
+        item = item["message"]
+    if "items" in item:
+        for i in item["items"]:
+            yield _crossref_record(i)
+    elif "DOI" in item:
+        yield _crossref_record(item)
+    elif "id" in item:
+        yield _arxiv_json_record(item)
+
+
+def iter_jsonl(fileobj):
+    """
+    Stream the records of a JSON lines dump, one Crossref work or arXiv
+    metadata record per line.
+
+    :param fileobj: A binary file object of the dump.
+    :returns: A generator of records.
+    """
+    for line in fileobj:
+        line = line.strip()
+        if not line:
+            continue
+        yield from _json_records(json.loads(line.decode("utf-8")))
+
+
+def iter_records(paths):
+    """
+    Stream the records of some dump files.
+
+    :param paths: A list of paths to dump files or directories, see \
+            ``dump_files``. ``.xml`` files are arXiv OAI-PMH harvests, \
+            ``.jsonl`` files are JSON lines and ``.json`` files are single \
+            JSON documents (e.g. a Crossref API page). All of them may be \
+            gzipped.
+    :returns: A generator of records.
+    """
+    for path in dump_files(paths):
+        format = dump_format(path)
+        with open_dump(path) as fh:
+            if format == "xml":
+                yield from iter_arxiv_oai(fh)
+            elif format == "jsonl":
+                yield from iter_jsonl(fh)
+            elif format == "json":
+                yield from _json_records(json.load(fh))
+            else:
+                raise ValueError("Unknown dump format for %s." % (path,))
@@ -0,0 +1,333 @@
+"""
+This file contains the local identifier index, matching plaintext citations
+to DOIs or arXiv ids without any network round trip.
+
+The index is built from local metadata dumps (see ``dumps.py``). It maps the
+normalized tokens of the titles and authors of the indexed papers to the
+papers, which are scored against the citation on their title, authors, year
+and journal.
+"""
+import os
+import threading
+import unicodedata
+
+from . import cache
+from . import dumps
+from . import regex
+
+
+# Minimum confidence of a match to be trusted, see ``IdentifierIndex.match``
+MIN_CONFIDENCE = 0.85
+# Size (in bytes) of the memory map of the index file
+MMAP_SIZE = 4 * 1024 ** 3
+# Number of the rarest tokens of a citation used to find candidates
+QUERY_TOKENS = 8
+# Number of candidates scored for each citation
+CANDIDATES = 20
+# Tokens found in more papers than this are never used to find candidates
+MAX_POSTINGS = 100000
+# Number of records indexed in a single transaction
+BATCH_SIZE = 10000
+
+# Weights of the parts of the score of a candidate
+TITLE_WEIGHT = 0.55
+AUTHORS_WEIGHT = 0.25
+YEAR_WEIGHT = 0.1
+JOURNAL_WEIGHT = 0.1
+
+STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "by", "de", "for", "from", "in",
+    "into", "is", "its", "of", "on", "or", "the", "to", "via", "with"
+])
+
+
+def tokenize(text):
+    """
+    Normalize a text and split it in tokens: accents are stripped,
+    everything is lowercased and only ASCII letters and digits are kept.
+
+    :param text: Some text.
+    :returns: A list of tokens, in order.
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return regex.index_tokens.findall(text.lower())
+
+
+def _covers(token, tokens, squashed):
+    """
+    Whether a token of an indexed paper is in a citation. Long tokens may be
+    split in the citation, e.g. by the cleaning of ``{E}lektrodynamik``.
+    """
+    return token in tokens or (len(token) >= 4 and token in squashed)
+
+
+def _abbreviates(token, tokens):
+    """
+    Whether a token of a journal name is abbreviated in a citation, e.g.
+    ``physical`` by ``phys``.
+    """
+    return any(len(i) >= 3 and token.startswith(i) for i in tokens)
+
+
+def score(citation_tokens, title, authors, year, journal):
+    """
+    Score an indexed paper against a citation.
+
+    :param citation_tokens: The tokens of the citation.
+    :param title: The tokens of the title of the paper.
+    :param authors: The tokens of the family names of the authors.
+    :param year: The year of the paper, or ``None``.
+    :param journal: The tokens of the journal of the paper.
+    :returns: A confidence between 0 and 1.
+    """
+    tokens = set(citation_tokens)
+    squashed = "".join(citation_tokens)
+    if not title:
+        return 0.0
+    title_score = (len([i for i in title if _covers(i, tokens, squashed)]) /
+                   len(title))
+    if authors:
+        authors_score = float(any(_covers(i, tokens, squashed)
+                                  for i in authors))
+    else:
+        authors_score = 0.5
+    if year is None or not year.isdigit():
+        year_score = 0.5
+    elif year in tokens:
+        year_score = 1.0
+    elif str(int(year) - 1) in tokens or str(int(year) + 1) in tokens:
+        # Preprint and published versions often differ by a year
+        year_score = 0.5
+    else:
+        year_score = 0.0
+    journal = [i for i in journal if len(i) >= 3]
+    if journal:
+        journal_score = (len([i for i in journal
+                              if i in tokens or _abbreviates(i, tokens)]) /
+                         len(journal))
+    else:
+        journal_score = 0.5
+    return (TITLE_WEIGHT * title_score +
+            AUTHORS_WEIGHT * authors_score +
+            YEAR_WEIGHT * year_score +
+            JOURNAL_WEIGHT * journal_score)
+
+
+class IdentifierIndex(object):
+    """
+    On-disk (SQLite) index of the titles, authors, years and journals of
+    papers with a DOI or an arXiv id.
+
+    The index file is memory-mapped, so that the worker processes sharing it
+    share its pages in the OS cache. It is updated incrementally with
+    ``update``: unchanged dump files are skipped and papers are upserted on
+    their DOI or arXiv id.
+
+    :param path: Path to the SQLite file, ``:memory:`` for an index in \
+            memory.
+    :param min_confidence: Minimum confidence of a match to be trusted.
+    :param mmap_size: Size (in bytes) of the memory map of the index file.
+    """
+    def __init__(self, path, min_confidence=MIN_CONFIDENCE,
+                 mmap_size=MMAP_SIZE):
+        self.min_confidence = min_confidence
+        self.matches = 0
+        self.low_confidence = 0
+        self._lock = threading.Lock()
+        self._db = cache.connect(path)
+        self._db.execute("PRAGMA mmap_size = %d" % (mmap_size,))
+        self._db.execute("CREATE TABLE IF NOT EXISTS records ("
+                         "id INTEGER PRIMARY KEY, "
+                         "doi TEXT UNIQUE, "
+                         "arxiv_id TEXT UNIQUE, "
+                         "title TEXT NOT NULL, "
+                         "authors TEXT NOT NULL, "
+                         "year TEXT, "
+                         "journal TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS postings ("
+                         "token TEXT NOT NULL, "
+                         "record_id INTEGER NOT NULL, "
+                         "PRIMARY KEY (token, record_id)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS tokens ("
+                         "token TEXT PRIMARY KEY, "
+                         "df INTEGER NOT NULL) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sources ("
+                         "path TEXT PRIMARY KEY, "
+                         "size INTEGER NOT NULL, "
+                         "mtime REAL NOT NULL)")
+        self._db.commit()
+
+    def _add(self, record):
+        """
+        Upsert a record from a dump. Must be called with the lock held.
+
+        :returns: Whether the record was indexed.
+        """
+        doi = record.get("doi")
+        doi = doi.strip().lower() if doi else None
+        arxiv_id = record.get("arxiv_id")
+        arxiv_id = (regex.arxiv_version.sub("", arxiv_id.strip())
+                    if arxiv_id else None)
+        title = [i for i in tokenize(record.get("title"))
+                 if i not in STOPWORDS]
+        if (doi is None and arxiv_id is None) or not title:
+            return False
+        authors = []
+        for name in record.get("authors") or []:
+            authors.extend(i for i in tokenize(name) if len(i) > 1)
+        journal = tokenize(record.get("journal"))
+        rows = self._db.execute(
+            "SELECT id, doi, arxiv_id, title, authors FROM records "
+            "WHERE doi = ? OR arxiv_id = ?", (doi, arxiv_id)).fetchall()
+        for row in rows:
+            # Remove the previous versions of the record
+            doi = doi or row[1]
+            arxiv_id = arxiv_id or row[2]
+            self._db.execute("DELETE FROM postings WHERE record_id = ?",
+                             (row[0],))
+            self._db.executemany(
+                "UPDATE tokens SET df = df - 1 WHERE token = ?",
+                [(i,) for i in set(row[3].split() + row[4].split())])
+            self._db.execute("DELETE FROM records WHERE id = ?", (row[0],))
+        id = self._db.execute(
+            "INSERT INTO records "
+            "(doi, arxiv_id, title, authors, year, journal) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (doi, arxiv_id, " ".join(title), " ".join(authors),
+             record.get("year"), " ".join(journal))).lastrowid
+        tokens = set(title + authors)
+        self._db.executemany("INSERT INTO postings VALUES (?, ?)",
+                             [(i, id) for i in tokens])
+        self._db.executemany(
+            "INSERT INTO tokens VALUES (?, 1) "
+            "ON CONFLICT (token) DO UPDATE SET df = df + 1",
+            [(i,) for i in tokens])
+        return True
+
+    def add(self, records):
+        """
+        Index some records, by transactions of ``BATCH_SIZE`` records.
+
+        :param records: An iterable of records, see ``dumps.py``.
+        :returns: The number of indexed records.
+        """
+        count = 0
+        with self._lock:
+            for i, record in enumerate(records, 1):
+                count += self._add(record)
+                if i % BATCH_SIZE == 0:
+                    self._db.commit()
+            self._db.commit()
+        return count
+
+    def update(self, paths, force=False):
+        """
+        Update the index from some dump files, skipping the ones which did not
+        change since they were last indexed.
+
+        .. note::
+
+            Papers removed from a dump file are kept in the index.
+
+        :param paths: A list of paths to dump files or directories, see \
+                ``dumps.iter_records``.
+        :param force: Index all the dump files, even unchanged ones.
+        :returns: The number of indexed records.
+        """
+        count = 0
+        for path in dumps.dump_files(paths):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT size, mtime FROM sources WHERE path = ?",
+                    (path,)).fetchone()
+            if not force and row == (stat.st_size, stat.st_mtime):
+                continue
+            count += self.add(dumps.iter_records([path]))
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime))
+                self._db.commit()
+        return count
+
+    def match(self, citation):
+        """
+        Find the best matching indexed paper for a citation.
+
+        :param citation: A cleaned plaintext citation.
+        :returns: ``None`` if no candidate was found, a tuple ``(url, \
+                confidence)`` otherwise, where ``url`` is the DOI URL (or \
+                the arXiv URL if there is no DOI) of the best candidate.
+        """
+        citation_tokens = tokenize(citation)
+        query = set(i for i in citation_tokens
+                    if len(i) > 2 and i not in STOPWORDS and not i.isdigit())
+        if not query:
+            return None
+        placeholders = ", ".join("?" * len(query))
+        with self._lock:
+            rare = sorted(
+                (df, token) for token, df in self._db.execute(
+                    "SELECT token, df FROM tokens WHERE token IN (%s)" % (
+                        placeholders,), list(query))
+                if 0 < df <= MAX_POSTINGS)[:QUERY_TOKENS]
+            if not rare:
+                return None
+            rows = self._db.execute(
+                "SELECT doi, arxiv_id, title, authors, year, journal "
+                "FROM records WHERE id IN ("
+                "SELECT record_id FROM postings WHERE token IN (%s) "
+                "GROUP BY record_id ORDER BY COUNT(*) DESC LIMIT ?)" % (
+                    ", ".join("?" * len(rare)),),
+                [token for _, token in rare] + [CANDIDATES]).fetchall()
+        best = None
+        for doi, arxiv_id, title, authors, year, journal in rows:
+            confidence = score(citation_tokens, title.split(),
+                               authors.split(), year, journal.split())
+            # Papers with a DOI are preferred on a tie
+            key = (confidence, doi is not None)
+            if best is None or key > best[0]:
+                if doi is not None:
+                    url = "http://dx.doi.org/%s" % (doi,)
+                else:
+                    url = "http://arxiv.org/abs/%s" % (arxiv_id,)
+                best = (key, url)
+        if best is None:
+            return None
+        return (best[1], best[0][0])
+
+    def lookup(self, citation):
+        """
+        Get the DOI or arXiv URL of a citation, if it matches an indexed paper
+        with enough confidence.
+
+        :param citation: A cleaned plaintext citation.
+        :returns: The DOI or arXiv URL, or ``None`` on a low-confidence match.
+        """
+        match = self.match(citation)
+        if match is None or match[1] < self.min_confidence:
+            self.low_confidence += 1
+            return None
+        self.matches += 1
+        return match[0]
+
+    def stats(self):
+        """
+        Get the counters of the index.
+
+        :returns: A dict with the number of confident ``matches``, \
+                ``low_confidence`` matches and indexed ``records``.
+        """
+        with self._lock:
+            records = self._db.execute(
+                "SELECT COUNT(*) FROM records").fetchone()[0]
+        return {
+            "matches": self.matches,
+            "low_confidence": self.low_confidence,
+            "records": records
+        }
@@ -0,0 +1,225 @@
+"""
+This file contains lightweight per-stage instrumentation of the references
+pipeline.
+
+Stages are timed with ``stage``, and their durations and counts (bytes,
+bibitems, cache hits…) are sent to the global sink (see ``set_sink``) and to
+the sinks collecting for the current thread (see ``collect``). When there is
+no sink at all, ``stage`` returns a shared no-op timer.
+"""
+import threading
+import time
+
+
+_sink = None
+_local = threading.local()
+
+
+class _NoopTimer(object):
+    """
+    Timer used when instrumentation is disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add(self, key, value=1):
+        pass
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer(object):
+    """
+    Timer of a single run of a stage.
+    """
+    def __init__(self, name, sinks, counts):
+        self.name = name
+        self.sinks = sinks
+        self.counts = counts
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        duration = time.perf_counter() - self.start
+        for sink in self.sinks:
+            sink.record(self.name, duration, self.counts)
+        return False
+
+    def add(self, key, value=1):
+        """
+        Add ``value`` to the ``key`` count of this stage.
+        """
+        self.counts[key] = self.counts.get(key, 0) + value
+
+
+def enabled():
+    """
+    Whether there is any sink for the current thread.
+    """
+    return _sink is not None or bool(getattr(_local, "sinks", None))
+
+
+def stage(name, **counts):
+    """
+    Time a stage of the pipeline.
+
+    .. code-block:: python
+
+        with instrumentation.stage("cleaning", bibitems=len(bibitems)) as t:
+            …
+            t.add("bytes", size)
+
+    :param name: The name of the stage.
+    :param counts: Initial counts of the stage.
+    :returns: A context manager, with an ``add(key, value=1)`` method to \
+            update the counts.
+    """
+    local_sinks = getattr(_local, "sinks", None)
+    if _sink is None and not local_sinks:
+        return _NOOP_TIMER
+    sinks = list(local_sinks or [])
+    if _sink is not None:
+        sinks.append(_sink)
+    return _Timer(name, sinks, counts)
+
+
+def set_sink(sink):
+    """
+    Set the global sink, receiving the records of all the threads.
+
+    :param sink: An object with a ``record(stage, duration, counts)`` \
+            method, or ``None`` to disable instrumentation.
+    """
+    global _sink
+    _sink = sink
+
+
+def collect():
+    """
+    Collect the records of the current thread in a ``HistogramSink``, e.g.
+    to get a per-paper breakdown.
+
+    .. code-block:: python
+
+        with instrumentation.collect() as breakdown:
+            arxiv.get_cited_dois(eprint)
+        print(breakdown.format())
+
+    :returns: A context manager, returning the ``HistogramSink``.
+    """
+    return _Collector()
+
+
+class _Collector(object):
+    """
+    Context manager returned by ``collect``.
+    """
+    def __enter__(self):
+        self.sink = HistogramSink()
+        if getattr(_local, "sinks", None) is None:
+            _local.sinks = []
+        _local.sinks.append(self.sink)
+        return self.sink
+
+    def __exit__(self, *args):
+        _local.sinks.remove(self.sink)
+        return False
+
+
+class HistogramSink(object):
+    """
+    Sink keeping all the durations and summing the counts of every stage in
+    memory.
+    """
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration, counts):
+        with self._lock:
+            self.durations.setdefault(stage, []).append(duration)
+            stage_counts = self.counts.setdefault(stage, {})
+            for key, value in counts.items():
+                stage_counts[key] = stage_counts.get(key, 0) + value
+
+    def percentile(self, stage, p):
+        """
+        Nearest-rank percentile of the durations of a stage.
+        """
+        durations = sorted(self.durations.get(stage, []))
+        if not durations:
+            return None
+        index = min(len(durations) - 1,
+                    max(0, int(round(p / 100 * len(durations))) - 1))
+        return durations[index]
+
+    def summary(self):
+        """
+        Get a summary of all the stages.
+
+        :returns: A dict of stages and dicts with their number of ``runs``, \
+                ``total`` duration, ``p50``, ``p95``, ``p99`` durations and \
+                summed ``counts``.
+        """
+        with self._lock:
+            stages = list(self.durations)
+        return {
+            stage: {
+                "runs": len(self.durations[stage]),
+                "total": sum(self.durations[stage]),
+                "p50": self.percentile(stage, 50),
+                "p95": self.percentile(stage, 95),
+                "p99": self.percentile(stage, 99),
+                "counts": dict(self.counts[stage]),
+            }
+            for stage in stages
+        }
+
+    def format(self):
+        """
+        Format the total duration and counts of every stage on a single line.
+        """
+        parts = []
+        for stage, summary in self.summary().items():
+            counts = ", ".join("%s=%s" % (key, value)
+                               for key, value in sorted(
+                                   summary["counts"].items()))
+            parts.append("%s %.3fs%s" % (stage, summary["total"],
+                                         " (%s)" % (counts,) if counts else ""))
+        return "; ".join(parts)
+
+
+class LogSink(object):
+    """
+    Sink writing a log line per record.
+
+    :param log: A function taking a string, e.g. ``logger.info`` (defaults \
+            to ``print``).
+    """
+    def __init__(self, log=print):
+        self.log = log
+
+    def record(self, stage, duration, counts):
+        self.log("%s %.3fs %s" % (
+            stage, duration,
+            " ".join("%s=%s" % (key, value)
+                     for key, value in sorted(counts.items()))))
+
+
+class CallbackSink(object):
+    """
+    Sink calling a function with ``(stage, duration, counts)`` for every
+    record.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, stage, duration, counts):
+        self.callback(stage, duration, counts)
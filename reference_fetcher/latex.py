@@ -0,0 +1,119 @@
+"""
+This file contains a pure-Python LaTeX to plaintext converter, used as a
+faster alternative to ``opendetex/delatex`` for cleaning bibitems.
+"""
+import unicodedata
+
+from . import regex
+
+
+# Combining characters of the LaTeX accents
+ACCENTS = {
+    "'": "\u0301",
+    "`": "\u0300",
+    "^": "\u0302",
+    '"': "\u0308",
+    "~": "\u0303",
+    "=": "\u0304",
+    ".": "\u0307",
+    "v": "\u030c",
+    "u": "\u0306",
+    "H": "\u030b",
+    "c": "\u0327",
+    "k": "\u0328",
+    "r": "\u030a",
+    "d": "\u0323",
+    "b": "\u0331",
+}
+# Letters macros
+LETTERS = {
+    "ss": "ß", "ae": "æ", "AE": "Æ", "oe": "œ", "OE": "Œ", "aa": "å",
+    "AA": "Å", "o": "ø", "O": "Ø", "l": "ł", "L": "Ł", "i": "i", "j": "j",
+}
+# Symbols macros of bibliography styles
+SYMBOLS = {
+    "cprime": "'",
+    "bibrangedash": "-",
+}
+
+
+def _replace_token(match):
+    """
+    Plaintext replacement for a single token matched by ``regex.latex_tokens``.
+    """
+    if match.group("verbatim") is not None:
+        return " %s " % (match.group("verbatim"),)
+    elif match.group("escaped") is not None:
+        return match.group("escaped")
+    elif match.group("dash") is not None:
+        return "-"
+    # Comments and math are dropped, control sequences, braces and ties are
+    # replaced by a space, as ``delatex -s`` does.
+    return " "
+
+
+def _replace_accent(match):
+    """
+    Composed letter for an accent matched by ``regex.latex_accents``.
+    """
+    letter = match.group("braced") or match.group("bare")
+    letter = letter.lstrip("\\")
+    return unicodedata.normalize("NFC",
+                                 letter + ACCENTS[match.group("accent")])
+
+
+def _replace_word_group(match):
+    """
+    Content of a group matched by ``regex.latex_word_groups``.
+    """
+    if match.group("command") is not None:
+        return match.group("command")
+    if match.group("before") is not None:
+        return match.group("before")
+    return match.group("after")
+
+
+def simplify(text):
+    """
+    Rewrite the LaTeX constructs which would otherwise split words apart or
+    leave markup in the plaintext, before any of the converters: accents are
+    composed with their letter (``Marto\\v{n}\\'{a}k`` is ``Martoňák``),
+    letters and symbols macros (``\\o``, ``\\ss``, ``\\cprime``,
+    ``\\bibrangedash``…) are replaced by their character, groups glued to a
+    word (``{I}sing``, ``{K}{\\"o}rper``) are unwrapped and the keys of
+    ``\\bibinfo{key}{value}`` are dropped.
+
+    :param text: The LaTeX text to rewrite.
+    :returns: The rewritten LaTeX text.
+    """
+    text = regex.latex_bibinfo_keys.sub(" ", text)
+    text = regex.latex_accents.sub(_replace_accent, text)
+    text = regex.latex_letters.sub(
+        lambda match: LETTERS[match.group("letter")], text)
+    text = regex.latex_symbols.sub(
+        lambda match: SYMBOLS[match.group("symbol")], text)
+    # Unwrapping a group may glue the group next to it to a word
+    while True:
+        simplified = regex.latex_word_groups.sub(_replace_word_group, text)
+        if simplified == text:
+            return text
+        text = simplified
+
+
+def to_plaintext(text):
+    """
+    Convert a LaTeX snippet (typically a bibitem) to plaintext.
+
+    It mimics ``delatex -s`` on the macros found in ``.bbl`` files: control
+    sequences (``\\newblock``, ``\\emph``, ``\\em``, ``\\bibinfo``…)
+    and braces are replaced by a space and their arguments are kept, ``~`` is
+    a space, ``--`` and ``---`` are a single dash, math and comments are
+    dropped and the arguments of ``\\url`` and ``\\doi`` are kept verbatim.
+
+    As with ``delatex``, accents and groups glued to words split them apart,
+    unless the text went through ``simplify`` first.
+
+    :param text: The LaTeX text to convert.
+    :returns: The plaintext representation, whitespaces are not cleaned.
+    """
+    return regex.latex_tokens.sub(_replace_token, text)
@@ -4,8 +4,19 @@ This file contains all the regex used across the app.
 import re
 
 urls = re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+")
-bibitems = re.compile(r"\\bibitem\{.+?\}")
-endthebibliography = re.compile(r"\\end\{thebibliography}")
+# Boundaries of the items of a .bbl file, see ``bbl.iter_bibitems``
+bbl_markers = re.compile(
+    r"\\(?:bibitem|entry|endentry)(?![a-zA-Z@])|\\end\{thebibliography\}")
+# Whitespaces and comments between the arguments of a LaTeX command
+latex_blank = re.compile(r"(?:\s|%[^\n]*)*")
+# Fields, names and lists of biblatex .bbl entries
+biblatex_fields = re.compile(r"\\(field|name|list)\s*\{([^{}]*)\}")
+biblatex_verbs = re.compile(r"\\verb\{([^{}]*)\}\s*\\verb (.*?)\s*\\endverb",
+                            re.DOTALL)
+biblatex_name_parts = re.compile(r"(?<![a-zA-Z])(family|given|prefix|suffix)=")
+# First line of a .bbl file, see ``arxiv.bbl_from_single_file``
+bbl_head = re.compile(
+    r"\s*(?:\\begin\{thebibliography\}|% \$ biblatex auxiliary file \$)")
 
 doi = re.compile('(?<=doi)/?:?\s?[0-9\.]{7}/\S*[0-9]', re.IGNORECASE)
 doi_pnas = re.compile('(?<=doi).?10.1073/pnas\.\d+', re.IGNORECASE)
@@ -14,4 +25,51 @@ clean_doi = re.compile('^/')
 clean_doi_fabse = re.compile('^10.1096')
 clean_doi_jcb = re.compile('^10.1083')
 clean_doi_len = re.compile(r'\d\.\d')
+arxiv_version = re.compile(r'v\d+$')
 arXiv = re.compile(r'arXiv:\s*([\w\.\/\-]+)', re.IGNORECASE)
+# DOI and arXiv id candidates of a lowercased citation, the patterns above in
+# decreasing order of priority behind their literal prefix, the only part
+# consumed, see ``doi.scan_doi_or_arxiv``
+identifiers = re.compile(r"""
+    doi(?=(?P<doi>/?:?\s?[0-9\.]{7}/\S*[0-9])
+          | (?P<doi_pnas>.?10.1073pnas\.\d+))  # Before "pnas" -> "/pnas"
+    | 10(?=(?P<doi_jsb>\.1083/jcb\.\d{9}))       # Without its "10" prefix
+    | arxiv(?=:\s*(?P<arXiv>[\w\.\/\-]+))
+""", re.VERBOSE)
+year = re.compile(r'\b(?:1[89]|20)\d{2}\b')
+# Tokens of the normalized texts of the identifier index, see ``index.py``
+index_tokens = re.compile(r'[a-z0-9]+')
+
+# Tokens of the pure-Python LaTeX to plaintext converter, see ``latex.py``
+latex_tokens = re.compile(r"""
+    \\(?:url|doi|path)\s*\{(?P<verbatim>[^{}]*)\}  # Verbatim arguments
+    | \\(?P<escaped>[&%$\#_{}])                    # Escaped special chars
+    | (?P<comment>%[^\n]*)                         # Comments
+    | (?P<math>\$\$?[^$]*\$\$?)                    # Inline or display math
+    | (?P<word>\\[a-zA-Z@]+\*?)                    # Control words
+    | (?P<symbol>\\.)                              # Control symbols
+    | (?P<tie>~)                                   # Unbreakable spaces
+    | (?P<dash>-{2,3})                             # En and em dashes
+    | (?P<brace>[{}])                              # Groups
+""", re.VERBOSE | re.DOTALL)
+# Accented letters, e.g. \'e, \'{e}, \v{n} or \"{\i}, see ``latex.py``
+latex_accents = re.compile(r"""
+    \\(?P<accent>['`^"~=.]|[vuHckrdb](?![a-zA-Z]))\s*
+    (?:\{\s*(?P<braced>\\[ij](?![a-zA-Z])|[a-zA-Z])\s*\}
+     |(?P<bare>\\[ij](?![a-zA-Z])|[a-zA-Z]))
+""", re.VERBOSE)
+# Letters macros, e.g. \o, \ss or \AA, and the spaces they swallow
+latex_letters = re.compile(
+    r"\\(?P<letter>ss|ae|AE|oe|OE|aa|AA|o|O|l|L|i|j)(?![a-zA-Z])(?:\{\}|\s*)")
+# Symbols macros, e.g. \cprime or \bibrangedash, and the spaces they swallow
+latex_symbols = re.compile(
+    r"\\(?P<symbol>cprime|bibrangedash)(?![a-zA-Z])(?:\{\}|\s*)")
+# Keys of the \bibinfo{key}{value} and \bibfield{key}{value} macros
+latex_bibinfo_keys = re.compile(r"\\bib(?:info|field)\s*\{[^{}]*\}")
+# Groups of plain text glued to a letter, e.g. {I}sing or Gr{\"u}n, control
+# sequences and their arguments being left untouched
+latex_word_groups = re.compile(r"""
+    (?P<command>\\(?:[a-zA-Z@]+\*?(?:\s*\{[^{}]*\})*|.))
+    | (?<=[^\W\d_])\{(?P<before>[^{}\\$%]*)\}
+    | \{(?P<after>[^{}\\$%]*)\}(?=[^\W\d_])
+""", re.VERBOSE | re.DOTALL)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+# Local import
+import config
+import database
+from routes import post
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Queue the papers with a new arXiv version, to update "
+                     "their citations."))
+    parser.parse_args()
+
+    engine = database.get_engine(config.database_url,
+                                 echo=config.database_echo,
+                                 sqlite_pragmas=config.sqlite_pragmas,
+                                 pool=config.database_pool)
+    database.Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    queued = post.queue_new_versions(sessionmaker(bind=engine))
+    print("Queued %d papers with a new arXiv version in %.1fs." % (
+        queued, time.perf_counter() - start))
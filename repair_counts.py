@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+# Local import
+import config
+import counts
+import database
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=("Recompute the numbers of relationships of the papers "
+                     "from the relationships."))
+    parser.parse_args()
+
+    engine = database.get_engine(config.database_url,
+                                 echo=config.database_echo,
+                                 sqlite_pragmas=config.sqlite_pragmas,
+                                 pool=config.database_pool)
+    database.Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        rows = counts.recompute(connection)
+    print("Recomputed the counts of %d (paper, relationship) in %.1fs." % (
+        rows, time.perf_counter() - start))
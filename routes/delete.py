@@ -3,8 +3,11 @@ This file contains DELETE routes methods.
 """
 import bottle
 
+import counts
 import database
+import graph
 import json
+import similarity_refresh
 import tools
 
 
@@ -28,7 +31,10 @@ def delete_paper(id, db):
     """
     resource = db.query(database.Paper).filter_by(id=id).first()
     if resource:
+        counts.remove_paper(db, id)
+        similarity_refresh.remove_paper(db, id)
         db.delete(resource)
+        graph.record_deleted_papers(db, [id])
         return tools.APIResponse(status=204, body="")
     return bottle.HTTPError(404, "Not found")
 
@@ -88,13 +94,21 @@ def delete_relationship(id, name, db):
             db.flush()
         else:
             relationship = (db.query(database.RelationshipAssociation)
-                            .filter_by(left_id=id, right_id=i["id"])
+                            .join(database.Relationship)
                             .filter(database.Relationship.name == name)
+                            .filter(database.RelationshipAssociation
+                                    .left_id == id)
+                            .filter(database.RelationshipAssociation
+                                    .right_id == i["id"])
                             .first())
             if relationship is None:
                 # An error occurred => 403
                 return bottle.HTTPError(403, "Forbidden")
             db.delete(relationship)
+            edge = (id, relationship.right_id)
+            counts.update(db, relationship.relationship_id, [edge], -1)
+            graph.record_removed(db, name, [edge])
+            similarity_refresh.mark_changed(db, name, [edge])
     # Return an empty 204 on success
     return tools.APIResponse(status=204, body="")
 
@@ -2,11 +2,23 @@
 This file contains GET routes methods.
 """
 import bottle
+import collections
+import re
+from sqlalchemy import and_, func
+from sqlalchemy.orm import aliased, selectinload
 
+import config
 import database
+import graph
 import tools
 
 
+# GET parameters on the counts of relationships of the papers, e.g. cite.in,
+# cite.out.min or cite.in.max
+COUNT_PARAM = re.compile(
+    r"^(?P<name>[^.]+)\.(?P<direction>in|out)(?:\.(?P<bound>min|max))?$")
+
+
 def fetch_papers(db):
     """
     Fetch all matching papers.
@@ -18,7 +30,15 @@ def fetch_papers(db):
 
 
     Filtering is possible using ``id=ID``, ``doi=DOI``, ``arxiv_id=ARXIV_ID`` \
-    or any combination of these GET parameters. Other parameters are ignored.
+    or any combination of these GET parameters. Papers can also be filtered \
+    on their number of relationships, e.g. ``cite.in=N`` (cited by ``N`` \
+    papers), ``cite.in.min=N``, ``cite.out.max=N``.
+
+    Papers are sorted with ``sort=FIELD[,FIELD…]``, a field being ``id``, \
+    ``doi``, ``arxiv_id``, ``rank`` (the PageRank computed by \
+    ``compute_ranks.py``) or a number of relationships (e.g. ``cite.in``), \
+    prefixed with ``-`` for a descending order, and can be limited with \
+    ``limit=N``. Other parameters are ignored.
 
 
     .. code-block:: json
@@ -42,6 +62,13 @@ def fetch_papers(db):
                             }
                         },
                         …
+                    },
+                    "meta": {
+                        "rank": 1.2e-05,
+                        "counts": {
+                            "cite": {"in": 12, "out": 35},
+                            …
+                        }
                     }
                 }
             ]
@@ -53,7 +80,14 @@ def fetch_papers(db):
     filters = {k: bottle.request.params[k]
                for k in bottle.request.params
                if k in ["id", "doi", "arxiv_id"]}
-    resources = db.query(database.Paper).filter_by(**filters).all()
+    query = (db.query(database.Paper)
+             .filter_by(**filters)
+             .options(selectinload(database.Paper.counts),
+                      selectinload(database.Paper.rank)))
+    query = _filter_and_sort_papers(query, db)
+    if query is None:
+        return bottle.HTTPError(403, "Forbidden")
+    resources = query.all()
     if resources:
         return tools.APIResponse(tools.pretty_json({
             "data": [resource.json_api_repr(db) for resource in resources]
@@ -61,6 +95,90 @@ def fetch_papers(db):
     return bottle.HTTPError(404, "Not found")
 
 
+def _filter_and_sort_papers(query, db):
+    """
+    Filter, sort and limit a query of papers with the GET parameters of
+    ``fetch_papers``.
+
+    :param query: A query of ``Paper``.
+    :param db: A database session.
+    :returns: The query, or ``None`` if the parameters are invalid.
+    """
+    # Dict of relationships names and their ids
+    relationships = {}
+    # Dict of relationships names and their joined RelationshipCount
+    joined = collections.OrderedDict()
+
+    def count(name, direction):
+        # Count of relationships of the papers, 0 if there is no row
+        if name not in relationships:
+            relationships[name] = database.relationship_registry.id(name,
+                                                                    db)
+        if relationships[name] is None:
+            return None
+        if name not in joined:
+            joined[name] = aliased(database.RelationshipCount)
+        return func.coalesce(
+            getattr(joined[name], "%s_count" % (direction,)), 0)
+
+    criteria = []
+    for k in bottle.request.params:
+        match = COUNT_PARAM.match(k)
+        if match is None:
+            continue
+        column = count(match.group("name"), match.group("direction"))
+        try:
+            value = int(bottle.request.params[k])
+        except ValueError:
+            return None
+        if column is None:
+            return None
+        if match.group("bound") == "min":
+            criteria.append(column >= value)
+        elif match.group("bound") == "max":
+            criteria.append(column <= value)
+        else:
+            criteria.append(column == value)
+    order = []
+    # Joined PaperRank, if sorted by rank
+    rank = None
+    for field in bottle.request.params.get("sort", "").split(","):
+        if not field:
+            continue
+        descending = field.startswith("-")
+        field = field.lstrip("-")
+        if field in ["id", "doi", "arxiv_id"]:
+            column = getattr(database.Paper, field)
+        elif field == "rank":
+            if rank is None:
+                rank = aliased(database.PaperRank)
+            column = func.coalesce(rank.score, 0)
+        else:
+            match = COUNT_PARAM.match(field)
+            if match is None or match.group("bound") is not None:
+                return None
+            column = count(match.group("name"), match.group("direction"))
+            if column is None:
+                return None
+        order.append(column.desc() if descending else column.asc())
+    for name, alias in joined.items():
+        query = query.outerjoin(
+            alias, and_(alias.paper_id == database.Paper.id,
+                        alias.relationship_id == relationships[name]))
+    if rank is not None:
+        query = query.outerjoin(rank,
+                                rank.paper_id == database.Paper.id)
+    # Papers with equal sort keys are sorted by id
+    query = query.filter(*criteria).order_by(*order).order_by(
+        database.Paper.id)
+    if "limit" in bottle.request.params:
+        try:
+            query = query.limit(int(bottle.request.params["limit"]))
+        except ValueError:
+            return None
+    return query
+
+
 def fetch_papers_by_id(id, db):
     """
     Fetch a paper identified by its internal id.
@@ -160,17 +278,296 @@ def fetch_relationship(id, name, db):
                     "id": t.id
                 })
         else:
-            if reversed:
-                relationships = resource.related_by
-            else:
-                relationships = resource.related_to
-            for r in relationships:
-                if r.relationship.name == name:
-                    response["data"].append({"type": name, "id": r.right_id})
+            relationship = (db.query(database.Relationship)
+                            .filter_by(name=name)
+                            .first())
+            if relationship is not None:
+                # Use the indexes on (left_id | right_id, relationship_id)
+                if reversed:
+                    ids = (db.query(database.RelationshipAssociation.left_id)
+                           .filter_by(right_id=id,
+                                      relationship_id=relationship.id))
+                else:
+                    ids = (db.query(database.RelationshipAssociation.right_id)
+                           .filter_by(left_id=id,
+                                      relationship_id=relationship.id))
+                for related_id, in ids:
+                    response["data"].append({"type": name,
+                                             "id": related_id})
         return tools.APIResponse(tools.pretty_json(response))
     return bottle.HTTPError(404, "Not found")
 
 
+def _get_graph_params(default_depth):
+    """
+    Get the ``depth`` and ``reverse`` GET parameters of the graph routes.
+
+    :param default_depth: Depth if the parameter is not given.
+    :returns: A tuple ``(depth, reverse)``, or ``None`` if the parameters \
+            are invalid or the depth is over ``config.graph_max_depth``.
+    """
+    try:
+        depth = int(bottle.request.params.get("depth", default_depth))
+    except ValueError:
+        return None
+    if depth < 1 or depth > config.graph_max_depth:
+        return None
+    reverse = bottle.request.params.get("reverse", "0") not in ["", "0"]
+    return (depth, reverse)
+
+
+def fetch_graph(id, db):
+    """
+    Fetch the links to the graph traversals from a paper.
+
+    .. code-block:: bash
+
+        GET /papers/1/graph
+        Accept: application/vnd.api+json
+
+
+    .. code-block:: json
+
+        {
+            "links": {
+                "self": "/papers/1/graph"
+            },
+            "relationships": {
+                "cite": {
+                    "links": {
+                        "neighbours": "/papers/1/graph/cite?depth={depth}&reverse={reverse}",
+                        "transitive": "/papers/1/graph/cite/transitive?reverse={reverse}",
+                        "path": "/papers/1/graph/cite/path/{id}?reverse={reverse}"
+                    }
+                },
+                …
+            }
+        }
+
+    :param id: The id of the requested paper.
+    :param db: A database session, injected by the ``Bottle`` plugin.
+    :returns: An ``HTTPResponse``.
+    """
+    resource = db.query(database.Paper).filter_by(id=id).first()
+    if resource is None:
+        return bottle.HTTPError(404, "Not found")
+    base = "/papers/%d/graph" % (id,)
+    return tools.APIResponse(tools.pretty_json({
+        "links": {
+            "self": base
+        },
+        "relationships": {
+            name: {
+                "links": {
+                    "neighbours": (
+                        "%s/%s?depth={depth}&reverse={reverse}" %
+                        (base, name)),
+                    "transitive": (
+                        "%s/%s/transitive?reverse={reverse}" % (base, name)),
+                    "path": (
+                        "%s/%s/path/{id}?reverse={reverse}" % (base, name))
+                }
+            }
+            for name in database.relationship_registry.names(db)
+        }
+    }))
+
+
+def fetch_graph_neighbours(id, name, db, default_depth=1):
+    """
+    Fetch the papers reachable from a paper in at most ``depth`` steps of a
+    relationship, by increasing depth. The response is streamed.
+
+    .. code-block:: bash
+
+        GET /papers/1/graph/cite?depth=2
+        Accept: application/vnd.api+json
+
+
+    .. code-block:: json
+
+        {
+            "links": {
+                "self": "/papers/1/graph/cite?depth=2&reverse=0"
+            },
+            "data": [
+                {"id": 2, "meta": {"depth": 1}, "type": "papers"},
+                {"id": 5, "meta": {"depth": 2}, "type": "papers"},
+                …
+            ]
+        }
+
+    ``depth`` defaults to 1 and is at most ``graph_max_depth`` (see \
+    ``config.py``). Using ``?reverse=1``, the relationship is followed \
+    backwards (e.g. the papers citing the paper for ``cite``).
+
+    :param id: The id of the requested paper.
+    :param name: The name of the relationship.
+    :param db: A database session, injected by the ``Bottle`` plugin.
+    :param default_depth: Depth if not given in the GET parameters.
+    :returns: An ``HTTPResponse``.
+    """
+    params = _get_graph_params(default_depth)
+    if params is None:
+        return bottle.HTTPError(403, "Forbidden")
+    depth, reverse = params
+    resource = db.query(database.Paper).filter_by(id=id).first()
+    if resource is None or not graph.citation_graph.load(name, db.get_bind()):
+        return bottle.HTTPError(404, "Not found")
+    data = (
+        {"type": "papers", "id": related_id, "meta": {"depth": distance}}
+        for related_id, distance in graph.citation_graph.traverse(
+            name, id, depth, reverse=reverse)
+    )
+    return tools.APIResponse(tools.stream_json({
+        "links": {
+            "self": "/papers/%d/graph/%s?depth=%d&reverse=%d" % (
+                id, name, depth, reverse)
+        }
+    }, "data", data))
+
+
+def fetch_graph_transitive(id, name, db):
+    """
+    Fetch the papers transitively reachable from a paper with a
+    relationship (e.g. all the papers it cites, directly or not, for
+    ``cite``), up to ``graph_max_depth`` steps. The response is streamed.
+
+    .. code-block:: bash
+
+        GET /papers/1/graph/cite/transitive
+        Accept: application/vnd.api+json
+
+    See ``fetch_graph_neighbours`` for the response and parameters.
+
+    :param id: The id of the requested paper.
+    :param name: The name of the relationship.
+    :param db: A database session, injected by the ``Bottle`` plugin.
+    :returns: An ``HTTPResponse``.
+    """
+    return fetch_graph_neighbours(id, name, db,
+                                  default_depth=config.graph_max_depth)
+
+
+def fetch_graph_path(id, name, target, db):
+    """
+    Fetch a shortest path of a relationship between two papers.
+
+    .. code-block:: bash
+
+        GET /papers/1/graph/cite/path/5
+        Accept: application/vnd.api+json
+
+
+    .. code-block:: json
+
+        {
+            "links": {
+                "self": "/papers/1/graph/cite/path/5?reverse=0"
+            },
+            "data": [
+                {"id": 1, "type": "papers"},
+                {"id": 2, "type": "papers"},
+                {"id": 5, "type": "papers"}
+            ]
+        }
+
+    The path is at most ``graph_max_depth`` long (see ``config.py``), and can
+    be shortened with ``?depth=DEPTH``. Using ``?reverse=1``, the
+    relationship is followed backwards.
+
+    :param id: The id of the paper to start from.
+    :param name: The name of the relationship.
+    :param target: The id of the paper to reach.
+    :param db: A database session, injected by the ``Bottle`` plugin.
+    :returns: An ``HTTPResponse``.
+    """
+    params = _get_graph_params(config.graph_max_depth)
+    if params is None:
+        return bottle.HTTPError(403, "Forbidden")
+    depth, reverse = params
+    if (db.query(database.Paper)
+            .filter(database.Paper.id.in_([id, target]))
+            .count() < len(set([id, target])) or
+            not graph.citation_graph.load(name, db.get_bind())):
+        return bottle.HTTPError(404, "Not found")
+    path = graph.citation_graph.shortest_path(name, id, target, depth,
+                                              reverse=reverse)
+    if path is None:
+        return bottle.HTTPError(404, "Not found")
+    return tools.APIResponse(tools.pretty_json({
+        "links": {
+            "self": "/papers/%d/graph/%s/path/%d?reverse=%d" % (
+                id, name, target, reverse)
+        },
+        "data": [{"type": "papers", "id": i} for i in path]
+    }))
+
+
+def fetch_similar(id, db):
+    """
+    Fetch the most similar papers of a paper, by co-citation and
+    bibliographic coupling, as precomputed by ``compute_similar.py``.
+
+    .. code-block:: bash
+
+        GET /papers/1/similar
+        Accept: application/vnd.api+json
+
+
+    .. code-block:: json
+
+        {
+            "links": {
+                "self": "/papers/1/similar"
+            },
+            "data": [
+                {
+                    "type": "papers",
+                    "id": 2,
+                    "meta": {
+                        "score": 0.8,
+                        "cocitations": 4,
+                        "couplings": 12
+                    }
+                },
+                …
+            ]
+        }
+
+    Papers are sorted by decreasing score. ``cocitations`` is the number of
+    papers citing both papers and ``couplings`` the number of papers cited
+    by both papers.
+
+    :param id: The id of the requested paper.
+    :param db: A database session, injected by the ``Bottle`` plugin.
+    :returns: An ``HTTPResponse``.
+    """
+    if db.query(database.Paper.id).filter_by(id=id).first() is None:
+        return bottle.HTTPError(404, "Not found")
+    # Use the primary key on (paper_id, position)
+    similar = (db.query(database.SimilarPaper)
+               .filter_by(paper_id=id)
+               .order_by(database.SimilarPaper.position))
+    return tools.APIResponse(tools.pretty_json({
+        "links": {
+            "self": "/papers/%d/similar" % (id,)
+        },
+        "data": [
+            {
+                "type": "papers",
+                "id": i.similar_id,
+                "meta": {
+                    "score": i.score,
+                    "cocitations": i.cocitations,
+                    "couplings": i.couplings
+                }
+            }
+            for i in similar
+        ]
+    }))
+
+
 def fetch_tags(db):
     """
     Fetch all matching tags.
@@ -3,13 +3,61 @@ This file contains POST routes methods.
 """
 import bottle
 import json
+import os
 import threading
+import traceback
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 
 import config
+import counts
 import database
+import graph
+import similarity_refresh
 import tools
 from reference_fetcher import arxiv
+from reference_fetcher import cache
+from reference_fetcher import doi as doi_tools
+from reference_fetcher import index
+from reference_fetcher import instrumentation
+from reference_fetcher import regex
+
+
+# Maximum number of values in the IN clauses of bulk queries
+IN_QUERY_CHUNK_SIZE = 500
+
+# Ids of the papers whose references are being fetched by ``create_paper``,
+# skipped by the queue worker meanwhile
+processing_papers = set()
+processing_papers_lock = threading.Lock()
+
+# Shared caches, opened by ``init_caches``
+resolution_cache = None
+sources_cache = None
+oa_cache = None
+identifier_index = None
+
+
+def init_caches():
+    """
+    Open the caches configured in ``config``, once at startup.
+    """
+    global resolution_cache, sources_cache, oa_cache, identifier_index
+    if config.resolution_cache is not None:
+        resolution_cache = cache.ResolutionCache(
+            config.resolution_cache,
+            max_entries=config.resolution_cache_max_entries)
+    if config.sources_cache is not None:
+        sources_cache = cache.SourcesCache(
+            config.sources_cache,
+            max_size=config.sources_cache_max_size,
+            offline=config.sources_cache_offline)
+    if config.oa_cache is not None:
+        oa_cache = cache.OAVersionCache(config.oa_cache)
+    if (config.identifier_index is not None and
+            os.path.isfile(config.identifier_index)):
+        identifier_index = index.IdentifierIndex(config.identifier_index)
 
 
 def create_paper(db):
@@ -80,27 +128,73 @@ def create_paper(db):
     response = {
         "data": paper.json_api_repr(db)
     }
-    # Import "cite" relation
-    add_cite_relationship(paper, db)
+    paper_id = paper.id
+    with processing_papers_lock:
+        processing_papers.add(paper_id)
+    try:
+        # Commit the paper first, not to hold the database write lock while
+        # fetching its references. It is queued in the same transaction, so
+        # that the queue worker fetches them if this fails.
+        _insert_or_ignore(database.CitationProcessingQueue.__table__,
+                          [{"paper_id": paper_id}],
+                          db)
+        db.commit()
+        try:
+            # Import "cite" relation
+            add_cite_relationship(paper, db)
+            (db.query(database.CitationProcessingQueue)
+             .filter_by(paper_id=paper_id)
+             .delete())
+            db.commit()
+        except Exception:
+            traceback.print_exc()
+            print("Failed to process citation relationships for %s, "
+                  "leaving it in the queue." % (paper,))
+            db.rollback()
+    finally:
+        with processing_papers_lock:
+            processing_papers.discard(paper_id)
     # Return 200 with the correct body
-    headers = {"Location": "/papers/%d" % (paper.id,)}
+    headers = {"Location": "/papers/%d" % (paper_id,)}
     return tools.APIResponse(status=200,
                              body=tools.pretty_json(response),
                              headers=headers)
 
 
-def create_by_doi(doi, db):
+def create_by_doi(doi, db, known_arxiv_ids=None):
     """
     Create a new resource identified by its DOI, if it does not exist.
 
-    :param doi: The DOI of the paper.
+    A paper imported from a metadata dump with this DOI is returned as is,
+    without querying arXiv API.
+
+    :param doi: The DOI of the paper, stored lowercased.
     :param db: A database session.
+    :param known_arxiv_ids: An optional dict of lowercased DOIs and their \
+            already fetched arXiv id (or ``None``), to avoid querying arXiv \
+            API.
     :returns: ``None`` if insertion failed, the ``Paper`` object otherwise.
     """
+    # DOIs are case insensitive, the references pipeline and the imported
+    # papers give them lowercased
+    doi = doi.lower()
+    # Papers imported from a metadata dump already have both identifiers
+    paper = db.query(database.Paper).filter_by(doi=doi).first()
+    if paper is not None:
+        if not paper.imported:
+            # Paper already exists
+            return None
+        paper.imported = False
+        db.flush()
+        return paper
+
     paper = database.Paper(doi=doi)
 
     # Try to fetch an arXiv id
-    arxiv_id = arxiv.get_arxiv_eprint_from_doi(doi)
+    if known_arxiv_ids is not None and doi in known_arxiv_ids:
+        arxiv_id = known_arxiv_ids[doi]
+    else:
+        arxiv_id = arxiv.get_arxiv_eprint_from_doi(doi)
     if arxiv_id:
         paper.arxiv_id = arxiv_id
 
@@ -117,21 +211,39 @@ def create_by_doi(doi, db):
     return paper
 
 
-def create_by_arxiv(arxiv_id, db):
+def create_by_arxiv(arxiv_id, db, known_dois=None):
     """
     Create a new resource identified by its arXiv eprint ID, if it does not
     exist.
 
+    A paper imported from a metadata dump with this arXiv eprint ID is
+    returned as is, without querying arXiv API.
+
     :param arxiv_id: The arXiv eprint ID.
     :param db: A database session.
+    :param known_dois: An optional dict of arXiv eprint IDs and their already \
+            fetched DOI (or ``None``), to avoid querying arXiv API.
     :returns: ``None`` if insertion failed, the ``Paper`` object otherwise.
     """
+    # Papers imported from a metadata dump already have both identifiers
+    paper = db.query(database.Paper).filter_by(arxiv_id=arxiv_id).first()
+    if paper is not None:
+        if not paper.imported:
+            # Paper already exists
+            return None
+        paper.imported = False
+        db.flush()
+        return paper
+
     paper = database.Paper(arxiv_id=arxiv_id)
 
-    # Try to fetch an arXiv id
-    doi = arxiv.get_doi(arxiv_id)
+    # Try to fetch a DOI
+    if known_dois is not None and arxiv_id in known_dois:
+        doi = known_dois[arxiv_id]
+    else:
+        doi = arxiv.get_doi(arxiv_id)
     if doi:
-        paper.doi = doi
+        paper.doi = doi.lower()
 
     # Add it to the database
     try:
@@ -151,47 +263,353 @@ def add_cite_relationship(paper, db):
     Add the "cite" relationships between the provided paper and the papers
     referenced by it.
 
+    The citations extracted from the last processed arXiv version of the
+    paper are kept. For a new version (queued by ``queue_new_versions``),
+    only the new citations are resolved, and only the changes in cited
+    papers are applied to the relationships.
+    The latest version is only looked up on arXiv API for the papers already
+    extracted: the first extraction gets the sources of the latest version
+    with the unversioned id.
+
+    Papers whose sources are not in the local sources store, in offline
+    mode, are skipped.
+
     :param paper: The paper to fetch references from.
     :param db: A database session
     :returns: Nothing.
     """
-    # If paper is on arXiv
-    if paper.arxiv_id is not None:
-        # Get the cited DOIs
-        cited_urls = arxiv.get_cited_dois(paper.arxiv_id)
-        # Filter out the ones that were not matched
-        cited_urls = [cited_urls[k]
-                      for k in cited_urls if cited_urls[k] is not None]
-        for url in cited_urls:
-            type, identifier = tools.get_identifier_from_url(url)
-            if type is None:
-                # No identifier found
-                continue
-            # Get the associated paper in the db
-            right_paper = (db.query(database.Paper)
-                           .filter(getattr(database.Paper, type) == identifier)
-                           .first())
-            if right_paper is None:
-                # If paper is not in db, add it
-                if type == "doi":
-                    right_paper = create_by_doi(identifier, db)
-                elif type == "arxiv_id":
-                    right_paper = create_by_arxiv(identifier, db)
-                else:
-                    continue
-                # Push this paper on the queue for update of cite relationships
-                queue = database.CitationProcessingQueue()
-                queue.paper = right_paper
-                try:
-                    db.add(queue)
-                except IntegrityError:
-                    # Unique constraint violation, relationship already exists
-                    db.rollback()
-            # Update the relationships
-            update_relationship_backend(paper.id, right_paper.id, "cite", db)
     # If paper is not on arXiv, nothing to do
+    if paper.arxiv_id is None:
+        return
+    # Stored arXiv ids may be versioned (e.g. from
+    # arxiv.get_arxiv_eprint_from_doi), always look for the latest version
+    eprint = regex.arxiv_version.sub("", paper.arxiv_id)
+    if paper.extracted_version is not None:
+        eprint = arxiv.get_latest_version(eprint) or paper.arxiv_id
+        if paper.extracted_version == eprint:
+            # Nothing changed since last extraction
+            return
+    previous = (db.query(database.ExtractedCitation)
+                .filter_by(paper_id=paper.id)
+                .all())
+    # Get the cited DOIs, reusing the resolutions of the previous version
+    try:
+        resolutions = arxiv.get_cited_resolutions(
+            eprint,
+            cache=resolution_cache,
+            sources_cache=sources_cache,
+            known={i.raw_citation: (i.citation, i.url) for i in previous},
+            index=identifier_index)
+    except cache.OfflineMiss:
+        # Sources store in offline mode, nothing can be extracted
+        print("%s is not in the local sources store, skipping it." % (
+            eprint,))
+        return
+    # Filter out the ones that were not matched
+    previous_urls = set(i.url for i in previous if i.url is not None)
+    cited_urls = []
+    for _, _, url, _ in resolutions:
+        if url is not None and url not in cited_urls:
+            cited_urls.append(url)
+    # Only update the relationships which changed. Added ones first, as they
+    # may query arXiv API before writing anything.
+    add_cited_urls(paper,
+                   [url for url in cited_urls if url not in previous_urls],
+                   db)
+    # A paper may still be cited, with another URL (e.g. its DOI instead of
+    # its arXiv id)
+    remove_cited_urls(paper,
+                      [url for url in previous_urls if url not in cited_urls],
+                      db,
+                      kept_urls=cited_urls)
+    # Keep the extracted citations for next version
+    (db.query(database.ExtractedCitation)
+     .filter_by(paper_id=paper.id)
+     .delete())
+    db.add_all([
+        database.ExtractedCitation(paper_id=paper.id,
+                                   raw_citation=raw_citation,
+                                   citation=citation,
+                                   url=url)
+        for raw_citation, citation, url, source in resolutions
+        # Citations whose Crossref query failed are resolved again next time
+        if source is not None
+    ])
+    paper.extracted_version = eprint
+    db.add(paper)
+    db.flush()
+
+
+def _query_in(query, column, values):
+    """
+    Run a query filtered on a column having one of the given values, with
+    ``IN`` clauses of at most ``IN_QUERY_CHUNK_SIZE`` values.
+
+    :param query: A ``SQLAlchemy`` query.
+    :param column: The column to filter on.
+    :param values: A list of values.
+    :returns: A list of the results.
+    """
+    results = []
+    for i in range(0, len(values), IN_QUERY_CHUNK_SIZE):
+        chunk = values[i:i + IN_QUERY_CHUNK_SIZE]
+        results.extend(query.filter(column.in_(chunk)).all())
+    return results
+
+
+def _get_papers(identifiers, db):
+    """
+    Get the papers with any of the given identifiers, with one query per
+    identifier type.
+
+    :param identifiers: A list of tuples ``(type, identifier)``, ``type`` \
+            being ``doi`` or ``arxiv_id``.
+    :param db: A database session.
+    :returns: A dict of ``(type, identifier)`` and their ``Paper``, for all \
+            the identifiers of the found papers.
+    """
+    papers = {}
+    for type in ("doi", "arxiv_id"):
+        column = getattr(database.Paper, type)
+        values = list(set(identifier for i, identifier in identifiers
+                          if i == type))
+        for paper in _query_in(db.query(database.Paper), column, values):
+            if paper.doi is not None:
+                papers[("doi", paper.doi)] = paper
+            if paper.arxiv_id is not None:
+                papers[("arxiv_id", paper.arxiv_id)] = paper
+    return papers
+
+
+def _insert_or_ignore(table, rows, db, returning=None):
+    """
+    Bulk insert rows in a table. On SQLite and PostgreSQL, rows violating a
+    unique constraint (e.g. inserted meanwhile by another request) are
+    skipped.
+
+    :param table: A ``SQLAlchemy`` ``Table``.
+    :param rows: A list of dicts of values, with the same keys.
+    :param db: A database session.
+    :param returning: An optional column of ``table`` to return for the \
+            actually inserted rows.
+    :returns: A list of the values of ``returning`` for the inserted rows, \
+            or ``None`` if not requested or not supported by the database \
+            (``RETURNING`` over many rows needs ``SQLAlchemy`` 2.0, and \
+            SQLite 3.35 or PostgreSQL).
+    """
+    if not rows:
+        return [] if returning is not None else None
+    dialect = db.get_bind().dialect
+    if dialect.name == "sqlite":
+        statement = sqlite_insert(table).on_conflict_do_nothing()
+    elif dialect.name == "postgresql":
+        statement = postgresql_insert(table).on_conflict_do_nothing()
     else:
+        statement = table.insert()
+    if (returning is None or
+            not getattr(dialect, "insert_executemany_returning", False)):
+        db.execute(statement, rows)
+        return None
+    return [value for value, in db.execute(statement.returning(returning),
+                                           rows)]
+
+
+def add_cited_urls(paper, cited_urls, db):
+    """
+    Add the "cite" relationships between the provided paper and the papers
+    identified by the given URLs, creating them if needed.
+
+    This runs a constant number of queries, whatever the number of cited
+    papers: they are looked up with one ``IN`` query per identifier type, and
+    the missing papers, their queue entries and the relationships are bulk
+    inserted.
+
+    :param paper: The citing paper.
+    :param cited_urls: A list of DOI or arXiv URLs of the cited papers.
+    :param db: A database session
+    :returns: Nothing.
+    """
+    identifiers = [tools.get_identifier_from_url(url) for url in cited_urls]
+    # Filter out the ones where no identifier was found, and the duplicates
+    identifiers = list(dict.fromkeys(
+        (type, identifier) for type, identifier in identifiers
+        if type is not None))
+    if not identifiers:
+        return
+    # Get the associated papers in the db
+    papers = _get_papers(identifiers, db)
+    missing = [key for key in identifiers if key not in papers]
+    # Fetch the other identifier of the missing papers, in batch
+    known_arxiv_ids = arxiv.get_arxiv_eprint_from_doi_batch(
+        [identifier for type, identifier in missing if type == "doi"])
+    known_dois = arxiv.get_doi_batch(
+        [identifier for type, identifier in missing if type == "arxiv_id"])
+    others = {}
+    for type, identifier in missing:
+        if type == "doi":
+            other = ("arxiv_id", known_arxiv_ids.get(identifier))
+        else:
+            other = ("doi", known_dois.get(identifier))
+            if other[1] is not None:
+                other = ("doi", other[1].lower())
+        if other[1] is not None:
+            others[(type, identifier)] = other
+    # Missing papers may be in the db with their other identifier
+    papers.update(_get_papers(list(others.values()), db))
+    # Rows of the papers to create, by identifier. A paper cited with both
+    # its DOI and its arXiv id has a single row.
+    rows = {}
+    for key in missing:
+        if key in rows:
+            continue
+        other = others.get(key)
+        if other in papers:
+            papers[key] = papers[other]
+        elif other in rows and rows[other][key[0]] is None:
+            rows[other][key[0]] = key[1]
+            rows[key] = rows[other]
+        else:
+            row = {"doi": None, "arxiv_id": None, "imported": False}
+            row[key[0]] = key[1]
+            if other is not None and other not in rows:
+                row[other[0]] = other[1]
+                rows[other] = row
+            rows[key] = row
+    # Fetch the open access versions of all the cited papers at once, before
+    # writing anything not to hold the database write lock meanwhile
+    oa_urls = {}
+    if config.fetch_oa_versions:
+        oa_urls = doi_tools.get_oa_versions(
+            [paper.doi for paper in papers.values()
+             if paper.doi is not None and paper.oa_url is None] +
+            [row["doi"] for row in rows.values() if row["doi"] is not None],
+            cache=oa_cache)
+    _insert_or_ignore(database.Paper.__table__,
+                      list({id(row): row for row in rows.values()}.values()),
+                      db)
+    papers.update(_get_papers(list(rows), db))
+
+    # Skip the papers which could not be inserted
+    right_papers = list({
+        papers[key].id: papers[key] for key in identifiers if key in papers
+    }.values())
+    # Push the new papers (or only imported from a dump) on the queue for
+    # update of cite relationships
+    queued_ids = []
+    for right_paper in right_papers:
+        if right_paper.imported:
+            right_paper.imported = False
+            queued_ids.append(right_paper.id)
+        elif (("doi", right_paper.doi) in rows or
+              ("arxiv_id", right_paper.arxiv_id) in rows):
+            queued_ids.append(right_paper.id)
+    db.flush()
+    _insert_or_ignore(database.CitationProcessingQueue.__table__,
+                      [{"paper_id": id} for id in queued_ids],
+                      db)
+    # Update the relationships
+    relationship = get_or_create_relationship("cite", db)
+    right_ids = [right_paper.id for right_paper in right_papers]
+    existing = set(
+        right_id for right_id, in _query_in(
+            (db.query(database.RelationshipAssociation.right_id)
+             .filter_by(left_id=paper.id, relationship_id=relationship.id)),
+            database.RelationshipAssociation.right_id,
+            right_ids))
+    right_ids = [right_id for right_id in right_ids
+                 if right_id not in existing]
+    inserted = _insert_or_ignore(
+        database.RelationshipAssociation.__table__,
+        [{"left_id": paper.id,
+          "right_id": right_id,
+          "relationship_id": relationship.id}
+         for right_id in right_ids],
+        db,
+        returning=database.RelationshipAssociation.__table__.c.right_id)
+    if inserted is not None:
+        # Only the relationships not added meanwhile by another request
+        right_ids = inserted
+    edges = [(paper.id, right_id) for right_id in right_ids]
+    counts.update(db, relationship.id, edges, 1)
+    graph.record_added(db, "cite", edges)
+    similarity_refresh.mark_changed(db, "cite", edges)
+    add_oa_versions(right_papers, oa_urls, db)
+
+
+def _get_paper_ids(urls, db):
+    """
+    Get the ids of the papers identified by some DOI or arXiv URLs.
+
+    :param urls: A list of DOI or arXiv URLs.
+    :param db: A database session.
+    :returns: A set of the ids of the found papers.
+    """
+    identifiers = [tools.get_identifier_from_url(url) for url in urls]
+    papers = _get_papers([(type, identifier)
+                          for type, identifier in identifiers
+                          if type is not None],
+                         db)
+    return set(paper.id for paper in papers.values())
+
+
+def remove_cited_urls(paper, cited_urls, db, kept_urls=None):
+    """
+    Remove the "cite" relationships between the provided paper and the papers
+    identified by the given URLs.
+
+    :param paper: The citing paper.
+    :param cited_urls: A list of DOI or arXiv URLs of the cited papers.
+    :param db: A database session
+    :param kept_urls: An optional list of DOI or arXiv URLs of papers still \
+            cited, whose relationships are kept even if one of their URLs is \
+            in ``cited_urls``.
+    :returns: Nothing.
+    """
+    relationship = (db.query(database.Relationship)
+                    .filter_by(name="cite")
+                    .first())
+    if relationship is None or not cited_urls:
         return
+    removed_ids = _get_paper_ids(cited_urls, db)
+    if kept_urls:
+        removed_ids -= _get_paper_ids(kept_urls, db)
+    # Only the existing relationships are removed from the counts
+    right_ids = [
+        right_id for right_id, in _query_in(
+            (db.query(database.RelationshipAssociation.right_id)
+             .filter_by(left_id=paper.id, relationship_id=relationship.id)),
+            database.RelationshipAssociation.right_id,
+            list(removed_ids))
+    ]
+    for i in range(0, len(right_ids), IN_QUERY_CHUNK_SIZE):
+        (db.query(database.RelationshipAssociation)
+         .filter_by(left_id=paper.id, relationship_id=relationship.id)
+         .filter(database.RelationshipAssociation.right_id.in_(
+             right_ids[i:i + IN_QUERY_CHUNK_SIZE]))
+         .delete(synchronize_session=False))
+    edges = [(paper.id, right_id) for right_id in right_ids]
+    counts.update(db, relationship.id, edges, -1)
+    graph.record_removed(db, "cite", edges)
+    similarity_refresh.mark_changed(db, "cite", edges)
+    db.flush()
+
+
+def add_oa_versions(papers, oa_urls, db):
+    """
+    Store the open access versions of the given papers, for those without
+    any known open access version.
+
+    :param papers: A list of ``Paper`` objects.
+    :param oa_urls: A dict of DOIs and their open access URL or ``None``, \
+            see ``doi.get_oa_versions``.
+    :param db: A database session.
+    :returns: Nothing.
+    """
+    for paper in papers:
+        if paper.oa_url is None and oa_urls.get(paper.doi) is not None:
+            paper.oa_url = oa_urls[paper.doi]
+            db.add(paper)
+    db.flush()
 
 
 def fetch_citations_in_queue(create_session):
@@ -203,28 +621,121 @@ def fetch_citations_in_queue(create_session):
             Calls itself recursively after the time defined in ``config``, so
             that queued articles are processed concurrently.
 
+    :param create_session: a ``SQLAlchemy`` ``sessionmaker``.
+    :returns: Nothing.
+    """
+    try:
+        process_queued_paper(create_session)
+    except Exception:
+        # Keep on processing the queue
+        traceback.print_exc()
+    finally:
+        # Call this function again after a while
+        threading.Timer(
+            config.queue_polling_interval,
+            lambda: fetch_citations_in_queue(create_session)
+        ).start()
+
+
+def process_queued_paper(create_session):
+    """
+    Process the first paper in the queue. A paper whose processing fails is
+    moved to the end of the queue, to be retried after the other ones. The
+    papers being processed by ``create_paper`` are skipped.
+
     :param create_session: a ``SQLAlchemy`` ``sessionmaker``.
     :returns: Nothing.
     """
     # Get a db Session
     db = create_session()
-    queued = db.query(database.CitationProcessingQueue).first()
-    if queued:
-        print("Processing citation relationships for %s." % (queued.paper,))
-        # Process this paper
-        add_cite_relationship(queued.paper, db)
-        # Remove this paper from queue
-        db.delete(queued)
-        # Commit to the database
+    try:
+        with processing_papers_lock:
+            processing = list(processing_papers)
+        queued = (db.query(database.CitationProcessingQueue)
+                  .filter(~database.CitationProcessingQueue.paper_id.in_(
+                      processing))
+                  .order_by(database.CitationProcessingQueue.id)
+                  .first())
+        if queued is None:
+            return
+        paper_id = queued.paper_id
+        name = str(queued.paper)
+        print("Processing citation relationships for %s." % (name,))
         try:
+            # Process this paper
+            with instrumentation.collect() as breakdown:
+                add_cite_relationship(queued.paper, db)
+            # Remove this paper from queue
+            db.delete(queued)
+            # Commit to the database
+            db.commit()
+        except Exception:
+            traceback.print_exc()
+            print("Failed to process citation relationships for %s, "
+                  "retrying it later." % (name,))
+            db.rollback()
+            # Queue it again, after the other papers
+            (db.query(database.CitationProcessingQueue)
+             .filter_by(paper_id=paper_id)
+             .delete())
+            db.add(database.CitationProcessingQueue(paper_id=paper_id))
             db.commit()
-        except:
+            return
+        print("Processed citation relationships for %s: %s." % (
+            name, breakdown.format()))
+    finally:
+        # Give the connection back to the pool
+        db.close()
+
+
+def queue_new_versions(create_session, batch_size=IN_QUERY_CHUNK_SIZE):
+    """
+    Queue the papers whose references were extracted from an older arXiv
+    version than the latest one, so that the queue worker updates their
+    "cite" relationships.
+
+    The latest versions are looked up on arXiv API by batches of papers,
+    each batch being queued in its own transaction so that the database is
+    not locked meanwhile.
+
+    :param create_session: a ``SQLAlchemy`` ``sessionmaker``.
+    :param batch_size: Number of papers looked up at once.
+    :returns: The number of queued papers.
+    """
+    queued = 0
+    last_id = 0
+    while True:
+        db = create_session()
+        try:
+            papers = (db.query(database.Paper.id,
+                               database.Paper.arxiv_id,
+                               database.Paper.extracted_version)
+                      .filter(database.Paper.id > last_id)
+                      .filter(database.Paper.arxiv_id.isnot(None))
+                      .filter(database.Paper.extracted_version.isnot(None))
+                      .order_by(database.Paper.id)
+                      .limit(batch_size)
+                      .all())
+            if not papers:
+                return queued
+            last_id = papers[-1].id
+            # End the read transaction while querying arXiv API
             db.rollback()
-    # Call this function again after a while
-    threading.Timer(
-        config.queue_polling_interval,
-        lambda: fetch_citations_in_queue(create_session)
-    ).start()
+            eprints = {paper.id: regex.arxiv_version.sub("", paper.arxiv_id)
+                       for paper in papers}
+            latest = arxiv.get_latest_versions(list(set(eprints.values())))
+            ids = []
+            for paper in papers:
+                version = latest.get(eprints[paper.id])
+                if version is not None and version != paper.extracted_version:
+                    ids.append(paper.id)
+            _insert_or_ignore(database.CitationProcessingQueue.__table__,
+                              [{"paper_id": id} for id in ids],
+                              db)
+            db.commit()
+            queued += len(ids)
+        finally:
+            db.close()
 
 
 def update_relationships(id, name, db):
@@ -273,9 +784,10 @@ def update_relationships(id, name, db):
             if paper is None or tag is None:
                 # An error occurred => 403
                 return bottle.HTTPError(403, "Forbidden")
-            paper.tags.append(tag)
-            db.add(paper)
-            db.flush()
+            if tag not in paper.tags:
+                paper.tags.append(tag)
+                db.add(paper)
+                db.flush()
         else:
             updated = update_relationship_backend(id, i["id"], name, db)
             if updated is None:
@@ -285,6 +797,24 @@ def update_relationships(id, name, db):
     return tools.APIResponse(status=204, body="")
 
 
+def get_or_create_relationship(name, db):
+    """
+    Get a relationship by its name, creating it if needed.
+
+    :param name: Name of the relationship.
+    :param db: A database session.
+    :returns: The ``Relationship`` object.
+    """
+    relationship = db.query(database.Relationship).filter_by(name=name).first()
+    if relationship is None:
+        relationship = database.Relationship(name=name)
+        db.add(relationship)
+        db.flush()
+        # Serializers must list the new relationship, once committed
+        database.relationship_registry.record_created(db)
+    return relationship
+
+
 def update_relationship_backend(left_id, right_id, name, db):
     """
     Backend method to update a single relationship between two papers.
@@ -293,7 +823,8 @@ def update_relationship_backend(left_id, right_id, name, db):
     :param right_id: ID of the paper on the right of the relationship.
     :param name: Name of the relationship between the two papers.
     :param db: A database session.
-    :returns: The updated left paper on success, ``None`` otherwise.
+    :returns: The updated left paper on success, also if the relationship \
+            already exists, ``None`` otherwise.
     """
     # Load necessary resources
     left_paper = db.query(database.Paper).filter_by(id=left_id).first()
@@ -301,22 +832,30 @@ def update_relationship_backend(left_id, right_id, name, db):
     if left_paper is None or right_paper is None:
         # Abort
         return None
-    relationship = db.query(database.Relationship).filter_by(name=name).first()
-    if relationship is None:
-        relationship = database.Relationship(name=name)
-        db.add(relationship)
-        db.flush()
-    # Update the relationship
-    a = database.RelationshipAssociation(relationship_id=relationship.id)
-    a.right_paper = right_paper
-    left_paper.related_to.append(a)
-    try:
-        db.add(a)
-        db.add(left_paper)
-    except IntegrityError:
-        # Unique constraint violation, relationship already exists
-        db.rollback()
-        return None
+    relationship = get_or_create_relationship(name, db)
+    # Relationships are unique, see the indexes of RelationshipAssociation
+    existing = (db.query(database.RelationshipAssociation.id)
+                .filter_by(left_id=left_id,
+                           right_id=right_id,
+                           relationship_id=relationship.id)
+                .first())
+    if existing is not None:
+        # Adding an existing relationship again is a no-op
+        return left_paper
+    # Update the relationship, skipped on a unique constraint violation
+    inserted = _insert_or_ignore(
+        database.RelationshipAssociation.__table__,
+        [{"left_id": left_id,
+          "right_id": right_id,
+          "relationship_id": relationship.id}],
+        db,
+        returning=database.RelationshipAssociation.__table__.c.id)
+    if inserted == []:
+        # Concurrently added meanwhile
+        return left_paper
+    counts.update(db, relationship.id, [(left_id, right_id)], 1)
+    graph.record_added(db, name, [(left_id, right_id)])
+    similarity_refresh.mark_changed(db, name, [(left_id, right_id)])
     return left_paper
 
 
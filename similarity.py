@@ -0,0 +1,284 @@
+"""
+This file contains the batch computation of the most similar papers of each
+paper in the graph of the "cite" relationships, stored in
+``similar_papers``.
+
+Two papers are similar when they are cited by the same papers (co-citation)
+and when they cite the same papers (bibliographic coupling). With ``A`` the
+adjacency matrix of the citations, the numbers of co-citations and couplings
+are the sparse matrix products ``A^T A`` and ``A A^T``. Their rows are
+computed by blocks of papers with NumPy, by expanding the compressed sparse
+row (CSR) arrays of the graph, so that the temporary arrays have a bounded
+size, and only the ``TOP_K`` most similar papers of each paper are kept.
+
+The papers whose citations changed are recorded in ``similarity_refresh``
+along with the changes, see ``similarity_refresh.py``, so that only their
+neighbourhood is recomputed afterwards. The numbers of
+co-citations and couplings are then exact, while the scores of the other
+papers paired with a changed paper take its new numbers of citations into
+account at their next recomputation.
+"""
+import numpy
+from sqlalchemy import delete, func, select
+
+import database
+import pagerank
+
+
+# Number of similar papers kept for each paper
+TOP_K = 20
+# Weights of the normalized numbers of co-citations and couplings in the
+# score
+COCITATION_WEIGHT = 0.5
+COUPLING_WEIGHT = 0.5
+# Maximum number of pairs of papers expanded at once
+MAX_PAIRS = 5000000
+# Maximum number of values in an IN clause
+IN_QUERY_CHUNK_SIZE = 500
+
+
+def _csr(sources, targets, size):
+    """
+    Build the CSR arrays of a graph: the successors of the paper ``i`` are
+    ``indices[ptr[i]:ptr[i + 1]]``.
+
+    :returns: A tuple ``(ptr, indices)``.
+    """
+    order = numpy.argsort(sources, kind="stable")
+    ptr = numpy.zeros(size + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(sources, minlength=size), out=ptr[1:])
+    return (ptr, targets[order])
+
+
+def _expand(ptr, indices, rows):
+    """
+    Get the successors of some papers in a CSR graph, all at once.
+
+    :param ptr: The offsets of the CSR graph.
+    :param indices: The successors of the CSR graph.
+    :param rows: An array of papers ids, possibly repeated.
+    :returns: A tuple ``(owners, successors)`` of two arrays, ``owners`` \
+            being the positions in ``rows`` of the papers of which \
+            ``successors`` are the successors.
+    """
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    owners = numpy.repeat(numpy.arange(len(rows)), lengths)
+    # Offsets of the successors of each paper in indices
+    offsets = (numpy.arange(lengths.sum()) +
+               numpy.repeat(starts - (numpy.cumsum(lengths) - lengths),
+                            lengths))
+    return (owners, indices[offsets])
+
+
+def _pairs(rows, first, second, size):
+    """
+    Count the paths of length 2 from some papers, through a first graph then
+    a second one, as in a row block of a sparse matrix product.
+
+    :returns: A tuple ``(keys, counts)`` of the pairs of papers ``(i, j)``, \
+            ``i != j``, encoded as ``i * size + j`` and sorted, and their \
+            numbers of paths.
+    """
+    owners, middles = _expand(first[0], first[1], rows)
+    second_owners, ends = _expand(second[0], second[1], middles)
+    starts = rows[owners[second_owners]].astype(numpy.int64)
+    keep = (starts != ends)
+    keys = starts[keep] * size + ends[keep]
+    return numpy.unique(keys, return_counts=True)
+
+
+def _normalize(counts, keys, degrees, size):
+    """
+    Normalize the numbers of paths between pairs of papers by the geometric
+    mean of their degrees (cosine similarity).
+    """
+    return counts / numpy.sqrt(degrees[keys // size] *
+                               degrees[keys % size])
+
+
+def similar_papers(rows, forward, backward, in_degrees, out_degrees, size,
+                   top_k=TOP_K):
+    """
+    Compute the most similar papers of a block of papers.
+
+    :param rows: A sorted array of papers ids.
+    :param forward: The CSR arrays of the cited papers of each paper.
+    :param backward: The CSR arrays of the citing papers of each paper.
+    :param in_degrees: An array of the numbers of citing papers.
+    :param out_degrees: An array of the numbers of cited papers.
+    :param size: The maximum paper id + 1.
+    :param top_k: Number of similar papers kept for each paper.
+    :returns: A tuple of arrays ``(paper_ids, positions, similar_ids, \
+            scores, cocitations, couplings)``, sorted by papers ids and \
+            positions.
+    """
+    # Papers citing a paper, then the other papers they cite
+    cocitation_keys, cocitations = _pairs(rows, backward, forward, size)
+    # Papers cited by a paper, then the other papers citing them
+    coupling_keys, couplings = _pairs(rows, forward, backward, size)
+    keys = numpy.union1d(cocitation_keys, coupling_keys)
+    all_cocitations = numpy.zeros(len(keys), dtype=numpy.int64)
+    all_cocitations[numpy.searchsorted(keys, cocitation_keys)] = cocitations
+    all_couplings = numpy.zeros(len(keys), dtype=numpy.int64)
+    all_couplings[numpy.searchsorted(keys, coupling_keys)] = couplings
+    scores = numpy.zeros(len(keys))
+    scores[all_cocitations > 0] += COCITATION_WEIGHT * _normalize(
+        all_cocitations[all_cocitations > 0],
+        keys[all_cocitations > 0], in_degrees, size)
+    scores[all_couplings > 0] += COUPLING_WEIGHT * _normalize(
+        all_couplings[all_couplings > 0],
+        keys[all_couplings > 0], out_degrees, size)
+
+    # Sort by paper, decreasing score and similar paper, and keep the top k
+    paper_ids = keys // size
+    similar_ids = keys % size
+    order = numpy.lexsort((similar_ids, -scores, paper_ids))
+    paper_ids = paper_ids[order]
+    _, starts, lengths = numpy.unique(paper_ids, return_index=True,
+                                      return_counts=True)
+    positions = numpy.arange(len(order)) - numpy.repeat(starts, lengths)
+    keep = order[positions < top_k]
+    return (paper_ids[positions < top_k], positions[positions < top_k],
+            similar_ids[keep], scores[keep], all_cocitations[keep],
+            all_couplings[keep])
+
+
+def _blocks(rows, costs, max_pairs=MAX_PAIRS):
+    """
+    Split papers in blocks of about ``max_pairs`` expanded pairs.
+
+    :param rows: A sorted array of papers ids.
+    :param costs: An array of the numbers of expanded pairs of each paper, \
+            indexed by papers ids.
+    :returns: A generator of arrays of papers ids.
+    """
+    if len(rows) == 0:
+        return
+    blocks = (numpy.cumsum(costs[rows]) // max_pairs).astype(numpy.int64)
+    bounds = numpy.flatnonzero(numpy.diff(blocks)) + 1
+    for block in numpy.split(rows, bounds):
+        yield block
+
+
+def _existing(connection, ids):
+    """
+    Get the ids of the papers which still exist among some papers.
+    """
+    ids = sorted(ids)
+    existing = set()
+    for i in range(0, len(ids), IN_QUERY_CHUNK_SIZE):
+        existing.update(
+            id for id, in connection.execute(
+                select(database.Paper.id)
+                .where(database.Paper.id.in_(
+                    ids[i:i + IN_QUERY_CHUNK_SIZE]))))
+    return existing
+
+
+def store_block(engine, rows, result):
+    """
+    Replace the similar papers of a block of papers, in a transaction, so
+    that the API is not locked out meanwhile.
+
+    :param engine: A ``SQLAlchemy`` engine.
+    :param rows: An array of the papers ids of the block.
+    :param result: The similar papers of the block, see ``similar_papers``.
+    :returns: The number of stored similar papers.
+    """
+    table = database.SimilarPaper.__table__
+    rows = rows.tolist()
+    with engine.begin() as connection:
+        for i in range(0, len(rows), IN_QUERY_CHUNK_SIZE):
+            connection.execute(
+                delete(table)
+                .where(table.c.paper_id.in_(
+                    rows[i:i + IN_QUERY_CHUNK_SIZE])))
+        # Papers may have been deleted since they were loaded
+        existing = _existing(
+            connection, set(rows) | set(result[2].tolist()))
+        inserted = [
+            {"paper_id": paper_id, "position": position,
+             "similar_id": similar_id, "score": score,
+             "cocitations": cocitations, "couplings": couplings}
+            for (paper_id, position, similar_id, score, cocitations,
+                 couplings) in zip(*[column.tolist() for column in result])
+            if paper_id in existing and similar_id in existing
+        ]
+        if inserted:
+            connection.execute(table.insert(), inserted)
+    return len(inserted)
+
+
+def _load_refresh(connection):
+    """
+    Load the papers to refresh.
+
+    :returns: A tuple ``(last_id, ids)`` of the id of the last row of \
+            ``similarity_refresh`` and the set of the papers ids.
+    """
+    SimilarityRefresh = database.SimilarityRefresh
+    last_id = connection.execute(
+        select(func.max(SimilarityRefresh.id))).scalar() or 0
+    ids = set(
+        id for id, in connection.execute(
+            select(SimilarityRefresh.paper_id).distinct()
+            .where(SimilarityRefresh.id <= last_id)))
+    return (last_id, ids)
+
+
+def update_similar(engine, full=False, top_k=TOP_K, directory=None):
+    """
+    Compute the most similar papers and store them: only for the papers
+    whose neighbourhood changed, unless ``full`` is set or none was computed
+    yet.
+
+    :param engine: A ``SQLAlchemy`` engine.
+    :param full: Recompute the similar papers of all the papers.
+    :param top_k: Number of similar papers kept for each paper.
+    :param directory: If given, the edges are memory-mapped files in this \
+            directory.
+    :returns: A tuple ``(papers, similar, edges)`` of the numbers of \
+            refreshed papers, stored similar papers and edges.
+    """
+    with engine.connect() as connection:
+        full = full or connection.execute(
+            select(database.SimilarPaper.paper_id).limit(1)).first() is None
+        # Read the changes and the graph in the same transaction, the
+        # changes recorded afterwards are kept for the next run
+        last_id, changed = _load_refresh(connection)
+        exists, sources, targets = pagerank.load_graph(connection, directory)
+    size = len(exists)
+    forward = _csr(sources, targets, size)
+    backward = _csr(targets, sources, size)
+    out_degrees = numpy.diff(forward[0])
+    in_degrees = numpy.diff(backward[0])
+
+    if full:
+        rows = numpy.flatnonzero(exists)
+    else:
+        # The changed papers, and the papers they cite or which cite them
+        changed = numpy.array(sorted(id for id in changed if id < size),
+                              dtype=numpy.int64)
+        rows = numpy.unique(numpy.concatenate([
+            changed,
+            _expand(forward[0], forward[1], changed)[1],
+            _expand(backward[0], backward[1], changed)[1]]))
+        rows = rows[exists[rows]]
+
+    # Numbers of expanded pairs of each paper
+    costs = (numpy.bincount(targets, weights=out_degrees[sources],
+                            minlength=size) +
+             numpy.bincount(sources, weights=in_degrees[targets],
+                            minlength=size))
+    similar = 0
+    for block in _blocks(rows, costs):
+        similar += store_block(
+            engine, block,
+            similar_papers(block, forward, backward, in_degrees,
+                           out_degrees, size, top_k=top_k))
+    with engine.begin() as connection:
+        connection.execute(
+            delete(database.SimilarityRefresh.__table__)
+            .where(database.SimilarityRefresh.id <= last_id))
+    return (len(rows), similar, len(sources))
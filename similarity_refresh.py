@@ -0,0 +1,58 @@
+"""
+This file contains the recording of the papers whose similar papers have to
+be recomputed by ``similarity.update_similar``, along with the changes of the
+"cite" relationships, in ``similarity_refresh``.
+
+It is kept apart from ``similarity.py`` so that the routes do not import
+NumPy.
+"""
+import database
+
+
+def mark_changed(db, name, edges):
+    """
+    Record relationships added or removed in a database session, whose
+    papers have to be refreshed.
+
+    :param db: A database session.
+    :param name: The name of the relationship, only "cite" ones are \
+            recorded.
+    :param edges: A list of tuples ``(left_id, right_id)``.
+    :returns: Nothing.
+    """
+    if name != "cite":
+        return
+    ids = sorted(set(id for edge in edges for id in edge))
+    if ids:
+        db.execute(database.SimilarityRefresh.__table__.insert(),
+                   [{"paper_id": id} for id in ids])
+
+
+def remove_paper(db, paper_id):
+    """
+    Record the papers to refresh, before a paper is deleted along with all
+    its relationships and similar papers: the papers it cites or which cite
+    it, and the papers it is similar to.
+
+    :param db: A database session.
+    :param paper_id: The id of the paper.
+    :returns: Nothing.
+    """
+    relationship_id = database.relationship_registry.id("cite", db)
+    RelationshipAssociation = database.RelationshipAssociation
+    ids = set(
+        id for id, in db.query(database.SimilarPaper.paper_id)
+        .filter(database.SimilarPaper.similar_id == paper_id))
+    if relationship_id is not None:
+        for left_id, right_id in (
+                db.query(RelationshipAssociation.left_id,
+                         RelationshipAssociation.right_id)
+                .filter(RelationshipAssociation.relationship_id ==
+                        relationship_id)
+                .filter((RelationshipAssociation.left_id == paper_id) |
+                        (RelationshipAssociation.right_id == paper_id))):
+            ids.update((left_id, right_id))
+    ids.discard(paper_id)
+    if ids:
+        db.execute(database.SimilarityRefresh.__table__.insert(),
+                   [{"paper_id": id} for id in sorted(ids)])
@@ -0,0 +1,187 @@
+"""
+Tests of the extraction of the ``.bbl`` files of arXiv e-prints, and of the
+batched arXiv API lookups.
+"""
+import gzip
+import io
+import os
+import tarfile
+import unittest
+from unittest import mock
+
+from reference_fetcher import arxiv
+from reference_fetcher import client
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as fh:
+        return fh.read()
+
+
+class ArxivAPIStandIn(object):
+    """
+    Stand-in for the HTTP client, answering arXiv API search queries for the
+    DOIs of ``eprints``. Queries with an unquoted DOI or any DOI of
+    ``malformed`` get an error entry, as arXiv API does.
+    """
+    def __init__(self, eprints, malformed):
+        self.eprints = eprints
+        self.malformed = malformed
+        self.queries = []
+
+    def get(self, url, params=None, revalidate=False, **kwargs):
+        query = params["search_query"]
+        self.queries.append(query)
+        terms = query.split(" OR ")
+        entries = []
+        if any(not term.startswith('doi:"') or
+               term[len('doi:"'):-1] in self.malformed for term in terms):
+            entries.append(("http://arxiv.org/api/errors", None))
+        else:
+            for term in terms:
+                doi = term[len('doi:"'):-1]
+                if doi in self.eprints:
+                    entries.append(("http://arxiv.org/abs/%s" % (
+                        self.eprints[doi],), doi))
+        feed = "".join(
+            '<entry><id>%s</id>%s</entry>' % (
+                id, '<arxiv:doi>%s</arxiv:doi>' % (doi,) if doi else "")
+            for id, doi in entries)
+        return Response((
+            '<feed xmlns="http://www.w3.org/2005/Atom" '
+            'xmlns:arxiv="http://arxiv.org/schemas/atom">%s</feed>' %
+            (feed,)).encode("utf-8"))
+
+
+class Response(object):
+    def __init__(self, content):
+        self.content = content
+
+
+def tarball(members):
+    """
+    Build a gzipped tarball of the given dict of names and text contents.
+    """
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode="w:gz") as tf:
+        for name, content in members.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return output.getvalue()
+
+
+class TestBblFromSources(unittest.TestCase):
+    def test_tarball(self):
+        bbl = read_fixture("sample.bbl")
+        eprint = tarball({"main.tex": "\\documentclass{article}\n",
+                          "main.bbl": bbl})
+        self.assertEqual(arxiv.bbl_from_sources(io.BytesIO(eprint)), [bbl])
+
+    def test_single_bbl_file(self):
+        for name in ("sample.bbl", "biblatex.bbl"):
+            bbl = read_fixture(name)
+            eprint = gzip.compress(bbl.encode("utf-8"))
+            with self.subTest(fixture=name):
+                self.assertEqual(arxiv.bbl_from_sources(io.BytesIO(eprint)),
+                                 [bbl])
+
+    def test_single_tex_file(self):
+        bbl = read_fixture("sample.bbl").strip()
+        tex = ("\\documentclass{article}\n\\begin{document}\nSome text.\n" +
+               bbl + " \\end{document}\n")
+        eprint = gzip.compress(tex.encode("utf-8"))
+        self.assertEqual(arxiv.bbl_from_sources(io.BytesIO(eprint)), [bbl])
+
+    def test_pdf(self):
+        for eprint in (b"%PDF-1.5\n", gzip.compress(b"%PDF-1.5\n")):
+            with self.subTest(eprint=eprint):
+                self.assertEqual(arxiv.bbl_from_sources(io.BytesIO(eprint)),
+                                 [])
+
+
+class TestDoiBatch(unittest.TestCase):
+    def setUp(self):
+        self.client = client.get_client()
+
+    def tearDown(self):
+        client.set_client(self.client)
+
+    def test_malformed_doi(self):
+        eprints = {"10.1016/s0004-3702(99)00059-4": "0000.0001v1",
+                   "10.1103/physreva.88.022316": "0000.0002v2"}
+        dois = list(eprints) + ["10.1000/bad", "10.1000/missing"]
+        stand_in = ArxivAPIStandIn(eprints, malformed=["10.1000/bad"])
+        client.set_client(stand_in)
+        self.assertEqual(arxiv.get_arxiv_eprint_from_doi_batch(dois), {
+            "10.1016/s0004-3702(99)00059-4": "0000.0001v1",
+            "10.1103/physreva.88.022316": "0000.0002v2",
+            "10.1000/bad": None,
+            "10.1000/missing": None,
+        })
+        # The failed query is split down to the malformed DOI only
+        self.assertEqual(len(stand_in.queries), 5)
+        self.assertIn('doi:"10.1000/bad"', stand_in.queries)
+
+
+class TestLatestVersions(unittest.TestCase):
+    def test_latest_versions(self):
+        versions = {"1401.0001": "1401.0001v2", "1401.0002": "1401.0002v1"}
+        queries = []
+
+        def query_arxiv_api(params):
+            eprints = params["id_list"].split(",")
+            queries.append(eprints)
+            if "bad" in eprints and len(eprints) > 1:
+                # A malformed id makes the whole query fail
+                return None
+            return [(versions[eprint], None) for eprint in eprints
+                    if eprint in versions]
+
+        with mock.patch.object(arxiv, "_query_arxiv_api", query_arxiv_api):
+            self.assertEqual(
+                arxiv.get_latest_versions(["1401.0001", "bad", "1401.0002"]),
+                {"1401.0001": "1401.0001v2", "bad": None,
+                 "1401.0002": "1401.0002v1"})
+        self.assertEqual(queries, [["1401.0001", "bad", "1401.0002"],
+                                   ["1401.0001"], ["bad"], ["1401.0002"]])
+
+
+class StreamedResponse(object):
+    """
+    Stand-in for a streamed ``requests.Response``, recording whether it was
+    closed.
+    """
+    def __init__(self, content):
+        self.raw = io.BytesIO(content)
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class TestBblFromArxiv(unittest.TestCase):
+    def setUp(self):
+        self.client = client.get_client()
+        self.addCleanup(client.set_client, self.client)
+        self.response = StreamedResponse(tarball({"main.bbl": "\\bibitem"}))
+        client.set_client(mock.Mock(get=lambda url, **kwargs: self.response))
+
+    def test_response_closed(self):
+        self.assertEqual(arxiv.bbl_from_arxiv("1401.0001"), ["\\bibitem"])
+        self.assertTrue(self.response.closed)
+
+    def test_response_closed_on_error(self):
+        with mock.patch.object(arxiv, "bbl_from_sources",
+                               side_effect=EOFError):
+            with self.assertRaises(EOFError):
+                arxiv.bbl_from_arxiv("1401.0001")
+        self.assertTrue(self.response.closed)
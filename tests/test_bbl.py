@@ -0,0 +1,248 @@
+"""
+Tests of the splitting of ``.bbl`` files in bibitems, of the cleaning of
+bibitems against the corpus of ``benchmarks/fixtures``, and of the
+resolution of citations through Crossref.
+
+``FIXTURE.expected.txt`` are the hand-written expected citations of the
+bibitems of ``FIXTURE.bbl``, one per line, and ``FIXTURE.simplified.txt`` the
+expected citations with ``simplify=True``. They were not produced by
+``delatex``, the ``delatex`` backend is only checked against them when
+``opendetex`` is built.
+"""
+import os
+import re
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+from reference_fetcher import bbl
+from reference_fetcher import client
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "benchmarks", "fixtures")
+FIXTURES = ("sample", "biblatex")
+DELATEX_PATH = os.path.join(os.path.dirname(os.path.abspath(bbl.__file__)),
+                            "opendetex", "delatex")
+
+
+def load_fixture(name, suffix):
+    """
+    Load the path to a ``.bbl`` fixture and its expected citations.
+    """
+    path = os.path.join(FIXTURES_DIR, "%s.%s.txt" % (name, suffix))
+    with open(path, "r", encoding="utf-8") as fh:
+        expected = fh.read().splitlines()
+    return (os.path.join(FIXTURES_DIR, "%s.bbl" % (name,)), expected)
+
+
+class TestTokenizeBibitems(unittest.TestCase):
+    def test_bibitems(self):
+        lines = [
+            "\\begin{thebibliography}{10}\n",
+            "\n",
+            "\\bibitem{a} A. Author, \\textit{Title},\n",
+            "  J. 1 (2000).\n",
+            "\\bibitem[Bo et~al.(2001)]{b}\n",
+            "B. Bo, Title 2.\n",
+            "\\end{thebibliography}\n",
+            "Not a bibitem.\n",
+        ]
+        self.assertEqual(list(bbl.tokenize_bibitems(lines)), [
+            "A. Author, \\textit{Title},\n  J. 1 (2000).",
+            "B. Bo, Title 2.",
+        ])
+
+    def test_head_across_lines(self):
+        lines = ["\\bibitem[{Lab\n", "el}]{c} C. Cee, \n", "Title 3.\n"]
+        self.assertEqual(list(bbl.tokenize_bibitems(lines)),
+                         ["C. Cee, \nTitle 3."])
+
+    def test_biblatex_entry(self):
+        lines = [
+            "\\entry{key}{article}{}\n",
+            "  \\name{author}{2}{}{%\n",
+            "    {{hash=1}{family={Einstein},given={Albert}}}%\n",
+            "    {{hash=2}{family={Bo},given={B.}}}%\n",
+            "  }\n",
+            "  \\field{title}{On things}\n",
+            "  \\field{journaltitle}{Ann. Phys.}\n",
+            "  \\field{volume}{17}\n",
+            "  \\field{year}{1905}\n",
+            "  \\verb{doi}\n",
+            "  \\verb 10.1002/andp.19053221004\n",
+            "  \\endverb\n",
+            "\\endentry\n",
+        ]
+        self.assertEqual(list(bbl.tokenize_bibitems(lines)), [
+            "Albert Einstein, B. Bo, On things, Ann. Phys., 17, 1905, "
+            "doi:\\doi{10.1002/andp.19053221004}",
+        ])
+
+    def test_lazy(self):
+        def lines():
+            yield "\\bibitem{a} First.\n"
+            yield "\\bibitem{b} Second.\n"
+            raise AssertionError("Read past the second bibitem")
+
+        bibitems = bbl.tokenize_bibitems(lines())
+        self.assertEqual(next(bibitems), "First.")
+
+
+class FakeDelatex(object):
+    """
+    Stand-in for ``bbl.delatex``, dropping math environments up to their end
+    (or the end of the text if not closed), as delatex does, and counting its
+    calls.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return re.sub(r"\$[^$]*\$?", "", text)
+
+
+class TestCleanBibitems(unittest.TestCase):
+    def setUp(self):
+        self.delatex = FakeDelatex()
+        patcher = mock.patch.object(bbl, "delatex", self.delatex)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_single_process(self):
+        bibitems = ["A. Author, Title $x^2$ (2000).", "B.  Bo,\nTitle 2."]
+        self.assertEqual(bbl.clean_bibitems(bibitems),
+                         ["A. Author, Title (2000)", "B. Bo, Title 2"])
+        self.assertEqual(self.delatex.calls, 1)
+        self.assertEqual(bbl.clean_bibitems([]), [])
+        self.assertEqual(self.delatex.calls, 1)
+
+    def test_fallback(self):
+        # The math environment left open swallows the separator
+        bibitems = ["A. Author, $open math", "B. Bo, Title 2."]
+        self.assertEqual(bbl.clean_bibitems(bibitems),
+                         ["A. Author", "B. Bo, Title 2"])
+        self.assertEqual(self.delatex.calls, 3)
+        # The separator is in a bibitem
+        bibitems = ["A. %s" % (bbl.DELATEX_SEPARATOR,), "B. Bo, Title 2."]
+        self.assertEqual(bbl.clean_bibitems(bibitems),
+                         ["A. %s" % (bbl.DELATEX_SEPARATOR,),
+                          "B. Bo, Title 2"])
+        self.assertEqual(self.delatex.calls, 5)
+
+
+class TestCleaning(unittest.TestCase):
+    def test_python_backend(self):
+        for name in FIXTURES:
+            bbl_file, expected = load_fixture(name, "expected")
+            with self.subTest(fixture=name):
+                self.assertEqual(bbl.parse(bbl_file, backend="python"),
+                                 expected)
+
+    @unittest.skipUnless(os.path.isfile(DELATEX_PATH),
+                         "opendetex is not built")
+    def test_delatex_backend(self):
+        for name in FIXTURES:
+            bbl_file, expected = load_fixture(name, "expected")
+            with self.subTest(fixture=name):
+                self.assertEqual(bbl.parse(bbl_file, backend="delatex"),
+                                 expected)
+                self.assertEqual(
+                    bbl.parse(bbl_file, backend="delatex", batch=False),
+                    expected)
+
+    def test_simplify(self):
+        for name in FIXTURES:
+            bbl_file, expected = load_fixture(name, "simplified")
+            with self.subTest(fixture=name):
+                self.assertEqual(
+                    bbl.parse(bbl_file, backend="python", simplify=True),
+                    expected)
+
+    def test_simplify_words(self):
+        cases = [
+            ("R.~Marto\\v{n}\\'{a}k", "R. Martoňák"),
+            ("transverse {I}sing model", "transverse Ising model"),
+            ("bewegter {K}{\\\"o}rper", "bewegter Körper"),
+            ("L.~P. Gor{\\cprime}kov", "L. P. Gor'kov"),
+            ("\\bibinfo{pages}{891\\bibrangedash 921}", "891-921"),
+            ("\\bibinfo{journal}{Phys. Rev. E}", "Phys. Rev. E"),
+        ]
+        for bibitem, expected in cases:
+            with self.subTest(bibitem=bibitem):
+                self.assertEqual(
+                    bbl.clean_bibitems_python([bibitem], simplify=True),
+                    [expected])
+
+
+class CrossrefStandIn(object):
+    """
+    Stand-in for the HTTP client, answering Crossref ``/links`` queries with a
+    DOI for each citation. Batches with a citation of ``malformed`` fail.
+    """
+    def __init__(self, malformed):
+        self.malformed = malformed
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None, **kwargs):
+        with self._lock:
+            self.batches.append(list(json))
+        if any(citation in self.malformed for citation in json):
+            return Response(500, None)
+        return Response(200, {"results": [
+            {"text": citation, "match": True,
+             "doi": "http://dx.doi.org/10.1000/%s" % (citation,)}
+            for citation in json]})
+
+
+class Response(object):
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def json(self):
+        return self.content
+
+
+class TestCrossrefLinks(unittest.TestCase):
+    def setUp(self):
+        self.client = client.get_client()
+
+    def tearDown(self):
+        client.set_client(self.client)
+
+    def test_failed_batches_are_split(self):
+        citations = ["citation-%d" % (i,) for i in range(100)]
+        stand_in = CrossrefStandIn(malformed=["citation-42"])
+        client.set_client(stand_in)
+        dois = bbl.crossref_links(citations, max_workers=3)
+        self.assertEqual(list(dois), [citation for citation in citations
+                                      if citation != "citation-42"])
+        for citation, doi in dois.items():
+            self.assertEqual(doi, "http://dx.doi.org/10.1000/%s" % (
+                citation,))
+        # The failed batches are split down to the malformed citation
+        self.assertIn(["citation-42"], stand_in.batches)
+        self.assertTrue(all(len(batch) <= 50 for batch in stand_in.batches))
+
+    def test_adaptive_batch_size(self):
+        batch_size = bbl.AdaptiveBatchSize(size=10, maximum=12,
+                                           target_latency=1)
+        batch_size.success(0.5)
+        self.assertEqual(batch_size.size, 11)
+        for _ in range(3):
+            batch_size.success(0.5)
+        self.assertEqual(batch_size.size, 12)
+        batch_size.success(2)
+        self.assertEqual(batch_size.size, 6)
+        for _ in range(5):
+            batch_size.failure()
+        self.assertEqual(batch_size.size, 1)
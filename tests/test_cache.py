@@ -0,0 +1,164 @@
+"""
+Tests of the cache of the resolutions of citations and of the store of
+e-prints sources.
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from reference_fetcher import cache
+
+
+class Clock(object):
+    """
+    Stand-in for ``time.time``, only moving forward when told to.
+    """
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestResolutionCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(cache, "time", mock.Mock(time=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get(self):
+        resolutions = cache.ResolutionCache(":memory:")
+        self.assertIsNone(resolutions.get("A. Author, Title"))
+        resolutions.set("A.  Author, Title", "A. Author, Title",
+                        "http://dx.doi.org/10.1000/a")
+        resolutions.set("B. Author, Title", "B. Author, Title", None)
+        self.assertEqual(resolutions.get("a. author,   title"),
+                         ("A. Author, Title", "http://dx.doi.org/10.1000/a"))
+        self.assertEqual(resolutions.get("B. Author, Title"),
+                         ("B. Author, Title", None))
+        self.assertEqual(resolutions.stats(),
+                         {"hits": 2, "misses": 1, "entries": 2})
+
+    def test_get_many(self):
+        resolutions = cache.ResolutionCache(":memory:", negative_ttl=10)
+        commits = mock.Mock(wraps=resolutions._db)
+        resolutions._db = commits
+        resolutions.set_many([
+            ("A.  Author, Title", "A. Author, Title",
+             "http://dx.doi.org/10.1000/a"),
+            ("B. Author, Title", "B. Author, Title", None),
+        ])
+        self.assertEqual(commits.commit.call_count, 1)
+        self.clock.now += 11
+        self.assertEqual(
+            resolutions.get_many(["a. author,   title", "A. Author, Title",
+                                  "B. Author, Title", "C. Author, Title"]),
+            {"a. author,   title": ("A. Author, Title",
+                                    "http://dx.doi.org/10.1000/a"),
+             "A. Author, Title": ("A. Author, Title",
+                                  "http://dx.doi.org/10.1000/a")})
+        self.assertEqual(commits.commit.call_count, 2)
+        self.assertEqual(resolutions.stats(),
+                         {"hits": 2, "misses": 2, "entries": 2})
+
+    def test_ttl(self):
+        resolutions = cache.ResolutionCache(":memory:", ttl=100,
+                                            negative_ttl=10)
+        resolutions.set("A", "A", "http://dx.doi.org/10.1000/a")
+        resolutions.set("B", "B", None)
+        self.clock.now += 10
+        self.assertIsNotNone(resolutions.get("A"))
+        self.assertIsNotNone(resolutions.get("B"))
+        self.clock.now += 1
+        self.assertIsNotNone(resolutions.get("A"))
+        self.assertIsNone(resolutions.get("B"))
+        self.clock.now += 90
+        self.assertIsNone(resolutions.get("A"))
+
+    def test_purge(self):
+        resolutions = cache.ResolutionCache(":memory:", ttl=100,
+                                            negative_ttl=10,
+                                            purge_interval=50)
+        resolutions.set("A", "A", "http://dx.doi.org/10.1000/a")
+        resolutions.set("B", "B", None)
+        self.clock.now += 20
+        # Not purged before purge_interval
+        resolutions.set("C", "C", None)
+        self.assertEqual(resolutions.stats()["entries"], 3)
+        self.clock.now += 40
+        resolutions.set("D", "D", None)
+        # B and C expired
+        self.assertEqual(resolutions.stats()["entries"], 2)
+        self.assertIsNotNone(resolutions.get("A"))
+        self.assertIsNotNone(resolutions.get("D"))
+
+    def test_eviction(self):
+        resolutions = cache.ResolutionCache(":memory:", max_entries=2)
+        resolutions.set("A", "A", None)
+        self.clock.now += 1
+        resolutions.set("B", "B", None)
+        self.clock.now += 1
+        # A is now more recently used than B
+        self.assertIsNotNone(resolutions.get("A"))
+        self.clock.now += 1
+        resolutions.set("C", "C", None)
+        self.assertEqual(resolutions.stats()["entries"], 2)
+        self.assertIsNotNone(resolutions.get("A"))
+        self.assertIsNone(resolutions.get("B"))
+        self.assertIsNotNone(resolutions.get("C"))
+
+
+class TestSourcesCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(cache, "time", mock.Mock(time=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+
+    def stored_files(self):
+        return sorted(name
+                      for _, _, names in os.walk(self.path)
+                      for name in names if name.endswith(".bbl"))
+
+    def test_deduplication(self):
+        sources = cache.SourcesCache(self.path)
+        sources.set("1401.2910v1", ["a" * 10, "b" * 10])
+        sources.set("1401.2910v2", ["a" * 10])
+        self.assertEqual(sources.get("1401.2910v1"), ["a" * 10, "b" * 10])
+        self.assertEqual(sources.get("1401.2910v2"), ["a" * 10])
+        self.assertIsNone(sources.get("1401.2910v3"))
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(sources.stats(),
+                         {"hits": 2, "misses": 1, "size": 20})
+        # Files are removed once not used anymore
+        sources.set("1401.2910v1", ["c" * 10])
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(sources.stats()["size"], 20)
+
+    def test_eviction(self):
+        sources = cache.SourcesCache(self.path, max_size=25)
+        sources.set("0000.0001", ["a" * 10])
+        self.clock.now += 1
+        sources.set("0000.0002", ["b" * 10])
+        self.clock.now += 1
+        # 0000.0001 is now more recently used than 0000.0002
+        self.assertIsNotNone(sources.get("0000.0001"))
+        self.clock.now += 1
+        sources.set("0000.0003", ["c" * 10])
+        self.assertIsNotNone(sources.get("0000.0001"))
+        self.assertIsNone(sources.get("0000.0002"))
+        self.assertIsNotNone(sources.get("0000.0003"))
+        self.assertEqual(sources.stats()["size"], 20)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_offline(self):
+        sources = cache.SourcesCache(self.path, offline=True)
+        sources.set("0000.0001", ["a" * 10])
+        self.assertEqual(sources.fetch("0000.0001", None), ["a" * 10])
+        with self.assertRaises(cache.OfflineMiss):
+            sources.fetch("0000.0002", None)
@@ -0,0 +1,58 @@
+"""
+Tests of the conditional revalidation of the requests of the HTTP client.
+"""
+import unittest
+from unittest import mock
+
+from reference_fetcher import client
+
+
+class Response(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class TestRevalidation(unittest.TestCase):
+    def setUp(self):
+        self.client = client.HTTPClient()
+        self.addCleanup(self.client.session.close)
+        # Headers of the sent requests, and responses (or functions giving
+        # them) to answer
+        self.requests = []
+        self.responses = []
+        patcher = mock.patch.object(self.client, "request", self.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append(dict(headers))
+        response = self.responses.pop(0)
+        return response() if callable(response) else response
+
+    def get(self):
+        return self.client.get("http://example.com/", revalidate=True)
+
+    def test_not_modified(self):
+        first = Response(200, {"ETag": '"a"'})
+        self.responses = [first, Response(304)]
+        self.assertIs(self.get(), first)
+        self.assertIs(self.get(), first)
+        self.assertEqual(self.requests, [{}, {"If-None-Match": '"a"'}])
+
+    def test_evicted_while_revalidating(self):
+        first = Response(200, {"ETag": '"a"'})
+        second = Response(200, {"ETag": '"b"'})
+
+        def not_modified():
+            # Evicted by another thread meanwhile
+            self.client._revalidation.clear()
+            return Response(304)
+
+        self.responses = [first, not_modified, second, Response(304)]
+        self.assertIs(self.get(), first)
+        # Fetched again, as a miss
+        self.assertIs(self.get(), second)
+        self.assertIs(self.get(), second)
+        self.assertEqual(self.requests, [{}, {"If-None-Match": '"a"'}, {},
+                                         {"If-None-Match": '"b"'}])
@@ -0,0 +1,88 @@
+"""
+Tests of the maintenance of the numbers of relationships of the papers.
+"""
+import random
+import unittest
+
+from sqlalchemy.orm import Session
+
+import counts
+import database
+
+
+def read_counts(db):
+    """
+    Read the non zero counts.
+
+    :returns: A dict of tuples ``(paper_id, relationship_id)`` and tuples \
+            ``(in_count, out_count)``.
+    """
+    return {(row.paper_id, row.relationship_id): (row.in_count, row.out_count)
+            for row in db.query(database.RelationshipCount)
+            if row.in_count or row.out_count}
+
+
+class TestCounts(unittest.TestCase):
+    def test_recompute_matches_maintained_counts(self):
+        rng = random.Random(0)
+        engine = database.get_engine("sqlite://")
+        database.Base.metadata.create_all(engine)
+        db = Session(bind=engine)
+        self.addCleanup(db.close)
+        db.add_all(database.Relationship(id=id, name=name)
+                   for id, name in ((1, "cite"), (2, "similar")))
+        papers = list(range(1, 31))
+        db.add_all(database.Paper(id=id) for id in papers)
+        db.commit()
+
+        edges = set()
+        for _ in range(20):
+            # Add some relationships
+            added = set((rng.choice(papers), rng.choice(papers),
+                         rng.choice((1, 2)))
+                        for _ in range(15)) - edges
+            for left_id, right_id, relationship_id in added:
+                db.add(database.RelationshipAssociation(
+                    left_id=left_id, right_id=right_id,
+                    relationship_id=relationship_id))
+            for relationship_id in (1, 2):
+                counts.update(db, relationship_id,
+                              [(l, r) for l, r, i in added
+                               if i == relationship_id], 1)
+            edges |= added
+            # Remove some of them
+            removed = set(rng.sample(sorted(edges), 5))
+            for left_id, right_id, relationship_id in removed:
+                (db.query(database.RelationshipAssociation)
+                 .filter_by(left_id=left_id, right_id=right_id,
+                            relationship_id=relationship_id)
+                 .delete())
+            for relationship_id in (1, 2):
+                counts.update(db, relationship_id,
+                              [(l, r) for l, r, i in removed
+                               if i == relationship_id], -1)
+            edges -= removed
+            # And sometimes a paper
+            if rng.random() < 0.2:
+                paper_id = papers.pop(rng.randrange(len(papers)))
+                counts.remove_paper(db, paper_id)
+                db.query(database.Paper).filter_by(id=paper_id).delete()
+                edges = set(edge for edge in edges
+                            if paper_id not in edge[:2])
+            db.commit()
+
+        maintained = read_counts(db)
+        expected = {}
+        for left_id, right_id, relationship_id in edges:
+            in_count, out_count = expected.get((right_id, relationship_id),
+                                               (0, 0))
+            expected[(right_id, relationship_id)] = (in_count + 1, out_count)
+            in_count, out_count = expected.get((left_id, relationship_id),
+                                               (0, 0))
+            expected[(left_id, relationship_id)] = (in_count, out_count + 1)
+        self.assertEqual(maintained, expected)
+
+        with engine.begin() as connection:
+            counts.recompute(connection)
+        db.expire_all()
+        self.assertEqual(read_counts(db), maintained)
@@ -0,0 +1,55 @@
+"""
+Tests of the registry of the relationships names.
+"""
+import unittest
+
+from sqlalchemy.orm import sessionmaker
+
+import database
+from routes import post
+
+
+class TestRelationshipRegistry(unittest.TestCase):
+    def setUp(self):
+        engine = database.get_engine("sqlite://")
+        database.Base.metadata.create_all(engine)
+        self.create_session = sessionmaker(bind=engine)
+        self.registry = database.relationship_registry
+        self.registry.invalidate()
+        self.addCleanup(self.registry.invalidate)
+        db = self.create_session()
+        db.add(database.Relationship(id=1, name="cite"))
+        db.commit()
+        db.close()
+
+    def test_created_on_commit(self):
+        reader = self.create_session()
+        self.addCleanup(reader.close)
+        self.assertEqual(self.registry.names(reader), ["cite"])
+        writer = self.create_session()
+        self.addCleanup(writer.close)
+        post.get_or_create_relationship("similar", writer)
+        # Not committed yet
+        self.assertEqual(self.registry.names(reader), ["cite"])
+        writer.commit()
+        self.assertEqual(self.registry.names(reader), ["cite", "similar"])
+
+    def test_created_and_rolled_back(self):
+        db = self.create_session()
+        self.addCleanup(db.close)
+        post.get_or_create_relationship("similar", db)
+        db.rollback()
+        self.assertEqual(self.registry.names(db), ["cite"])
+        self.assertNotIn("relationships_created", db.info)
+
+    def test_created_by_another_process(self):
+        db = self.create_session()
+        self.addCleanup(db.close)
+        self.assertEqual(self.registry.names(db), ["cite"])
+        # Not recorded, as from another process
+        db.add(database.Relationship(id=2, name="similar"))
+        db.commit()
+        self.assertEqual(self.registry.names(db), ["cite"])
+        self.assertEqual(self.registry.id("similar", db), 2)
+        self.assertEqual(self.registry.names(db), ["cite", "similar"])
+        self.assertIsNone(self.registry.id("unknown", db))
@@ -0,0 +1,33 @@
+"""
+Tests of the single pass scan of citations for DOIs and arXiv ids, against
+the regex cascade of ``match_doi_or_arxiv``.
+"""
+import unittest
+
+from reference_fetcher import doi
+
+
+class TestScanDoiOrArxiv(unittest.TestCase):
+    def test_same_as_cascade(self):
+        cases = [
+            ("Journal, doi:10.1103/PhysRevE.58.5355 (1998)",
+             ("DOI", "10.1103/physreve.58.5355")),
+            # DOIs take priority over arXiv ids, wherever they are
+            ("arXiv:1401.2910, doi:10.1000/12345",
+             ("DOI", "10.1000/12345")),
+            ("arXiv:doi/10.1000/12345", ("DOI", "10.1000/12345")),
+            ("doi 10.1073pnas.0401234101", ("DOI", "10.1073/pnas.0401234101")),
+            ("arXiv:1401.2910, 10.1083/jcb.200709012extra",
+             ("DOI", "10.1083/jcb.200709012")),
+            ("ArXiv: hep-th/9711200", ("arXiv", "hep-th/9711200")),
+            ("Landau L. D. J. Phys. USSR 11 1947 91", None),
+            # Matched on a rewritten text by the cascade
+            ("doi:10.1000/abc&#338;def123", ("DOI", "10.1000/abc-def123")),
+            # Case-insensitive matches of the cascade
+            ("arxıv:1401.2910", ("arXiv", "1401.2910")),
+            ("doı:10.1000/12345", ("DOI", "10.1000/12345")),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(doi.match_doi_or_arxiv(text), expected)
+                self.assertEqual(doi.scan_doi_or_arxiv(text), expected)
@@ -0,0 +1,53 @@
+"""
+Tests of the bulk mode of fetch_references.py.
+"""
+import os
+import tempfile
+import unittest
+
+import fetch_references
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+
+    def touch(self, name):
+        path = os.path.join(self.path, name)
+        with open(path, "w") as fh:
+            fh.write("")
+        return path
+
+    def test_tasks_directory(self):
+        for name in ("1401.0001.bbl", "1401.0002.tar.gz", "1401.0003.gz",
+                     "1401.0004"):
+            self.touch(name)
+        os.mkdir(os.path.join(self.path, "subdirectory"))
+        self.assertEqual(list(fetch_references.bulk_tasks(self.path)), [
+            ("1401.0001", "bbl", os.path.join(self.path, "1401.0001.bbl")),
+            ("1401.0002", "sources",
+             os.path.join(self.path, "1401.0002.tar.gz")),
+            ("1401.0003", "sources",
+             os.path.join(self.path, "1401.0003.gz")),
+            ("1401.0004", "sources", os.path.join(self.path, "1401.0004")),
+        ])
+
+    def test_tasks_file(self):
+        path = os.path.join(self.path, "eprints.txt")
+        with open(path, "w") as fh:
+            fh.write("# Some papers\n1401.2910v2\n\n  1401.0001 \n")
+        self.assertEqual(list(fetch_references.bulk_tasks(path)), [
+            ("1401.2910v2", "arxiv", None),
+            ("1401.0001", "arxiv", None),
+        ])
+
+    def test_process_error(self):
+        path = os.path.join(self.path, "missing.tar.gz")
+        eprint, records = fetch_references.bulk_process(
+            ("missing", "sources", path))
+        self.assertEqual(eprint, "missing")
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["eprint"], "missing")
+        self.assertIn("FileNotFoundError", records[0]["error"])
@@ -0,0 +1,131 @@
+"""
+Tests of the in-memory graph of the relationships between papers.
+"""
+import array
+import random
+import unittest
+from unittest import mock
+
+from sqlalchemy.orm import Session
+
+import database
+import graph
+
+
+def create_database(edges):
+    """
+    Create an in-memory database with the given ``cite`` relationships.
+
+    :param edges: A list of tuples ``(left_id, right_id)``.
+    :returns: Its ``Engine``.
+    """
+    engine = database.get_engine("sqlite://")
+    database.Base.metadata.create_all(engine)
+    with Session(bind=engine) as db:
+        db.add(database.Relationship(id=1, name="cite"))
+        ids = set(id for edge in edges for id in edge)
+        db.add_all(database.Paper(id=id) for id in sorted(ids))
+        db.add_all(database.RelationshipAssociation(left_id=left_id,
+                                                    right_id=right_id,
+                                                    relationship_id=1)
+                   for left_id, right_id in edges)
+        db.commit()
+    return engine
+
+
+def adjacency(edges):
+    """
+    Build an ``Adjacency`` of some edges.
+    """
+    return graph.Adjacency(array.array("i", [edge[0] for edge in edges]),
+                           array.array("i", [edge[1] for edge in edges]))
+
+
+class CommittingGraph(graph.CitationGraph):
+    """
+    Graph whose relationships get some changes committed while they are
+    being read.
+    """
+    def __init__(self, changes):
+        super().__init__()
+        self.changes = changes
+
+    def _read(self, name, bind):
+        adjacencies = super()._read(name, bind)
+        self.apply(self.changes)
+        return adjacencies
+
+
+class TestAdjacency(unittest.TestCase):
+    def test_successors(self):
+        edges = adjacency([(3, 1), (1, 2), (1, 4), (3, 2)])
+        self.assertEqual(sorted(edges.successors(1)), [2, 4])
+        self.assertEqual(edges.successors(2), [])
+        self.assertEqual(sorted(edges.successors(3)), [1, 2])
+        # Past the CSR arrays
+        self.assertEqual(edges.successors(10), [])
+        self.assertEqual(adjacency([]).successors(0), [])
+
+    def test_add_remove(self):
+        edges = adjacency([(1, 2), (1, 3)])
+        edges.add(1, 4)
+        edges.add(1, 2)
+        edges.add(7, 1)
+        edges.remove(1, 3)
+        edges.remove(1, 5)
+        self.assertEqual(sorted(edges.successors(1)), [2, 4])
+        self.assertEqual(edges.successors(7), [1])
+        self.assertEqual(sorted(edges.edges()), [(1, 2), (1, 4), (7, 1)])
+        # Back to the CSR arrays
+        edges.add(1, 3)
+        edges.remove(1, 4)
+        edges.remove(7, 1)
+        self.assertEqual(sorted(edges.successors(1)), [2, 3])
+        self.assertEqual(edges._delta, 0)
+
+    def test_compact(self):
+        rng = random.Random(0)
+        expected = set((rng.randrange(20), rng.randrange(20))
+                       for _ in range(50))
+        edges = adjacency(sorted(expected))
+        with mock.patch.object(graph, "COMPACTION_THRESHOLD", 5):
+            for _ in range(200):
+                edge = (rng.randrange(25), rng.randrange(25))
+                if rng.random() < 0.5:
+                    edges.add(*edge)
+                    expected.add(edge)
+                else:
+                    edges.remove(*edge)
+                    expected.discard(edge)
+                self.assertLess(edges._delta, 5)
+                self.assertEqual(sorted(edges.edges()), sorted(expected))
+        for source in range(25):
+            self.assertEqual(
+                sorted(edges.successors(source)),
+                sorted(target for s, target in expected if s == source))
+
+
+class TestCitationGraph(unittest.TestCase):
+    def test_load(self):
+        engine = create_database([(1, 2), (1, 3), (2, 3)])
+        citation_graph = graph.CitationGraph()
+        self.assertTrue(citation_graph.load("cite", engine))
+        self.assertFalse(citation_graph.load("unknown", engine))
+        self.assertEqual(sorted(citation_graph.successors("cite", 1)), [2, 3])
+        self.assertEqual(
+            sorted(citation_graph.successors("cite", 3, reverse=True)),
+            [1, 2])
+
+    def test_changes_during_load(self):
+        engine = create_database([(1, 2), (1, 3), (2, 3)])
+        citation_graph = CommittingGraph([
+            ("added", "cite", [(3, 4)]),
+            ("removed", "cite", [(1, 2)]),
+            ("deleted_papers", None, [2]),
+        ])
+        self.assertTrue(citation_graph.load("cite", engine))
+        self.assertEqual(citation_graph.successors("cite", 1), [3])
+        self.assertEqual(citation_graph.successors("cite", 2), [])
+        self.assertEqual(citation_graph.successors("cite", 3), [4])
+        self.assertEqual(
+            sorted(citation_graph.successors("cite", 3, reverse=True)), [1])
@@ -0,0 +1,56 @@
+"""
+Tests of the local identifier index.
+"""
+import unittest
+
+from reference_fetcher import index
+
+
+RECORDS = [
+    {"doi": "10.1103/PhysRevE.58.5355",
+     "title": "Quantum annealing in the transverse Ising model",
+     "authors": ["Tadashi Kadowaki", "Hidetoshi Nishimori"],
+     "year": "1998", "journal": "Physical Review E"},
+    {"arxiv_id": "1401.2910v2",
+     "title": "Defining and detecting quantum speedup",
+     "authors": ["T. F. Rønnow", "M. Troyer"],
+     "year": "2014", "journal": "Science"},
+    # Not indexed, without any identifier
+    {"title": "Quantum annealing", "authors": ["A. Author"]},
+]
+
+
+class TestIdentifierIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = index.IdentifierIndex(":memory:")
+        self.assertEqual(self.index.add(RECORDS), 2)
+
+    def test_lookup(self):
+        self.assertEqual(
+            self.index.lookup("T. Kadowaki and H. Nishimori, Quantum "
+                              "annealing in the transverse Ising model, "
+                              "Phys. Rev. E 58, 5355 (1998)."),
+            "http://dx.doi.org/10.1103/physreve.58.5355")
+        self.assertEqual(
+            self.index.lookup("T. F. Ronnow, M. Troyer, Defining and "
+                              "detecting quantum speedup, Science (2014)"),
+            "http://arxiv.org/abs/1401.2910")
+        self.assertIsNone(
+            self.index.lookup("A. Other, Quantum chemistry of molecules, "
+                              "J. Chem. (2001)"))
+        self.assertEqual(self.index.stats(), {"matches": 2,
+                                              "low_confidence": 1,
+                                              "records": 2})
+
+    def test_upsert(self):
+        # Same paper, now with a DOI
+        self.assertEqual(self.index.add([{
+            "doi": "10.1126/science.1252319", "arxiv_id": "1401.2910",
+            "title": "Defining and detecting quantum speedup",
+            "authors": ["T. F. Rønnow", "M. Troyer"],
+            "year": "2014", "journal": "Science"}]), 1)
+        self.assertEqual(
+            self.index.lookup("T. F. Ronnow, M. Troyer, Defining and "
+                              "detecting quantum speedup, Science (2014)"),
+            "http://dx.doi.org/10.1126/science.1252319")
+        self.assertEqual(self.index.stats()["records"], 2)
@@ -0,0 +1,118 @@
+"""
+Tests of the upgrade of a database created before the current schema.
+"""
+import unittest
+
+from sqlalchemy import exc, inspect, text
+
+import database
+import migrate
+
+
+# Schema of the database before the upgrades (SQLite)
+BASELINE_SCHEMA = [
+    "CREATE TABLE papers ("
+    "id INTEGER NOT NULL, doi VARCHAR, arxiv_id VARCHAR(30), "
+    "PRIMARY KEY (id), UNIQUE (doi), UNIQUE (arxiv_id))",
+    "CREATE TABLE relationships ("
+    "id INTEGER NOT NULL, name VARCHAR, PRIMARY KEY (id), UNIQUE (name))",
+    "CREATE TABLE tags ("
+    "id INTEGER NOT NULL, name VARCHAR, PRIMARY KEY (id), UNIQUE (name))",
+    "CREATE TABLE citationprocessingqueue ("
+    "id INTEGER NOT NULL, paper_id INTEGER, PRIMARY KEY (id), "
+    "UNIQUE (paper_id), "
+    "FOREIGN KEY(paper_id) REFERENCES papers (id) ON DELETE CASCADE)",
+    "CREATE TABLE relationship_association ("
+    "id INTEGER NOT NULL, left_id INTEGER, right_id INTEGER, "
+    "relationship_id INTEGER, PRIMARY KEY (id), "
+    "FOREIGN KEY(left_id) REFERENCES papers (id) ON DELETE CASCADE, "
+    "FOREIGN KEY(right_id) REFERENCES papers (id) ON DELETE CASCADE, "
+    "FOREIGN KEY(relationship_id) REFERENCES relationships (id) "
+    "ON DELETE CASCADE)",
+    "CREATE TABLE tag_association ("
+    "paper_id INTEGER, tag_id INTEGER, "
+    "FOREIGN KEY(paper_id) REFERENCES papers (id) ON DELETE CASCADE, "
+    "FOREIGN KEY(tag_id) REFERENCES tags (id) ON DELETE CASCADE)",
+]
+
+BASELINE_DATA = [
+    "INSERT INTO papers (id, doi, arxiv_id) VALUES "
+    "(1, '10.1000/a', NULL), (2, NULL, '1401.2910'), (3, '10.1000/c', NULL)",
+    "INSERT INTO relationships (id, name) VALUES (1, 'cite')",
+    "INSERT INTO tags (id, name) VALUES (1, 'physics')",
+    # Duplicate relationships and tags
+    "INSERT INTO relationship_association "
+    "(id, left_id, right_id, relationship_id) VALUES "
+    "(1, 1, 2, 1), (2, 1, 3, 1), (3, 1, 2, 1), (4, 2, 3, 1)",
+    "INSERT INTO tag_association (paper_id, tag_id) VALUES "
+    "(1, 1), (1, 1), (2, 1)",
+]
+
+
+class TestUpgrade(unittest.TestCase):
+    def setUp(self):
+        self.engine = database.get_engine("sqlite://")
+        with self.engine.begin() as connection:
+            for statement in BASELINE_SCHEMA + BASELINE_DATA:
+                connection.execute(text(statement))
+
+    def test_upgrade(self):
+        added, removed = migrate.upgrade(self.engine)
+        self.assertEqual(added, ["oa_url", "extracted_version", "imported"])
+        self.assertEqual(removed, {"relationship_association": 1,
+                                   "tag_association": 1})
+        with self.engine.connect() as connection:
+            self.assertEqual(
+                connection.execute(text(
+                    "SELECT id, oa_url, extracted_version, imported "
+                    "FROM papers ORDER BY id")).fetchall(),
+                [(1, None, None, 0), (2, None, None, 0), (3, None, None, 0)])
+            self.assertEqual(
+                connection.execute(text(
+                    "SELECT left_id, right_id FROM relationship_association "
+                    "ORDER BY id")).fetchall(),
+                [(1, 2), (1, 3), (2, 3)])
+            self.assertEqual(
+                connection.execute(text(
+                    "SELECT paper_id, tag_id FROM tag_association "
+                    "ORDER BY paper_id")).fetchall(),
+                [(1, 1), (2, 1)])
+            self.assertEqual(
+                connection.execute(text(
+                    "SELECT paper_id, in_count, out_count "
+                    "FROM relationship_counts ORDER BY paper_id")).fetchall(),
+                [(1, 0, 2), (2, 1, 1), (3, 2, 0)])
+        inspector = inspect(self.engine)
+        for table in (database.RelationshipAssociation.__table__,
+                      database.tag_association_table):
+            indexes = set(index["name"]
+                          for index in inspector.get_indexes(table.name))
+            self.assertTrue(
+                set(index.name for index in table.indexes) <= indexes)
+        for table in database.Base.metadata.tables:
+            self.assertTrue(inspector.has_table(table))
+
+    def test_upgrade_after_start(self):
+        # The API creates the missing tables on start
+        database.Base.metadata.create_all(self.engine)
+        migrate.upgrade(self.engine)
+        with self.engine.connect() as connection:
+            self.assertEqual(
+                connection.execute(text(
+                    "SELECT paper_id, in_count, out_count "
+                    "FROM relationship_counts ORDER BY paper_id")).fetchall(),
+                [(1, 0, 2), (2, 1, 1), (3, 2, 0)])
+
+    def test_upgrade_twice(self):
+        migrate.upgrade(self.engine)
+        self.assertEqual(migrate.upgrade(self.engine),
+                         ([], {"relationship_association": 0,
+                               "tag_association": 0}))
+
+    def test_unique_after_upgrade(self):
+        migrate.upgrade(self.engine)
+        with self.engine.connect() as connection:
+            with self.assertRaises(exc.IntegrityError):
+                connection.execute(text(
+                    "INSERT INTO relationship_association "
+                    "(left_id, right_id, relationship_id) VALUES (1, 2, 1)"))
@@ -0,0 +1,132 @@
+"""
+Tests of the batch computation of the PageRank of the papers.
+"""
+import random
+import unittest
+
+import numpy
+
+import database
+import pagerank
+
+
+def brute_force_pagerank(ids, edges, damping, iterations=1000):
+    """
+    Compute the PageRank with a dense power iteration, one paper at a time.
+
+    :param ids: A list of the papers ids.
+    :param edges: A list of tuples ``(source, target)``.
+    :returns: A dict of papers ids and their scores.
+    """
+    successors = {id: [] for id in ids}
+    for source, target in edges:
+        successors[source].append(target)
+    scores = {id: 1 / len(ids) for id in ids}
+    for _ in range(iterations):
+        dangling = sum(scores[id] for id in ids if not successors[id])
+        new_scores = {id: (1 - damping + damping * dangling) / len(ids)
+                      for id in ids}
+        for id in ids:
+            for target in successors[id]:
+                new_scores[target] += (damping * scores[id] /
+                                       len(successors[id]))
+        scores = new_scores
+    return scores
+
+
+class TestPageRank(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        # Ids 0 and 7 are not papers
+        self.ids = [id for id in range(1, 40) if id != 7]
+        self.edges = sorted(set(
+            (rng.choice(self.ids), rng.choice(self.ids))
+            for _ in range(120)))
+        self.exists = numpy.zeros(40, dtype=bool)
+        self.exists[self.ids] = True
+        self.sources = numpy.array([edge[0] for edge in self.edges],
+                                   dtype=numpy.int32)
+        self.targets = numpy.array([edge[1] for edge in self.edges],
+                                   dtype=numpy.int32)
+        self.expected = brute_force_pagerank(self.ids, self.edges,
+                                             pagerank.DAMPING)
+
+    def assertScores(self, scores):
+        self.assertAlmostEqual(scores.sum(), 1.0)
+        self.assertEqual(scores[0], 0.0)
+        self.assertEqual(scores[7], 0.0)
+        for id in self.ids:
+            self.assertAlmostEqual(scores[id], self.expected[id], places=9)
+
+    def test_pagerank(self):
+        scores, iterations, delta = pagerank.pagerank(
+            self.exists, self.sources, self.targets, tolerance=1e-12,
+            chunk_size=7)
+        self.assertLess(delta, 1e-12)
+        self.assertScores(scores)
+
+    def test_initial_scores(self):
+        scores, iterations, _ = pagerank.pagerank(
+            self.exists, self.sources, self.targets, tolerance=1e-12)
+        # Start from the previous scores, with a new paper
+        initial = scores.copy()
+        initial[self.ids[-1]] = 0
+        restarted, restarted_iterations, _ = pagerank.pagerank(
+            self.exists, self.sources, self.targets, initial=initial,
+            tolerance=1e-12)
+        self.assertScores(restarted)
+        self.assertLess(restarted_iterations, iterations)
+
+    def test_no_papers(self):
+        scores, iterations, delta = pagerank.pagerank(
+            numpy.zeros(3, dtype=bool), numpy.array([], dtype=numpy.int32),
+            numpy.array([], dtype=numpy.int32))
+        self.assertEqual(scores.tolist(), [0.0, 0.0, 0.0])
+        self.assertEqual(iterations, 0)
+
+
+class TestUpdateRanks(unittest.TestCase):
+    def setUp(self):
+        self.engine = database.get_engine("sqlite://")
+        database.Base.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(database.Relationship.__table__.insert(),
+                               [{"id": 1, "name": "cite"}])
+            connection.execute(database.Paper.__table__.insert(),
+                               [{"id": id} for id in (1, 2, 3, 4)])
+            connection.execute(
+                database.RelationshipAssociation.__table__.insert(),
+                [{"left_id": left_id, "right_id": right_id,
+                  "relationship_id": 1}
+                 for left_id, right_id in ((1, 2), (1, 3), (2, 3), (3, 4))])
+
+    def test_missing_papers(self):
+        # Edges to a paper missing from the loaded papers, as with a paper
+        # committed after the papers were loaded with a lower id
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.execute(database.Paper.__table__.delete()
+                               .where(database.Paper.id == 3))
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+        with self.engine.connect() as connection:
+            exists, sources, targets = pagerank.load_graph(connection)
+        self.assertEqual(list(zip(sources.tolist(), targets.tolist())),
+                         [(1, 2)])
+        scores, _, _ = pagerank.pagerank(exists, sources, targets,
+                                         tolerance=1e-12)
+        self.assertAlmostEqual(scores.sum(), 1.0)
+        expected = brute_force_pagerank([1, 2, 4], [(1, 2)],
+                                        pagerank.DAMPING)
+        for id in (1, 2, 4):
+            self.assertAlmostEqual(scores[id], expected[id], places=9)
+
+    def test_stored_scores(self):
+        self.assertEqual(pagerank.update_ranks(self.engine)[0], 4)
+        with self.engine.connect() as connection:
+            exists, _, _ = pagerank.load_graph(connection)
+        with self.engine.begin() as connection:
+            connection.execute(database.Paper.__table__.delete()
+                               .where(database.Paper.id.in_([3, 4])))
+        # Deleted since they were loaded
+        self.assertEqual(
+            pagerank.store_scores(self.engine, exists, numpy.ones(5) / 4), 2)
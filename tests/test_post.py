@@ -0,0 +1,191 @@
+"""
+Tests of the bulk ingestion of the cited papers of a paper, and of their
+update on new arXiv versions.
+"""
+import unittest
+from unittest import mock
+
+from sqlalchemy.orm import Session, sessionmaker
+
+import database
+from routes import post
+
+
+# Identifiers known by arXiv API
+ARXIV_IDS = {"10.1000/d": "1401.0001"}
+DOIS = {"1401.0001": "10.1000/D"}
+
+
+class TestAddCitedUrls(unittest.TestCase):
+    def setUp(self):
+        engine = database.get_engine("sqlite://")
+        database.Base.metadata.create_all(engine)
+        self.db = Session(bind=engine)
+        self.addCleanup(self.db.close)
+        self.paper = database.Paper(doi="10.1000/a")
+        self.db.add_all([
+            self.paper,
+            database.Paper(doi="10.1000/b"),
+            database.Paper(doi="10.1000/c", imported=True),
+        ])
+        self.db.commit()
+        for name, known in (("get_arxiv_eprint_from_doi_batch", ARXIV_IDS),
+                            ("get_doi_batch", DOIS)):
+            patcher = mock.patch.object(
+                post.arxiv, name,
+                lambda identifiers, known=known: {
+                    i: known.get(i) for i in identifiers})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def cited(self):
+        return set(
+            (paper.doi, paper.arxiv_id)
+            for paper in self.db.query(database.Paper)
+            .join(database.RelationshipAssociation,
+                  database.RelationshipAssociation.right_id ==
+                  database.Paper.id)
+            .filter(database.RelationshipAssociation.left_id ==
+                    self.paper.id))
+
+    def test_add_cited_urls(self):
+        post.add_cited_urls(self.paper, [
+            "http://dx.doi.org/10.1000/b",
+            "http://dx.doi.org/10.1000/c",
+            "http://dx.doi.org/10.1000/d",
+            # Same paper as 10.1000/d
+            "http://arxiv.org/abs/1401.0001",
+            "http://arxiv.org/abs/1401.0002",
+            "http://dx.doi.org/10.1000/b",
+            "http://example.com/",
+        ], self.db)
+        self.db.commit()
+        self.assertEqual(self.cited(), {
+            ("10.1000/b", None),
+            ("10.1000/c", None),
+            ("10.1000/d", "1401.0001"),
+            (None, "1401.0002"),
+        })
+        self.assertEqual(self.db.query(database.Paper).count(), 5)
+        # The new and imported papers are queued
+        queued = set(
+            (paper.doi, paper.arxiv_id)
+            for paper in self.db.query(database.Paper)
+            .join(database.CitationProcessingQueue,
+                  database.CitationProcessingQueue.paper_id ==
+                  database.Paper.id))
+        self.assertEqual(queued, {
+            ("10.1000/c", None),
+            ("10.1000/d", "1401.0001"),
+            (None, "1401.0002"),
+        })
+        self.assertFalse(
+            self.db.query(database.Paper).filter_by(doi="10.1000/c")
+            .one().imported)
+        count = (self.db.query(database.RelationshipCount)
+                 .filter_by(paper_id=self.paper.id).one())
+        self.assertEqual((count.in_count, count.out_count), (0, 4))
+
+    def test_add_cited_urls_twice(self):
+        cited_urls = ["http://dx.doi.org/10.1000/b",
+                      "http://arxiv.org/abs/1401.0002"]
+        post.add_cited_urls(self.paper, cited_urls, self.db)
+        self.db.commit()
+        post.add_cited_urls(self.paper, cited_urls, self.db)
+        self.db.commit()
+        self.assertEqual(self.cited(), {("10.1000/b", None),
+                                        (None, "1401.0002")})
+        count = (self.db.query(database.RelationshipCount)
+                 .filter_by(paper_id=self.paper.id).one())
+        self.assertEqual((count.in_count, count.out_count), (0, 2))
+
+
+class TestAddCiteRelationship(unittest.TestCase):
+    def setUp(self):
+        engine = database.get_engine("sqlite://")
+        database.Base.metadata.create_all(engine)
+        self.db = Session(bind=engine)
+        self.addCleanup(self.db.close)
+        self.paper = database.Paper(arxiv_id="1401.9999",
+                                    extracted_version="1401.9999v1")
+        self.cited = database.Paper(doi="10.1000/d", arxiv_id="1401.0001")
+        self.removed = database.Paper(doi="10.1000/e")
+        self.db.add_all([self.paper, self.cited, self.removed])
+        self.db.flush()
+        # Extracted from the first version
+        post.add_cited_urls(self.paper, ["http://arxiv.org/abs/1401.0001",
+                                         "http://dx.doi.org/10.1000/e"],
+                            self.db)
+        self.db.add_all([
+            database.ExtractedCitation(
+                paper_id=self.paper.id, raw_citation="D", citation="D",
+                url="http://arxiv.org/abs/1401.0001"),
+            database.ExtractedCitation(
+                paper_id=self.paper.id, raw_citation="E", citation="E",
+                url="http://dx.doi.org/10.1000/e"),
+        ])
+        self.db.commit()
+
+    def test_new_version(self):
+        # The second version cites the same paper with its DOI
+        resolutions = [("D.", "D.", "http://dx.doi.org/10.1000/d", "crossref")]
+        with mock.patch.object(post.arxiv, "get_latest_version",
+                               lambda eprint: "1401.9999v2"), \
+                mock.patch.object(post.arxiv, "get_cited_resolutions",
+                                  lambda eprint, **kwargs: resolutions):
+            post.add_cite_relationship(self.paper, self.db)
+        self.db.commit()
+        self.assertEqual(
+            [right_id for right_id, in
+             self.db.query(database.RelationshipAssociation.right_id)
+             .filter_by(left_id=self.paper.id)],
+            [self.cited.id])
+        count = (self.db.query(database.RelationshipCount)
+                 .filter_by(paper_id=self.paper.id).one())
+        self.assertEqual(count.out_count, 1)
+        self.assertEqual(self.paper.extracted_version, "1401.9999v2")
+
+
+class TestQueueNewVersions(unittest.TestCase):
+    def test_queue_new_versions(self):
+        engine = database.get_engine("sqlite://")
+        database.Base.metadata.create_all(engine)
+        create_session = sessionmaker(bind=engine)
+        db = create_session()
+        self.addCleanup(db.close)
+        db.add_all([
+            # Up to date
+            database.Paper(id=1, arxiv_id="1401.0001",
+                           extracted_version="1401.0001v2"),
+            # New version
+            database.Paper(id=2, arxiv_id="1401.0002v1",
+                           extracted_version="1401.0002v1"),
+            # Extracted once from the unversioned id
+            database.Paper(id=3, arxiv_id="1401.0003",
+                           extracted_version="1401.0003"),
+            # Not extracted yet, or not on arXiv
+            database.Paper(id=4, arxiv_id="1401.0004"),
+            database.Paper(id=5, doi="10.1000/e"),
+            # Not found on arXiv
+            database.Paper(id=6, arxiv_id="1401.0006",
+                           extracted_version="1401.0006v1"),
+        ])
+        db.commit()
+        latest = {"1401.0001": "1401.0001v2", "1401.0002": "1401.0002v3",
+                  "1401.0003": "1401.0003v1", "1401.0004": "1401.0004v1"}
+        lookups = []
+
+        def get_latest_versions(eprints):
+            lookups.append(sorted(eprints))
+            return {eprint: latest.get(eprint) for eprint in eprints}
+
+        with mock.patch.object(post.arxiv, "get_latest_versions",
+                               get_latest_versions):
+            self.assertEqual(
+                post.queue_new_versions(create_session, batch_size=2), 2)
+        self.assertEqual(lookups, [["1401.0001", "1401.0002"],
+                                   ["1401.0003", "1401.0006"]])
+        self.assertEqual(
+            sorted(paper_id for paper_id, in
+                   db.query(database.CitationProcessingQueue.paper_id)),
+            [2, 3])
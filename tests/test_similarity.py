@@ -0,0 +1,128 @@
+"""
+Tests of the batch computation of the most similar papers.
+"""
+import math
+import random
+import unittest
+
+import numpy
+from sqlalchemy.orm import Session
+
+import database
+import similarity
+
+
+def brute_force_similar(ids, edges, top_k):
+    """
+    Compute the most similar papers by comparing every pair of papers.
+
+    :param ids: A list of the papers ids.
+    :param edges: A list of tuples ``(source, target)``.
+    :returns: A dict of papers ids and the list of tuples ``(similar_id, \
+            score, cocitations, couplings)`` of their most similar papers.
+    """
+    cited = {id: set() for id in ids}
+    citing = {id: set() for id in ids}
+    for source, target in edges:
+        cited[source].add(target)
+        citing[target].add(source)
+    similar = {}
+    for id in ids:
+        candidates = []
+        for other in ids:
+            if other == id:
+                continue
+            cocitations = len(citing[id] & citing[other])
+            couplings = len(cited[id] & cited[other])
+            score = 0.0
+            if cocitations:
+                score += similarity.COCITATION_WEIGHT * (
+                    cocitations /
+                    math.sqrt(len(citing[id]) * len(citing[other])))
+            if couplings:
+                score += similarity.COUPLING_WEIGHT * (
+                    couplings /
+                    math.sqrt(len(cited[id]) * len(cited[other])))
+            if score > 0:
+                candidates.append((other, score, cocitations, couplings))
+        candidates.sort(key=lambda candidate: (-candidate[1], candidate[0]))
+        if candidates:
+            similar[id] = candidates[:top_k]
+    return similar
+
+
+def random_graph(seed):
+    """
+    Generate a random graph of citations, with gaps in the papers ids.
+
+    :returns: A tuple ``(ids, edges)``.
+    """
+    rng = random.Random(seed)
+    ids = [id for id in range(1, 50) if id % 9 != 0]
+    edges = sorted(set((rng.choice(ids), rng.choice(ids))
+                       for _ in range(200)))
+    edges = [(source, target) for source, target in edges
+             if source != target]
+    return (ids, edges)
+
+
+class TestSimilarPapers(unittest.TestCase):
+    def assertSimilar(self, result, expected):
+        self.assertEqual(sorted(result), sorted(expected))
+        for id, similar in expected.items():
+            self.assertEqual([(i[0], i[2], i[3]) for i in result[id]],
+                             [(i[0], i[2], i[3]) for i in similar])
+            for (_, score, _, _), (_, expected_score, _, _) in zip(
+                    result[id], similar):
+                self.assertAlmostEqual(score, expected_score)
+
+    def test_similar_papers(self):
+        ids, edges = random_graph(0)
+        top_k = 5
+        size = max(ids) + 1
+        sources = numpy.array([edge[0] for edge in edges], dtype=numpy.int64)
+        targets = numpy.array([edge[1] for edge in edges], dtype=numpy.int64)
+        forward = similarity._csr(sources, targets, size)
+        backward = similarity._csr(targets, sources, size)
+        out_degrees = numpy.diff(forward[0])
+        in_degrees = numpy.diff(backward[0])
+        costs = (numpy.bincount(targets, weights=out_degrees[sources],
+                                minlength=size) +
+                 numpy.bincount(sources, weights=in_degrees[targets],
+                                minlength=size))
+        result = {}
+        blocks = list(similarity._blocks(numpy.array(ids), costs,
+                                         max_pairs=50))
+        self.assertGreater(len(blocks), 1)
+        for block in blocks:
+            columns = similarity.similar_papers(
+                block, forward, backward, in_degrees, out_degrees, size,
+                top_k=top_k)
+            for row in zip(*[column.tolist() for column in columns]):
+                similar = result.setdefault(row[0], [])
+                self.assertEqual(row[1], len(similar))
+                similar.append(row[2:])
+        self.assertSimilar(result, brute_force_similar(ids, edges, top_k))
+
+    def test_update_similar(self):
+        ids, edges = random_graph(1)
+        engine = database.get_engine("sqlite://")
+        database.Base.metadata.create_all(engine)
+        db = Session(bind=engine)
+        self.addCleanup(db.close)
+        db.add(database.Relationship(id=1, name="cite"))
+        db.add_all(database.Paper(id=id) for id in ids)
+        db.add_all(database.RelationshipAssociation(left_id=left_id,
+                                                    right_id=right_id,
+                                                    relationship_id=1)
+                   for left_id, right_id in edges)
+        db.commit()
+
+        similarity.update_similar(engine, full=True, top_k=3)
+        result = {}
+        for row in (db.query(database.SimilarPaper)
+                    .order_by(database.SimilarPaper.paper_id,
+                              database.SimilarPaper.position)):
+            result.setdefault(row.paper_id, []).append(
+                (row.similar_id, row.score, row.cocitations, row.couplings))
+        self.assertSimilar(result, brute_force_similar(ids, edges, 3))
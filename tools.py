@@ -39,6 +39,32 @@ def get_identifier_from_url(url):
     return (type, identifier)
 
 
+def stream_json(data, key, items, chunk_size=1000):
+    """
+    Stream a JSON document with a (possibly long) list, without building it in
+    memory.
+
+    :param data: A dict of the other items of the JSON document.
+    :param key: The key of the streamed list in the JSON document.
+    :param items: An iterable of the JSON-serializable items of the list.
+    :param chunk_size: Number of items in each chunk of the stream.
+    :returns: A generator of the chunks of the JSON-formatted string.
+    """
+    placeholder = "__streamed__"
+    head, tail = pretty_json(dict(data, **{key: placeholder})).split(
+        json.dumps(placeholder), 1)
+    chunk = [head + "["]
+    separator = "\n"
+    for item in items:
+        chunk.append(separator + json.dumps(item, sort_keys=True))
+        separator = ",\n"
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    chunk.append("\n]" + tail)
+    yield "".join(chunk)
+
+
 class APIResponse(bottle.HTTPResponse):
     """
     Extend bottle.HTTPResponse base class to add Content-Type header.